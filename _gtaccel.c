@@ -0,0 +1,276 @@
+/*
+ * Optional C accelerator for pyGT - https://github.com/sybip/pyGT
+ *
+ * Native versions of the per-byte inner loops:
+ *   crc16(data)                   - CRC16-XMODEM, as pycrc16.crc
+ *   gth16(data)                   - GTH16 hash, as pygth16.gtAlgoH16
+ *   escape(data)                  - DLE stuffing, as gtframe.gtEscape
+ *   unescape_scan(data, pos, esc) - as gtframe.gtUnescapeScan
+ *   unescape_into(out, at, data, pos, esc) - as gtframe.gtUnescapeInto
+ *   tlv_scan(data)                - TLV walk, backing pyTLV.tlvRead
+ *
+ * Build in place with:  python setup_accel.py build_ext --inplace
+ * The pure Python modules pick this up automatically when present.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+
+#define DLE 0x10
+
+static uint16_t crc_tab[256];
+
+static void
+crc_init(void)
+{
+    int i, j;
+    for (i = 0; i < 256; i++) {
+        uint16_t crc = 0, c = (uint16_t)(i << 8);
+        for (j = 0; j < 8; j++) {
+            if ((crc ^ c) & 0x8000)
+                crc = (uint16_t)((crc << 1) ^ 0x1021);
+            else
+                crc = (uint16_t)(crc << 1);
+            c = (uint16_t)(c << 1);
+        }
+        crc_tab[i] = crc;
+    }
+}
+
+static PyObject *
+accel_crc16(PyObject *self, PyObject *args)
+{
+    Py_buffer buf;
+    const unsigned char *p;
+    Py_ssize_t i;
+    uint16_t crc = 0;
+
+    if (!PyArg_ParseTuple(args, "y*:crc16", &buf))
+        return NULL;
+    p = (const unsigned char *)buf.buf;
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < buf.len; i++)
+        crc = (uint16_t)((crc << 8) ^ crc_tab[((crc >> 8) ^ p[i]) & 0xff]);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&buf);
+    return PyLong_FromLong(crc);
+}
+
+static PyObject *
+accel_gth16(PyObject *self, PyObject *args)
+{
+    Py_buffer buf;
+    const unsigned char *p;
+    Py_ssize_t i;
+    uint64_t x = 0xaa;
+    uint32_t h = 0;
+
+    if (!PyArg_ParseTuple(args, "y*:gth16", &buf))
+        return NULL;
+    p = (const unsigned char *)buf.buf;
+    for (i = 0; i < buf.len; i++) {
+        x = (((x + p[i]) * 48271 + 1) & 0xffffffffULL) % 0x7fffffffULL;
+        h ^= (uint32_t)x;
+    }
+    PyBuffer_Release(&buf);
+    return PyLong_FromLong((long)(((h >> 16) ^ h) & 0xffff));
+}
+
+static PyObject *
+accel_escape(PyObject *self, PyObject *args)
+{
+    Py_buffer buf;
+    const unsigned char *p;
+    unsigned char *q;
+    Py_ssize_t i, n = 0;
+    PyObject *res;
+
+    if (!PyArg_ParseTuple(args, "y*:escape", &buf))
+        return NULL;
+    p = (const unsigned char *)buf.buf;
+    for (i = 0; i < buf.len; i++)
+        n += (p[i] == DLE);
+
+    res = PyBytes_FromStringAndSize(NULL, buf.len + n);
+    if (res != NULL) {
+        q = (unsigned char *)PyBytes_AS_STRING(res);
+        for (i = 0; i < buf.len; i++) {
+            if (p[i] == DLE)
+                *q++ = DLE;
+            *q++ = p[i];
+        }
+    }
+    PyBuffer_Release(&buf);
+    return res;
+}
+
+static PyObject *
+accel_unescape_scan(PyObject *self, PyObject *args)
+{
+    Py_buffer buf;
+    const unsigned char *p;
+    unsigned char *out, *q;
+    Py_ssize_t pos = 0, end;
+    int esc = 0, ctrl = -1;
+    PyObject *chunk;
+
+    if (!PyArg_ParseTuple(args, "y*|np:unescape_scan", &buf, &pos, &esc))
+        return NULL;
+    p = (const unsigned char *)buf.buf;
+    end = buf.len;
+    if (pos < 0)
+        pos = 0;
+    if (pos > end)
+        pos = end;
+
+    /* output can't be longer than the remaining input */
+    out = q = (unsigned char *)PyMem_Malloc(end - pos + 1);
+    if (out == NULL) {
+        PyBuffer_Release(&buf);
+        return PyErr_NoMemory();
+    }
+
+    while (pos < end) {
+        unsigned char c = p[pos++];
+        if (!esc) {
+            if (c == DLE)
+                esc = 1;
+            else
+                *q++ = c;
+        } else {
+            esc = 0;
+            if (c == DLE) {
+                *q++ = c;
+            } else {
+                ctrl = c;
+                break;
+            }
+        }
+    }
+
+    chunk = PyBytes_FromStringAndSize((const char *)out, q - out);
+    PyMem_Free(out);
+    PyBuffer_Release(&buf);
+    if (chunk == NULL)
+        return NULL;
+    return Py_BuildValue("(NnOi)", chunk, pos, esc ? Py_True : Py_False,
+                         ctrl);
+}
+
+static PyObject *
+accel_unescape_into(PyObject *self, PyObject *args)
+{
+    PyObject *out;
+    Py_buffer buf;
+    const unsigned char *p;
+    unsigned char *q;
+    Py_ssize_t at, pos = 0, end;
+    int esc = 0, ctrl = -1;
+
+    if (!PyArg_ParseTuple(args, "O!ny*|np:unescape_into", &PyByteArray_Type,
+                          &out, &at, &buf, &pos, &esc))
+        return NULL;
+    p = (const unsigned char *)buf.buf;
+    end = buf.len;
+    if (pos < 0)
+        pos = 0;
+    if (pos > end)
+        pos = end;
+    if (at < 0 || at > PyByteArray_GET_SIZE(out)) {
+        PyBuffer_Release(&buf);
+        PyErr_SetString(PyExc_ValueError, "offset outside of buffer");
+        return NULL;
+    }
+
+    /* make room for the most that can be written; never shrink */
+    if (at + (end - pos) > PyByteArray_GET_SIZE(out) &&
+            PyByteArray_Resize(out, at + (end - pos)) < 0) {
+        PyBuffer_Release(&buf);
+        return NULL;
+    }
+    q = (unsigned char *)PyByteArray_AS_STRING(out) + at;
+
+    while (pos < end) {
+        unsigned char c = p[pos++];
+        if (!esc) {
+            if (c == DLE)
+                esc = 1;
+            else
+                *q++ = c;
+        } else {
+            esc = 0;
+            if (c == DLE) {
+                *q++ = c;
+            } else {
+                ctrl = c;
+                break;
+            }
+        }
+    }
+
+    at = q - (unsigned char *)PyByteArray_AS_STRING(out);
+    PyBuffer_Release(&buf);
+    return Py_BuildValue("(nnOi)", at, pos, esc ? Py_True : Py_False, ctrl);
+}
+
+static PyObject *
+accel_tlv_scan(PyObject *self, PyObject *args)
+{
+    Py_buffer buf;
+    const unsigned char *p;
+    Py_ssize_t pos = 0;
+    PyObject *items, *item;
+
+    if (!PyArg_ParseTuple(args, "y*:tlv_scan", &buf))
+        return NULL;
+    p = (const unsigned char *)buf.buf;
+
+    items = PyList_New(0);
+    if (items == NULL)
+        goto done;
+
+    while (pos + 2 <= buf.len && pos + 2 + p[pos + 1] <= buf.len) {
+        item = Py_BuildValue("(iiy#)", p[pos], p[pos + 1],
+                             (const char *)p + pos + 2,
+                             (Py_ssize_t)p[pos + 1]);
+        if (item == NULL || PyList_Append(items, item) < 0) {
+            Py_XDECREF(item);
+            Py_CLEAR(items);
+            goto done;
+        }
+        Py_DECREF(item);
+        pos += 2 + p[pos + 1];
+    }
+
+done:
+    PyBuffer_Release(&buf);
+    if (items == NULL)
+        return NULL;
+    return Py_BuildValue("(Nn)", items, pos);
+}
+
+static PyMethodDef accel_methods[] = {
+    {"crc16", accel_crc16, METH_VARARGS, "CRC16-XMODEM of a buffer"},
+    {"gth16", accel_gth16, METH_VARARGS, "GTH16 hash of a buffer"},
+    {"escape", accel_escape, METH_VARARGS, "Double every DLE byte"},
+    {"unescape_scan", accel_unescape_scan, METH_VARARGS,
+     "Unescape until end or control byte: (chunk, pos, esc, ctrl)"},
+    {"unescape_into", accel_unescape_into, METH_VARARGS,
+     "unescape_scan into a bytearray at an offset: (at, pos, esc, ctrl)"},
+    {"tlv_scan", accel_tlv_scan, METH_VARARGS,
+     "Split a TLV sequence: ([(type, length, value), ...], end)"},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef accel_module = {
+    PyModuleDef_HEAD_INIT, "_gtaccel",
+    "Optional C accelerator for pyGT", -1, accel_methods
+};
+
+PyMODINIT_FUNC
+PyInit__gtaccel(void)
+{
+    crc_init();
+    return PyModule_Create(&accel_module);
+}
@@ -1,9 +1,14 @@
 """ goTenna App objects - part of pyGT https://github.com/sybip/pyGT """
 
+import logging
 from struct import pack, unpack
 from pyTLV import tlvPack, tlvRead
 from pycrc16 import crc
-from gtdefs import *  # noqa: F403
+from gtcompress import gtCompressBlob, gtExpandBlob
+from gtdefs import (MSGB_TLV_TYPE, MSGB_TLV_NICK, MSGB_TLV_TEXT, MSGB_TLV_LCTN,
+                    MSGB_TLV_PUBK)
+
+log = logging.getLogger(__name__)
 
 # Message content types - GTA specific
 GTA_CONTENT_TEXT = 0
@@ -17,38 +22,140 @@ GTA_CONTENT_PUBK_REQ = 14
 GTA_CONTENT_PUBK_RES = 15
 
 
-def gtMakeGTABlobMsg(bodyTXT, fromTXT='API'):
+def gtMakeGTABlobMsg(bodyTXT, fromTXT='API', compress=False):
     """
     Assemble a GTA compatible message blob
     (suitable for feeding to gtMakeAPIMsg() )
+    With optional compression (see gtcompress), for capable receivers
     """
     blob = (tlvPack(MSGB_TLV_TYPE, "%d" % GTA_CONTENT_TEXT) +
             tlvPack(MSGB_TLV_NICK, fromTXT) +
             tlvPack(MSGB_TLV_TEXT, bodyTXT))
     # append CRC and return
-    return blob + pack("!H", crc(blob))
+    blob += pack("!H", crc(blob))
+    return gtCompressBlob(blob) if compress else blob
 
 
 def gtReadGTABlob(blob):
     """
     Break down a GTA message blob into its elements
+    Returns False if the blob is invalid (CRC, structure or type)
     """
 
+    try:
+        blob = gtExpandBlob(blob)
+    except ValueError as e:
+        log.debug("GTA blob: %s", e)
+        return False
+
     msg = {}
     # there's a CRC16 field at the end of the content blob;
     #   check this first and stop if incorrect
+    if len(blob) < 2:
+        return False
     wantCRC = unpack('!H', blob[-2:])[0]
     haveCRC = crc(blob[:-2])
 
     if wantCRC != haveCRC:
-        print("CRC failed, want=%04x, have=%04x" % (wantCRC, haveCRC))
+        log.debug("CRC failed, want=%04x, have=%04x", wantCRC, haveCRC)
         return False
 
-    for type, length, value in tlvRead(blob[:-2]):
-        msg[type] = value
+    try:
+        for type, length, value in tlvRead(blob[:-2]):
+            msg[type] = value
+    except ValueError:
+        return False
 
     # Check for mandatory subelement MSGB_TLV_TYPE
     if MSGB_TLV_TYPE in msg:
         return msg
 
     return False
+
+
+def gtReadGTAContent(blob):
+    """
+    Decode a GTA message blob into named fields, by content type:
+      all     - contentType, nick, text (where present)
+      LCTN    - location: list of (type, value) sub-elements, or the raw
+                value if it is not TLV formatted
+      PUBK    - pubKey (raw)
+    Group setup content (GTA_CONTENT_GROUP_KEY) is not decoded, as its
+      layout is unknown; gtReadGTABlob gives its raw elements
+    Returns False if the blob fails the checks of gtReadGTABlob
+    """
+    elems = gtReadGTABlob(blob)
+    if not elems:
+        return False
+
+    try:
+        res = {'contentType': int(elems[MSGB_TLV_TYPE])}
+    except ValueError:
+        return False
+
+    if MSGB_TLV_NICK in elems:
+        res['nick'] = elems[MSGB_TLV_NICK].decode('utf8', 'replace')
+    if MSGB_TLV_TEXT in elems:
+        res['text'] = elems[MSGB_TLV_TEXT].decode('utf8', 'replace')
+
+    if MSGB_TLV_LCTN in elems:
+        value = elems[MSGB_TLV_LCTN]
+        try:
+            res['location'] = [(t, v) for t, l, v in tlvRead(value)]
+        except ValueError:
+            res['location'] = value
+
+    if MSGB_TLV_PUBK in elems:
+        res['pubKey'] = elems[MSGB_TLV_PUBK]
+
+    return res
+
+
+class gtKeyring():
+    """
+    Group keys indexed by group GID, each with a cipher context which is
+      prepared on first use and then reused for all traffic of the group
+    Keys are added explicitly, e.g. from the app's group settings
+    Iterating yields GIDs and indexing yields contexts, so a keyring can
+      be passed directly as the keys of compatTAK.gtReadTAKBlob()
+    """
+    def __init__(self):
+        self.keys = {}
+        self.members = {}
+        self.contexts = {}
+
+    def add(self, groupGID, groupKey, members=()):
+        if self.keys.get(groupGID) != groupKey:
+            self.contexts.pop(groupGID, None)
+        self.keys[groupGID] = groupKey
+        self.members[groupGID] = list(members)
+
+    def drop(self, groupGID):
+        self.keys.pop(groupGID, None)
+        self.members.pop(groupGID, None)
+        self.contexts.pop(groupGID, None)
+
+    def context(self, groupGID):
+        ctx = self.contexts.get(groupGID)
+        if ctx is None:
+            # deferred, compatTAK imports this module (and cryptography)
+            from compatTAK import aesContext
+            ctx = self.contexts[groupGID] = aesContext(self.keys[groupGID])
+        return ctx
+
+    def decrypt(self, groupGID, cipherGram):
+        return self.context(groupGID).decrypt(cipherGram)
+
+    def encrypt(self, groupGID, clearText):
+        return self.context(groupGID).encrypt(clearText)
+
+    __getitem__ = context
+
+    def __contains__(self, groupGID):
+        return groupGID in self.keys
+
+    def __iter__(self):
+        return iter(list(self.keys))
+
+    def __len__(self):
+        return len(self.keys)
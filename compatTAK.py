@@ -1,24 +1,41 @@
 """ goTenna TAK plugin objects - part of pyGT https://github.com/sybip/pyGT """
 
 # ATAK-goTenna specific encryption
-from base64 import b64decode, b64encode
+from binascii import a2b_base64, b2a_base64
 from struct import pack, unpack
 import os
-
-# pip install cryptography
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+import logging
 
 from compatGTA import gtReadGTABlob, gtMakeGTABlobMsg
 from pycrc16 import crc
+from gtcompress import (gtCompressBlob, gtExpandBlob, gtPackPLI, gtUnpackPLI,
+                        PLI_BIN_MARK)
 from gtdefs import MSGB_TLV_TEXT
 
+log = logging.getLogger(__name__)
+
 BLOCK_SIZE = 16  # for AES encryption
 
 # PKCS padding macros
 pad = lambda s: s + (BLOCK_SIZE - len(s) % BLOCK_SIZE) * pack('B', (BLOCK_SIZE - len(s) % BLOCK_SIZE))
 unpad = lambda s: s[:-ord(s[len(s) - 1:])]
 
+# pip install cryptography
+#   (imported on first use, so that non-crypto users don't pay for it)
+_crypto = None
+
+
+def _aes():
+    """ Load the AES backend, returns (Cipher, algorithms, modes, backend) """
+    global _crypto
+    if _crypto is None:
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives.ciphers import (Cipher,
+                                                            algorithms, modes)
+        _crypto = (Cipher, algorithms, modes, default_backend())
+    return _crypto
+
+
 # Types of objects used by the ATAK-goTenna plugin
 GTAK_TYPE_MSG = 0  # goTenna plugin built-in chat facility
 GTAK_TYPE_PLI = 1  # Location (PLI)
@@ -54,28 +71,64 @@ def parseClearText(clearText, objType=0):
     res['objType'] = objType
 
     if (objType == GTAK_TYPE_PLI):
+        if clearText[:2] == PLI_BIN_MARK:
+            # binary packed (see gtcompress)
+            try:
+                clearText = gtUnpackPLI(clearText)
+            except ValueError:
+                return False
         values = clearText.split(b';')
         if (len(values)) >= 9:
-            for i in range(len(values)):
-                res[PLIKEYS[i]] = values[i].decode('utf8')
+            try:
+                for (key, value) in zip(PLIKEYS, values):
+                    res[key] = value.decode('utf8')
+            except UnicodeDecodeError:
+                return False
             return res
 
     elif (objType == GTAK_TYPE_MSG):
         divpos = clearText.find(b': ')
         if divpos > 0:
-            res['callsign'] = clearText[:divpos].decode('utf8')
-            res['message'] = clearText[divpos+2:].decode('utf8')
+            try:
+                res['callsign'] = clearText[:divpos].decode('utf8')
+                res['message'] = clearText[divpos+2:].decode('utf8')
+            except UnicodeDecodeError:
+                return False
             return res
 
     return False
 
 
+class aesContext():
+    """
+    An AES key prepared once, for keys used repeatedly (see
+      compatGTA.gtKeyring); each message still gets its own CBC cipher
+    """
+    def __init__(self, aesKey):
+        (Cipher, algorithms, modes, backend) = _aes()
+        self.key = aesKey
+        self.algorithm = algorithms.AES(aesKey)
+
+    def decrypt(self, cipherGram):
+        return aesDecrypt(cipherGram, self)
+
+    def encrypt(self, clearText):
+        return aesEncrypt(clearText, self)
+
+
+def _aesCipher(aesKey, iv):
+    """ AES-CBC cipher for a key or an aesContext """
+    (Cipher, algorithms, modes, backend) = _aes()
+    if isinstance(aesKey, aesContext):
+        return Cipher(aesKey.algorithm, modes.CBC(iv), backend)
+    return Cipher(algorithms.AES(aesKey), modes.CBC(iv), backend)
+
+
 def aesDecrypt(cipherGram, aesKey):
-    """ Decrypt an AES encrypted TAK payload """
+    """ Decrypt an AES encrypted TAK payload (key may be an aesContext) """
     iv = cipherGram[:16]
     cipherText = cipherGram[16:]
-    cipher = Cipher(algorithms.AES(aesKey), modes.CBC(iv), default_backend())
-    decryptor = cipher.decryptor()
+    decryptor = _aesCipher(aesKey, iv).decryptor()
 
     try:
         clearText = decryptor.update(cipherText) + decryptor.finalize()
@@ -86,11 +139,10 @@ def aesDecrypt(cipherGram, aesKey):
 
 
 def aesEncrypt(clearText, aesKey):
-    """ Encrypt a TAK payload using AES """
+    """ Encrypt a TAK payload using AES (key may be an aesContext) """
     clearText = pad(clearText)
     iv = os.urandom(BLOCK_SIZE)
-    cipher = Cipher(algorithms.AES(aesKey), modes.CBC(iv), default_backend())
-    encryptor = cipher.encryptor()
+    encryptor = _aesCipher(aesKey, iv).encryptor()
     ct = encryptor.update(clearText) + encryptor.finalize()
     return iv + ct
 
@@ -110,12 +162,20 @@ def gtReadTAKBlob(blob, keys={}):
       if 01013003, treat it as GTA (01-01-30, 03-xx-xxxx... you get it)
     """
 
+    try:
+        blob = gtExpandBlob(blob)
+    except ValueError as e:
+        log.debug("TAK blob: %s", e)
+        return False
+
     # check CRC first and stop if incorrect
+    if len(blob) < 2:
+        return False
     wantCRC = unpack('!H', blob[-2:])[0]
     haveCRC = crc(blob[:-2])
 
     if wantCRC != haveCRC:
-        print("CRC failed, want=%04x, have=%04x" % (wantCRC, haveCRC))
+        log.debug("CRC failed, want=%04x, have=%04x", wantCRC, haveCRC)
         return False
 
     # Object type can be PLI or MSG
@@ -136,7 +196,7 @@ def gtReadTAKBlob(blob, keys={}):
     # Attempt parsing as cleartext
     msgData = parseClearText(payLoadRaw, objType)
     if msgData:
-        print("Cleartext message received")
+        log.debug("Cleartext message received")
         msgData['crypt'] = False
         return(msgData)
 
@@ -146,14 +206,14 @@ def gtReadTAKBlob(blob, keys={}):
     #   encrypted chat message objects are b64 encoded
     if objType == GTAK_TYPE_MSG:
         try:
-            payLoadRaw = b64decode(payLoadRaw)
+            payLoadRaw = a2b_base64(payLoadRaw)
         except:
             return False
 
     # Due to the block cipher nature of AES, an encrypted payload must be
     #   a multiple of BLOCK_SIZE - if it's not, bail out early
     if (len(payLoadRaw) < 2*BLOCK_SIZE) or (len(payLoadRaw) % BLOCK_SIZE):
-        print("Invalid length for decryption: %d" % len(payLoadRaw))
+        log.debug("Invalid length for decryption: %d", len(payLoadRaw))
         return False
 
     for a in keys:
@@ -171,32 +231,41 @@ def gtReadTAKBlob(blob, keys={}):
 
 
 def gtMakeTAKBlobPLI(uuid, type, callsign, how, lat, lon, hae,
-                     team, update, aesKey=False):
+                     team, update, aesKey=False, compact=False,
+                     compress=False):
     """
     Assemble an ATAK plugin compatible PLI blob
       (suitable for feeding to gtMakeAPIMsg() )
     With optional AES encryption, if a key is provided
+    compact (binary PLI) and compress (see gtcompress) are understood
+      by pyGT receivers only
     """
-    body = (b'%s;%s;%s;%s;%.06f;%.06f;%.03f;%s;%d' %
-            (uuid, type, callsign, how, lat, lon, hae, team, update))
+    if compact:
+        body = gtPackPLI(uuid, type, callsign, how, lat, lon, hae,
+                         team, update)
+    else:
+        body = (b'%s;%s;%s;%s;%.06f;%.06f;%.03f;%s;%d' %
+                (uuid, type, callsign, how, lat, lon, hae, team, update))
     # Apply optional encryption
     if aesKey:
         body = aesEncrypt(body, aesKey)
 
-    return body + pack("!H", crc(body))
+    blob = body + pack("!H", crc(body))
+    return gtCompressBlob(blob) if compress else blob
 
 
-def gtMakeTAKBlobMsg(callsign, text, aesKey=False):
+def gtMakeTAKBlobMsg(callsign, text, aesKey=False, compress=False):
     """
     Assemble an ATAK plugin compatible chat message blob
       (suitable for feeding to gtMakeAPIMsg() )
     With optional AES encryption, if a key is provided
+    compress (see gtcompress) is understood by pyGT receivers only
     """
     body = (callsign + b': ' + text)[:230]
     # Apply optional encryption (and base64 encoding only for chats)
     if aesKey:
-        body = b64encode(aesEncrypt(body, aesKey))
-    return gtMakeGTABlobMsg(body, 'A')
+        body = b2a_base64(aesEncrypt(body, aesKey), newline=False)
+    return gtMakeGTABlobMsg(body, 'A', compress)
 
 
 if __name__ == '__main__':
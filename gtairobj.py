@@ -1,14 +1,17 @@
 """ goTenna radio objects - part of pyGT https://github.com/sybip/pyGT """
 """ WARNING: not to be confused with gtapiobj.py (API objects) """
 
-from struct import pack, unpack
-from binascii import hexlify, unhexlify
-from datetime import datetime
+from struct import unpack
+from binascii import hexlify
 import time
+import logging
 
-from pyTLV import tlvPack
-from pygth16 import gtAlgoH16
-from gtdefs import *  # noqa: F403
+from gtcodec import (gtEncodeMsg, gtUnpackDest, gtUnpackHead, gtDestLen,
+                     HEAD_LEN, MSG_CLASS_WITH_X04)
+from gtdefs import (MSG_CLASS_NAMES, MESG_TLV_HEAD, MESG_TLV_MXRX,
+                    MESG_TLV_MXTX)
+
+log = logging.getLogger(__name__)
 
 
 def gtMakeAirMsg(msgBlob, msgClass, msgAppID, fromGID, destGID=0, destTag=0,
@@ -18,67 +21,84 @@ def gtMakeAirMsg(msgBlob, msgClass, msgAppID, fromGID, destGID=0, destTag=0,
       (for gtm-lab command !tx)
     """
 
-    # 1) Message destination element
-    msgDest = pack('!BH', msgClass, msgAppID)
-    if msgClass in (MSG_CLASS_P2P, MSG_CLASS_GROUP):
-        # Destination address only in addressed messages
-        msgDest += unhexlify('%012x%02x' % (destGID, destTag))
-
-    # 2) Message header element (sender GID, timestamp and seq numbers)
-    msgHead = pack('!BQLHB', crypt, fromGID, int(time.time()), seqNo0, seqNo1)
-    msgHeadTLV = tlvPack(MESG_TLV_HEAD, msgHead)
+    return gtEncodeMsg(msgBlob, msgClass, msgAppID, fromGID, destGID,
+                       destTag, meshTTL, seqNo0, seqNo1, crypt, air=True)
 
-    # 3) Assemble the PDU: Dest, 0x04, Data (Head + Blob), Mesh TTL
-    msgFullPDU = msgDest
-    if msgClass == MSG_CLASS_P2P:
-        # Element 0x04 only in P2P messages
-        msgFullPDU += b'\xff\x00\x00'
-    msgFullPDU += msgHeadTLV + msgBlob
 
-    return msgFullPDU
+# Reasons for rejecting an air frame, as counted by gtReadAirMsgs()
+AIR_ERR_SHORT = 'short'   # frame truncated
+AIR_ERR_META = 'meta'     # malformed mesh metadata TLV
+AIR_ERR_HEAD = 'head'     # HEAD element not in expected position
 
 
-def gtReadAirMsg(msgPDU, verbose=1):
+def gtAirParse(msgPDU):
     """
-    Parse a GTM radio message PDU (NO top-level TLVs)
-      (via gtm-lab RX_MSG)
+    Parse a GTM radio message PDU without any logging or printing
+    Returns (msg, None) on success or (None, AIR_ERR_*) on failure
     """
     msg = {}
-    headPos = 3   # if DEST element is short
-
-    (msg['classID'], msg['appID']) = unpack("!BH", msgPDU[:3])
-
-    if msg['classID'] in (MSG_CLASS_P2P, MSG_CLASS_GROUP):
-        # Non-broadcast messages have a destination address:
-        #   extract 6-byte destGID and 1-byte dest tag
-        # (there's no unpack template for 48-bit numbers, so we
-        #  unpack AppID+GID as a 64-bit number and mask out AppID)
-        msg['destGID'] = unpack('!Q', msgPDU[1:9])[0] & 0xffffffffffff
-        msg['destTag'] = bytearray(msgPDU)[9]
-        if msg['classID'] == MSG_CLASS_P2P:
-            # Element 04 only in P2P class messages
-            msg['tlv_04'] = msgPDU[10:13]
-            headPos = 13  # long DEST element and element 04
-        else:
-            headPos = 10  # long DEST element, no element 04
+    pos = 0
+
+    # Mesh metadata TLVs (MXRX/MXTX) may precede the DEST element; they
+    #   can't be mistaken for it, since DEST starts with a class ID (0-3)
+    while pos < len(msgPDU) and msgPDU[pos] in (MESG_TLV_MXRX,
+                                                 MESG_TLV_MXTX):
+        if len(msgPDU) < pos + 2:
+            return None, AIR_ERR_META
+        (mType, mLen) = unpack('BB', msgPDU[pos:pos+2])
+        if len(msgPDU) < pos + 2 + mLen:
+            return None, AIR_ERR_META
+        msg['meshRX' if mType == MESG_TLV_MXRX else 'meshTX'] = \
+            msgPDU[pos+2:pos+2+mLen]
+        pos += 2 + mLen
+
+    if len(msgPDU) < pos + 3:
+        return None, AIR_ERR_SHORT
+
+    # DEST (and element 04) length depends on the message class
+    headPos = pos + gtDestLen(bytearray(msgPDU[pos:pos+1])[0])
+    if len(msgPDU) < headPos + HEAD_LEN:
+        return None, AIR_ERR_SHORT
+
+    gtUnpackDest(msgPDU, msg, pos)
+    if msg['classID'] in MSG_CLASS_WITH_X04:
+        # Element 04 only in P2P class messages
+        msg['tlv_04'] = msgPDU[headPos-3:headPos]
 
     (tFB, t10) = unpack('BB', msgPDU[headPos:headPos+2])
     if (tFB != MESG_TLV_HEAD) or (t10 != 0x10):
-        print("HEAD element not in expected position")
-        return False
+        return None, AIR_ERR_HEAD
 
-    (msg['cryptFlag'], msg['fromGID'], msg['tstamp'], msg['seqNo0'],
-        msg['seqNo1']) = unpack('!BQLHB', msgPDU[headPos+2:headPos+18])
+    gtUnpackHead(msgPDU, msg, headPos+2)
 
-    msg['hashID'] = gtAlgoH16(msgPDU[headPos+2:headPos+18])
+    msg['msgBlob'] = msgPDU[headPos+HEAD_LEN:]
 
-    msg['msgBlob'] = msgPDU[headPos+18:]
+    return msg, None
+
+
+def gtReadAirMsg(msgPDU, verbose=0):
+    """
+    Parse a GTM radio message PDU (NO top-level TLVs)
+      (via gtm-lab RX_MSG)
+    """
+    (msg, err) = gtAirParse(msgPDU)
+    if err == AIR_ERR_HEAD:
+        log.debug("HEAD element not in expected position")
+        return False
+    elif err:
+        log.debug("Malformed air frame (%s)", err)
+        return False
 
     if verbose:
         print("[MSGD]   CLASSID: %02x (%s)" %
-              (msg['classID'], MSG_CLASS_NAME[msg['classID']]))
+              (msg['classID'], MSG_CLASS_NAMES[msg['classID']]))
         print("[MSGD]   APPID  : %04x" % msg['appID'])
 
+        if 'meshRX' in msg:
+            print("[MESH]   MXRX   : " + hexlify(msg['meshRX']).decode())
+        if 'meshTX' in msg:
+            print("[MESH]   MXTX   : " + hexlify(msg['meshTX']).decode())
+
         if 'destGID' in msg:
             print("[MSGD]   DESTGID: %012x" % msg['destGID'])
             print("[MSGD]   DESTTAG: %02x" % msg['destTag'])
@@ -86,9 +106,52 @@ def gtReadAirMsg(msgPDU, verbose=1):
         print("[MSGH]   ENCRYPT: %01x" % msg['cryptFlag'])
         print("[MSGH]   FROMGID: %012x" % msg['fromGID'])
         print("[MSGH]   DTSTAMP: " + "%08x (%s)" % (msg['tstamp'],
-              datetime.fromtimestamp(msg['tstamp']).
-              strftime("%Y-%m-%d %H:%M:%S")))
+              time.strftime("%Y-%m-%d %H:%M:%S",
+              time.localtime(msg['tstamp']))))
         print("[MSGH]   SEQNO_0: %04x" % msg['seqNo0'])
         print("[MSGH]   SEQNO_1: %02x" % msg['seqNo1'])
 
     return msg
+
+
+def _airDecodeOne(msgPDU):
+    # process pool worker, must be a top-level function
+    return gtAirParse(msgPDU)
+
+
+def gtReadAirMsgs(msgPDUs, stats=None, processes=0, chunksize=256):
+    """
+    Streaming batch decoder for raw radio message PDUs
+      msgPDUs   - any iterable of air frames (as from gtm-lab RX_MSG)
+      stats     - optional dict, updated with frame and error counts
+      processes - if non-zero, decode in a process pool of that size
+                  (worthwhile for offline corpora, not for live capture)
+    Yields parsed messages in input order, including any mesh metadata
+      ('meshRX', 'meshTX'); malformed frames are counted, not yielded
+    """
+    if stats is None:
+        stats = {}
+    for key in ('frames', 'decoded', 'malformed',
+                AIR_ERR_SHORT, AIR_ERR_META, AIR_ERR_HEAD):
+        stats.setdefault(key, 0)
+
+    pool = None
+    if processes:
+        from multiprocessing import Pool
+        pool = Pool(processes)
+        results = pool.imap(_airDecodeOne, msgPDUs, chunksize)
+    else:
+        results = (gtAirParse(msgPDU) for msgPDU in msgPDUs)
+
+    try:
+        for (msg, err) in results:
+            stats['frames'] += 1
+            if err:
+                stats['malformed'] += 1
+                stats[err] += 1
+            else:
+                stats['decoded'] += 1
+                yield msg
+    finally:
+        if pool:
+            pool.terminate()
@@ -1,14 +1,19 @@
 """ goTenna API objects - part of pyGT https://github.com/sybip/pyGT """
 """ WARNING: not to be confused with gtairobj.py ("air" radio objects) """
 
-from struct import pack, unpack
-from binascii import hexlify, unhexlify
-from datetime import datetime
+import struct
+import logging
+from struct import unpack
+from binascii import hexlify
 import time
 
-from pyTLV import tlvPack, tlvRead
-from pygth16 import gtAlgoH16
-from gtdefs import *  # noqa: F403
+from pyTLV import tlvOffsets
+from gtcodec import gtEncodeMsg, gtUnpackDest, gtUnpackHead, HEAD_LEN
+from gttrace import hexDump
+from gtdefs import (MSG_CLASS_NAMES, MESG_TLV_0x04, MESG_TLV_DATA, MESG_TLV_DEST,
+                    MESG_TLV_DLR, MESG_TLV_HOPS)
+
+log = logging.getLogger(__name__)
 
 
 def gtMakeAPIMsg(msgBlob, msgClass, msgAppID, fromGID, destGID=0, destTag=0,
@@ -18,53 +23,42 @@ def gtMakeAPIMsg(msgBlob, msgClass, msgAppID, fromGID, destGID=0, destTag=0,
       (for API command 03 - OP_SENDMSG)
     """
 
-    # 1) Message destination element
-    msgDest = pack('!BH', msgClass, msgAppID)
-    if msgClass in (MSG_CLASS_P2P, MSG_CLASS_GROUP):
-        # Destination address only in addressed messages
-        msgDest += unhexlify('%012x%02x' % (destGID, destTag))
-
-    # 2) Message header element (sender GID, timestamp and seq numbers)
-    msgHead = pack('!BQLHB', crypt, fromGID, int(time.time()), seqNo0, seqNo1)
-    msgHeadTLV = tlvPack(MESG_TLV_HEAD, msgHead)
-
-    # 3) Assemble the PDU: Dest, 0x04, Data (Head + Blob), Mesh TTL
-    msgFullPDU = tlvPack(MESG_TLV_DEST, msgDest)
-    if msgClass == MSG_CLASS_P2P:
-        # Element 0x04 only in P2P messages
-        msgFullPDU += tlvPack(0x04, b'\xff\x00\x00')
-    msgFullPDU += tlvPack(MESG_TLV_DATA, msgHeadTLV + msgBlob)
-    msgFullPDU += tlvPack(MESG_TLV_TTL,  pack('B', meshTTL))
+    return gtEncodeMsg(msgBlob, msgClass, msgAppID, fromGID, destGID,
+                       destTag, meshTTL, seqNo0, seqNo1, crypt)
 
-    return msgFullPDU
 
-
-def gtReadAPIMsg(msgPDU, verbose=1):
+def gtReadAPIMsg(msgPDU, verbose=0):
     """
     Parse a GTM API message PDU (WITH top-level TLVs)
       (via API command 06 - OP_READMSG)
+    Returns False if the PDU is malformed
+    msgPDU may be a memoryview (e.g. of a receive buffer): the message
+      blob is the only part copied out of it
     """
+    try:
+        return _readAPIMsg(msgPDU, verbose)
+    except (ValueError, IndexError, struct.error) as e:
+        # untrusted radio data: no more than a debug line per bad PDU
+        log.debug("Malformed message PDU (%s): %s", e, hexDump(msgPDU))
+        return False
+
+
+def _readAPIMsg(msgPDU, verbose):
     msg = {}
 
-    # Message PDU is a TLV structure
-    for type, length, value in tlvRead(msgPDU):
+    # Message PDU is a TLV structure; the DATA element (the bulk of it)
+    #   is read in place, and only the blob copied out of it
+    for type, pos, length in tlvOffsets(msgPDU):
         if verbose:
-            print("[MESG] TYPE %02x: " % type + hexlify(value).decode())
+            print("[MESG] TYPE %02x: " % type +
+                  hexlify(msgPDU[pos:pos+length]).decode())
 
         if type == MESG_TLV_DEST:        # Destination element
-            (msg['classID'], msg['appID']) = unpack("!BH", value[:3])
-
-            if msg['classID'] in (MSG_CLASS_P2P, MSG_CLASS_GROUP):
-                # Non-broadcast messages have a destination address:
-                #   extract 6-byte destGID and 1-byte dest tag
-                # (there's no unpack template for 48-bit numbers, so we
-                #  unpack AppID+GID as a 64-bit number and mask out AppID)
-                msg['destGID'] = unpack('!Q', value[1:9])[0] & 0xffffffffffff
-                msg['destTag'] = bytearray(value)[9]
+            gtUnpackDest(msgPDU[pos:pos+length], msg)
 
             if verbose:
                 print("[MSGD]   CLASSID: %02x (%s)" %
-                      (msg['classID'], MSG_CLASS_NAME[msg['classID']]))
+                      (msg['classID'], MSG_CLASS_NAMES[msg['classID']]))
                 print("[MSGD]   APPID  : %04x" % msg['appID'])
 
                 if 'destGID' in msg:
@@ -73,52 +67,50 @@ def gtReadAPIMsg(msgPDU, verbose=1):
 
         elif type == MESG_TLV_DATA:      # Main (DATA) element
             if (length < 16):
-                print("WW: Length %02x invalid for DATA TLV" % length)
+                log.debug("Length %02x invalid for DATA TLV", length)
                 continue
 
-            stype, slength, = unpack('BB', value[:2])
+            (stype, slength) = (msgPDU[pos], msgPDU[pos+1])
 
             # This is really the HEAD (0xFB) element, its format is strict
             #   so we'll just parse it as a fixed struct
             if (stype != 0xfb):  # Expecting first byte to be FB
-                print("WW: Don't know how to parse: " +
-                      hexlify(value).decode())
+                log.debug("Don't know how to parse: %s",
+                          hexDump(msgPDU[pos:pos+length]))
                 continue
 
             if (slength != 0x10):
-                print("WW: Length %02x invalid for FB TLV" % slength)
+                log.debug("Length %02x invalid for FB TLV", slength)
 
-            (msg['cryptFlag'], msg['fromGID'], msg['tstamp'],
-                msg['seqNo0'], msg['seqNo1']) = unpack('!BQLHB', value[2:18])
-
-            msg['hashID'] = gtAlgoH16(value[2:18])
+            if (length < HEAD_LEN):
+                raise ValueError('Truncated HEAD element')
+            gtUnpackHead(msgPDU, msg, pos+2)
 
             if verbose:
                 print("[MSGH]   ENCRYPT: %01x" % msg['cryptFlag'])
                 print("[MSGH]   FROMGID: %012x" % msg['fromGID'])
                 print("[MSGH]   DTSTAMP: " + "%08x (%s)" % (msg['tstamp'],
-                      datetime.fromtimestamp(msg['tstamp']).
-                      strftime("%Y-%m-%d %H:%M:%S")))
+                      time.strftime("%Y-%m-%d %H:%M:%S",
+                      time.localtime(msg['tstamp']))))
                 print("[MSGH]   SEQNO_0: %04x" % msg['seqNo0'])
                 print("[MSGH]   SEQNO_1: %02x" % msg['seqNo1'])
 
-            # skip the HEAD element
-            value = value[18:]
-
-            # message content is here
-            msg['msgBlob'] = value       # as received
+            # message content is here, after the HEAD element
+            msg['msgBlob'] = bytes(msgPDU[pos+HEAD_LEN:pos+length])
 
         elif type == MESG_TLV_0x04:      # Unknown TLV 4
-            msg['tlv_04'] = value
+            msg['tlv_04'] = bytes(msgPDU[pos:pos+length])
 
         elif type == MESG_TLV_DLR:       # Delivery ACK
-            (msg['ackStatus'], msg['ackMsgID'],) = unpack('!BH', value)
+            (msg['ackStatus'], msg['ackMsgID'],) = unpack(
+                '!BH', msgPDU[pos:pos+length])
             if verbose:
                 print("  Delivery ACK: status 0x%02x for message ID 0x%04x" %
                       (msg['ackStatus'], msg['ackMsgID']))
 
         elif type == MESG_TLV_HOPS:      # Number of hops
-            (msg['meshHops'], msg['dChRSSI'],) = unpack('BB', value)
+            (msg['meshHops'], msg['dChRSSI'],) = unpack(
+                'BB', msgPDU[pos:pos+length])
             if verbose:
                 print("  Received via %d hops, dChRSSI=0x%02x" %
                       (msg['meshHops'], msg['dChRSSI']))
@@ -0,0 +1,586 @@
+#!/usr/bin/python
+
+""" gtbridge.py
+Gateway between a goTenna mesh and a Cursor-on-Target (CoT) network
+
+Radio to network: messages read from the device are decoded as TAK
+  plugin blobs, turned into CoT events (PLI or GeoChat) and sent over
+  UDP (multicast SA, by default) or a TCP connection to a TAK server.
+Network to radio: PLI and GeoChat events received are turned into TAK
+  plugin blobs and sent as shouts.
+
+Both directions go through bounded queues:
+ - radio to network: the reader stops taking messages off the device
+   while its queue is full, so they wait in the device's own queue
+ - network to radio: TCP reception blocks (and TCP flow control pushes
+   back on the server); UDP datagrams are dropped, and counted
+The radio side sends in batches: events arriving within batchWindow
+  are collected, and PLIs of the same uid coalesced into the latest,
+  so that a burst of position updates costs one message each.
+"""
+
+import sys
+import time
+import queue
+import socket
+import logging
+import struct
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+from gtapiobj import gtMakeAPIMsg, gtReadAPIMsg
+from gtcodec import HEAD_LEN
+from compatTAK import (gtReadTAKBlob, gtMakeTAKBlobPLI, gtMakeTAKBlobMsg,
+                       GTAK_TYPE_PLI, GTAK_TYPE_MSG)
+from gtdefs import (OP_READMSG, OP_NEXTMSG, OP_SENDMSG, GT_OP_SUCCESS,
+                    MSG_CLASS_SHOUT)
+
+log = logging.getLogger(__name__)
+
+# ATAK situational awareness multicast group
+COT_SA_GROUP = ('239.2.3.1', 6969)
+
+# Largest CoT event accepted from the network
+COT_MAX_EVENT = 16384
+
+# Largest blob a message can carry (DATA element, after the header)
+COT_MAX_BLOB = 0xff - HEAD_LEN
+
+# CoT type of GeoChat messages
+COT_TYPE_CHAT = 'b-t-f'
+
+COT_TIME_FMT = '%Y-%m-%dT%H:%M:%S.000Z'
+
+
+def _cotTime(t):
+    return time.strftime(COT_TIME_FMT, time.gmtime(t))
+
+
+def _event(uid, type, how, stale, now=None):
+    if now is None:
+        now = time.time()
+    return ElementTree.Element('event', {
+        'version': '2.0', 'uid': uid, 'type': type, 'how': how,
+        'time': _cotTime(now), 'start': _cotTime(now),
+        'stale': _cotTime(now + stale)})
+
+
+def _point(event, lat=0., lon=0., hae=0.):
+    ElementTree.SubElement(event, 'point', {
+        'lat': '%.6f' % lat, 'lon': '%.6f' % lon, 'hae': '%.1f' % hae,
+        'ce': '9999999.0', 'le': '9999999.0'})
+
+
+def pliToCoT(pli, now=None):
+    """ CoT event (bytes) for a PLI decoded by gtReadTAKBlob """
+    update = int(float(pli['update'] or 0))
+    event = _event(pli['uuid'], pli['type'], pli['how'],
+                   max(update * 3, 60), now)
+    _point(event, float(pli['lat']), float(pli['lon']), float(pli['hae']))
+    detail = ElementTree.SubElement(event, 'detail')
+    ElementTree.SubElement(detail, 'contact', {'callsign': pli['callsign']})
+    ElementTree.SubElement(detail, '__group', {'name': pli['team'],
+                                                'role': 'Team Member'})
+    return ElementTree.tostring(event)
+
+
+def chatToCoT(chat, fromGID=0, now=None):
+    """ CoT GeoChat event (bytes) for a chat decoded by gtReadTAKBlob """
+    if now is None:
+        now = time.time()
+    sender = chat['callsign']
+    uid = 'GeoChat.%s.All Chat Rooms.%x-%d' % (sender, fromGID,
+                                                int(now * 1000))
+    event = _event(uid, COT_TYPE_CHAT, 'h-g-i-g-o', 86400, now)
+    _point(event)
+    detail = ElementTree.SubElement(event, 'detail')
+    ElementTree.SubElement(detail, '__chat', {
+        'chatroom': 'All Chat Rooms', 'id': 'All Chat Rooms',
+        'senderCallsign': sender})
+    remarks = ElementTree.SubElement(detail, 'remarks', {
+        'source': 'BAO.F.goTenna.%x' % fromGID, 'time': _cotTime(now)})
+    remarks.text = chat['message']
+    return ElementTree.tostring(event)
+
+
+def _chatBlob(callsign, text, aesKey):
+    """ Chat blob with the text cut short to fit a message, or None """
+    while True:
+        try:
+            blob = gtMakeTAKBlobMsg(callsign, text, aesKey)
+            if len(blob) <= COT_MAX_BLOB:
+                return blob
+        except struct.error:
+            pass    # encrypted and base64 encoded, too long for a TLV
+        if not text:
+            return None
+        # (without splitting a UTF-8 sequence)
+        text = text[:-1].decode('utf8', 'ignore').encode('utf8')
+
+
+def cotToBlob(xml, aesKey=False):
+    """
+    TAK plugin blob for a CoT event (PLI or GeoChat)
+    Returns (coalescing key or None, blob), or None for events which
+      can't be carried (other types, malformed XML, PLI fields too long
+      for a message); chat text is cut short to fit
+    """
+    try:
+        event = ElementTree.fromstring(xml)
+    except ElementTree.ParseError:
+        return None
+    if event.tag != 'event':
+        return None
+    (uid, type) = (event.get('uid', ''), event.get('type', ''))
+    detail = event.find('detail')
+    contact = detail.find('contact') if detail is not None else None
+    callsign = contact.get('callsign', '') if contact is not None else ''
+
+    if type == COT_TYPE_CHAT:
+        chat = detail.find('__chat') if detail is not None else None
+        remarks = detail.find('remarks') if detail is not None else None
+        if remarks is None or not remarks.text:
+            return None
+        if chat is not None:
+            callsign = chat.get('senderCallsign', callsign)
+        blob = _chatBlob(callsign.encode('utf8'),
+                         remarks.text.encode('utf8'), aesKey)
+        return (None, blob) if blob is not None else None
+
+    if not type.startswith('a-'):
+        return None
+    point = event.find('point')
+    if point is None:
+        return None
+    group = detail.find('__group') if detail is not None else None
+    team = group.get('name', '') if group is not None else ''
+    try:
+        (lat, lon, hae) = (float(point.get('lat')), float(point.get('lon')),
+                           float(point.get('hae', 0)))
+    except (TypeError, ValueError):
+        return None
+    if hae > 9e6:
+        hae = 0.
+    blob = gtMakeTAKBlobPLI(uid.encode('utf8'), type.encode('utf8'),
+                            callsign.encode('utf8'),
+                            event.get('how', 'm-g').encode('utf8'),
+                            lat, lon, hae, team.encode('utf8'), 60,
+                            aesKey)
+    if len(blob) > COT_MAX_BLOB:
+        return None
+    return (('pli', uid), blob)
+
+
+class cotTransport(ABC):
+    """
+    CoT network side: send(event) and a receiver thread calling
+      handler(event) for each event received
+    blocking - whether handler may block (applying backpressure to the
+               peer) rather than drop when the bridge is behind
+    """
+    blocking = False
+
+    def start(self, handler):
+        self.handler = handler
+        self.running = True
+        self.thread = threading.Thread(target=self.receiveLoop,
+                                       name='gtBridge-net')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.running = False
+
+    @abstractmethod
+    def send(self, event):
+        """ Send one event; raises OSError on failure """
+
+    @abstractmethod
+    def receiveLoop(self):
+        """ Receiver thread: calls handler(event) until close() """
+
+
+class cotUDP(cotTransport):
+    """
+    CoT over UDP, one event per datagram
+      target - (host, port) events are sent to (multicast or unicast)
+      listen - (host, port) to receive events on, or None; a multicast
+               host is joined
+    Multicast loopback is off, so that our own events don't come back
+    """
+    def __init__(self, target=COT_SA_GROUP, listen=None, ttl=1):
+        self.target = target
+        self.tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.tx.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.tx.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 0)
+        self.rx = None
+        if listen is not None:
+            self.rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.rx.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            (host, port) = listen
+            if 224 <= int(host.split('.')[0]) <= 239:
+                self.rx.bind(('', port))
+                self.rx.setsockopt(socket.IPPROTO_IP,
+                                   socket.IP_ADD_MEMBERSHIP,
+                                   socket.inet_aton(host) +
+                                   struct.pack('!I', socket.INADDR_ANY))
+            else:
+                self.rx.bind(listen)
+            self.rx.settimeout(0.2)
+
+    def start(self, handler):
+        if self.rx is not None:
+            cotTransport.start(self, handler)
+
+    def send(self, event):
+        self.tx.sendto(event, self.target)
+
+    def receiveLoop(self):
+        while self.running:
+            try:
+                data = self.rx.recv(COT_MAX_EVENT)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.handler(data)
+
+    def close(self):
+        cotTransport.close(self)
+        if self.rx is not None:
+            if hasattr(self, 'thread'):
+                self.thread.join()
+            self.rx.close()
+        self.tx.close()
+
+
+class cotTCP(cotTransport):
+    """
+    CoT streamed over a TCP connection (to a TAK server), both ways
+    Reception blocks while the bridge is behind, so the server is
+      slowed down by TCP flow control instead of events being dropped
+    """
+    blocking = True
+
+    def __init__(self, addr, timeout=10.0):
+        self.sock = socket.create_connection(addr, timeout)
+        self.sock.settimeout(0.2)
+        self.lock = threading.Lock()
+
+    def send(self, event):
+        # the socket timeout is shared with the receiver thread, so it is
+        #   left alone: a timeout only means the server is behind
+        with self.lock:
+            view = memoryview(event)
+            while view:
+                try:
+                    view = view[self.sock.send(view):]
+                except socket.timeout:
+                    continue
+
+    def receiveLoop(self):
+        buf = b''
+        while self.running:
+            try:
+                data = self.sock.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if not data:
+                break
+            buf += data
+            while True:
+                end = buf.find(b'</event>')
+                if end < 0:
+                    break
+                start = buf.find(b'<event')
+                event = buf[start:end + 8] if 0 <= start < end else None
+                buf = buf[end + 8:]
+                if event:
+                    self.handler(event)
+            if len(buf) > COT_MAX_EVENT:
+                log.debug("Oversized CoT event dropped")
+                buf = b''
+        self.running = False
+
+    def close(self):
+        cotTransport.close(self)
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if hasattr(self, 'thread'):
+            self.thread.join()
+        self.sock.close()
+
+
+class gtCoTBridge():
+    """
+    Bridge a goTennaDev and a cotTransport
+      fromGID     - our GID, as the sender of radio messages
+      appID       - app ID of the radio messages
+      aesKey      - TAK plugin key, for encrypting what we send and, with
+                    keys, decrypting what we receive ({keyID: key})
+      queueSize   - capacity of each direction's queue
+      batchWindow - seconds to collect radio-bound events for coalescing
+      minInterval - least seconds between two radio sends (airtime)
+    """
+    def __init__(self, dev, transport, fromGID, appID=0x3fff, aesKey=False,
+                 keys={}, queueSize=64, batchWindow=0.5, minInterval=0.,
+                 dedup=None, poll=0.5):
+        self.dev = dev
+        self.transport = transport
+        self.fromGID = fromGID
+        self.appID = appID
+        self.aesKey = aesKey
+        self.keys = keys
+        self.dedup = dedup
+        self.poll = poll
+        self.batchWindow = batchWindow
+        self.minInterval = minInterval
+        self.toNet = queue.Queue(queueSize)
+        self.toRadio = queue.Queue(queueSize)
+        self.running = False
+        self.threads = []
+
+        # updated from the bridge and transport threads, through count()
+        self.countLock = threading.Lock()
+        self.counters = dict.fromkeys((
+            'radioRx',          # messages read from the device
+            'netTx',            # events sent to the network
+            'netRx',            # events received from the network
+            'radioTx',          # messages sent by the device
+            'unparsed',         # radio messages or events not convertible
+            'duplicates',       # mesh duplicates (with dedup)
+            'netDropped',       # events dropped, radio queue full
+            'coalesced',        # PLIs superseded before being sent
+            'radioFailed',      # radio sends which failed
+            'netFailed',        # network sends which failed
+            'radioWaits',       # radio reads held back by a full queue
+        ), 0)
+
+    def start(self):
+        """ Start the device I/O thread and the bridge threads """
+        self.running = True
+        self.dev.startIO()
+        for (name, target) in (('radio-rx', self.radioReader),
+                               ('radio-tx', self.radioSender),
+                               ('net-tx', self.netSender)):
+            thread = threading.Thread(target=target,
+                                      name='gtBridge-%s' % name)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        self.transport.start(self.netReceived)
+
+    def stop(self):
+        self.running = False
+        self.transport.close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def count(self, name):
+        with self.countLock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self.countLock:
+            res = dict(self.counters)
+        res['toNet'] = self.toNet.qsize()
+        res['toRadio'] = self.toRadio.qsize()
+        return res
+
+    def _put(self, q, item):
+        """ Blocking put which gives up when the bridge stops """
+        while self.running:
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # Radio to network
+
+    def radioReader(self):
+        """ Take messages off the device while there is room for them """
+        while self.running:
+            if self.toNet.full():
+                self.count('radioWaits')
+                time.sleep(0.05)
+                continue
+            res = self.dev.execute(OP_READMSG)
+            if not res or res[0] != GT_OP_SUCCESS:
+                # nothing waiting: sleep until MWI is raised, or poll
+                deadline = time.monotonic() + self.poll
+                while (self.running and not self.dev.mwi and
+                       time.monotonic() < deadline):
+                    time.sleep(0.01)
+                continue
+            self.count('radioRx')
+            event = self.radioToCoT(res[1])
+            if event is not None and not self._put(self.toNet, event):
+                break
+            self.dev.execute(OP_NEXTMSG)
+
+    def radioToCoT(self, msgPDU):
+        msg = gtReadAPIMsg(msgPDU)
+        if not msg or 'msgBlob' not in msg:
+            self.count('unparsed')
+            return None
+        if self.dedup is not None and self.dedup.seen(msg):
+            self.count('duplicates')
+            return None
+        obj = gtReadTAKBlob(msg['msgBlob'], self.keys)
+        try:
+            if obj and obj['objType'] == GTAK_TYPE_PLI:
+                return pliToCoT(obj)
+            if obj and obj['objType'] == GTAK_TYPE_MSG:
+                return chatToCoT(obj, msg['fromGID'])
+        except (KeyError, ValueError):
+            pass
+        self.count('unparsed')
+        return None
+
+    def netSender(self):
+        while self.running:
+            try:
+                event = self.toNet.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                self.transport.send(event)
+                self.count('netTx')
+            except OSError as e:
+                self.count('netFailed')
+                log.debug("CoT send failed: %s", e)
+
+    # Network to radio
+
+    def netReceived(self, event):
+        """ Transport handler: queue an event for the radio """
+        self.count('netRx')
+        if len(event) > COT_MAX_EVENT:
+            self.count('unparsed')
+            return
+        if self.transport.blocking:
+            self._put(self.toRadio, event)
+            return
+        try:
+            self.toRadio.put_nowait(event)
+        except queue.Full:
+            self.count('netDropped')
+
+    def radioSender(self):
+        """ Collect a batch of events, coalesce PLIs, send """
+        lastSend = 0.
+        while self.running:
+            try:
+                first = self.toRadio.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            batch = OrderedDict()
+            serial = 0
+            deadline = time.monotonic() + self.batchWindow
+            event = first
+            while True:
+                try:
+                    res = cotToBlob(event, self.aesKey)
+                except Exception as e:
+                    log.warning("CoT event not converted: %s", e)
+                    res = None
+                if res is None:
+                    self.count('unparsed')
+                else:
+                    (key, blob) = res
+                    if key is None:
+                        (key, serial) = (serial, serial + 1)
+                    elif key in batch:
+                        self.count('coalesced')
+                        del batch[key]
+                    batch[key] = blob
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    event = self.toRadio.get(timeout=timeout)
+                except queue.Empty:
+                    break
+
+            for blob in batch.values():
+                wait = lastSend + self.minInterval - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    res = self.dev.execute(OP_SENDMSG, gtMakeAPIMsg(
+                        blob, MSG_CLASS_SHOUT, self.appID, self.fromGID))
+                except Exception as e:
+                    log.warning("Radio send failed: %s", e)
+                    res = False
+                lastSend = time.monotonic()
+                if res and res[0] == GT_OP_SUCCESS:
+                    self.count('radioTx')
+                else:
+                    self.count('radioFailed')
+
+
+def giveHelp():
+    print("\ngoTenna to CoT gateway")
+    print("\nUsage: %s -m mac -g gid [-u host:port] [-l host:port] "
+          "[-t host:port] [-k hexkey]\n" % sys.argv[0])
+    print("  -u  send CoT over UDP to host:port (default %s:%d)" %
+          COT_SA_GROUP)
+    print("  -l  receive CoT over UDP on host:port")
+    print("  -t  exchange CoT with a TAK server over TCP instead")
+    print("  -k  TAK plugin AES key")
+
+
+def main():
+    import getopt
+    from binascii import unhexlify
+
+    def hostPort(value):
+        (host, port) = value.rsplit(':', 1)
+        return (host, int(port))
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "m:g:u:l:t:k:")
+        opts = dict(opts)
+        mac = opts['-m']
+        gid = int(opts['-g'], 0)
+        aesKey = unhexlify(opts['-k']) if '-k' in opts else False
+        if '-t' in opts:
+            transport = cotTCP(hostPort(opts['-t']))
+        else:
+            transport = cotUDP(hostPort(opts.get('-u', '%s:%d' %
+                                                 COT_SA_GROUP)),
+                               hostPort(opts['-l']) if '-l' in opts else None)
+    except (getopt.GetoptError, KeyError, ValueError):
+        giveHelp()
+        sys.exit(-1)
+
+    from gtdevice import goTennaDev
+    from gtdedup import gtDedupCache
+    dev = goTennaDev(mac)
+    if not dev.initialize():
+        sys.exit(1)
+    bridge = gtCoTBridge(dev, transport, gid, aesKey=aesKey,
+                         keys={'key': aesKey} if aesKey else {},
+                         dedup=gtDedupCache())
+    bridge.start()
+    try:
+        while True:
+            time.sleep(10)
+            log.info("%s", bridge.stats())
+    except KeyboardInterrupt:
+        pass
+    bridge.stop()
+    dev.disconnect()
+
+
+if __name__ == "__main__":
+    main()
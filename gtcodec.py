@@ -0,0 +1,171 @@
+""" goTenna message codec - part of pyGT https://github.com/sybip/pyGT """
+
+"""
+The message layout, described once and shared by the API framing
+  (gtapiobj, top-level TLVs) and the air framing (gtairobj, no TLVs):
+
+  DEST   class(1) appID(2) [destGID(6) destTag(1)]  - GID only in P2P/GROUP
+  X_04   ff 00 00                                   - P2P only
+  HEAD   fb 10 crypt(1) fromGID(8) tstamp(4) seqNo0(2) seqNo1(1)
+  BLOB   message content, up to the end of DATA (API) or frame (air)
+
+In API framing DEST, X_04 and DATA (HEAD + BLOB) are each wrapped in a
+  TLV, and a TTL TLV is appended; in air framing they are concatenated.
+"""
+
+import time
+from struct import pack, unpack_from
+
+from pyTLV import tlvPack
+from pygth16 import gtAlgoH16
+from gtdefs import (MSG_CLASS_P2P, MSG_CLASS_GROUP, MESG_TLV_0x04,
+                    MESG_TLV_DATA, MESG_TLV_DEST, MESG_TLV_HEAD, MESG_TLV_TTL,
+                    MESG_TLV_MXRX, MESG_TLV_MXTX)
+
+# Fixed element sizes
+DEST_LEN_SHORT = 3       # class + appID
+DEST_LEN_LONG = 10       # class + appID + destGID + destTag
+X04_VALUE = b'\xff\x00\x00'
+HEAD_LEN = 18            # including its own FB 10 TLV header
+
+# Message classes which carry a destination GID / an 0x04 element
+MSG_CLASS_ADDRESSED = (MSG_CLASS_P2P, MSG_CLASS_GROUP)
+MSG_CLASS_WITH_X04 = (MSG_CLASS_P2P, )
+
+
+def gtPackDest(msgClass, msgAppID, destGID=0, destTag=0):
+    """ Message destination element (value only) """
+    if msgClass in MSG_CLASS_ADDRESSED:
+        # Destination address only in addressed messages
+        #   (48-bit GID packed as the low half of a 64-bit number,
+        #    whose top 16 bits are overwritten by class and appID)
+        return pack('!BHHI', msgClass, msgAppID, (destGID >> 32) & 0xffff,
+                    destGID & 0xffffffff) + pack('B', destTag)
+    return pack('!BH', msgClass, msgAppID)
+
+
+def gtPackHead(fromGID, tstamp=None, seqNo0=0, seqNo1=0, crypt=0):
+    """ Message header element (sender GID, timestamp and seq numbers) """
+    if tstamp is None:
+        tstamp = int(time.time())
+    return tlvPack(MESG_TLV_HEAD,
+                   pack('!BQLHB', crypt, fromGID, tstamp, seqNo0, seqNo1))
+
+
+def gtDestLen(msgClass):
+    """ Length of DEST plus the optional 0x04 element, by class """
+    if msgClass in MSG_CLASS_WITH_X04:
+        return DEST_LEN_LONG + len(X04_VALUE)
+    if msgClass in MSG_CLASS_ADDRESSED:
+        return DEST_LEN_LONG
+    return DEST_LEN_SHORT
+
+
+def gtUnpackDest(value, msg, pos=0):
+    """
+    Parse a DEST element value at pos into msg
+    Raises IndexError/struct.error if too short
+    """
+    (msg['classID'], msg['appID']) = unpack_from("!BH", value, pos)
+
+    if msg['classID'] in MSG_CLASS_ADDRESSED:
+        # Non-broadcast messages have a destination address:
+        #   extract 6-byte destGID and 1-byte dest tag
+        # (there's no unpack template for 48-bit numbers, so we
+        #  unpack AppID+GID as a 64-bit number and mask out AppID)
+        msg['destGID'] = unpack_from('!Q', value, pos+1)[0] & 0xffffffffffff
+        msg['destTag'] = value[pos+9]
+
+    return msg
+
+
+def gtUnpackHead(value, msg, pos=0):
+    """
+    Parse the 16-byte HEAD element value at pos into msg, with hashID
+    """
+    (msg['cryptFlag'], msg['fromGID'], msg['tstamp'],
+        msg['seqNo0'], msg['seqNo1']) = unpack_from('!BQLHB', value, pos)
+
+    msg['hashID'] = gtAlgoH16(value[pos:pos+16])
+
+    return msg
+
+
+def gtEncodeMsg(msgBlob, msgClass, msgAppID, fromGID, destGID=0, destTag=0,
+                meshTTL=3, seqNo0=0, seqNo1=0, crypt=0, tstamp=None,
+                air=False):
+    """
+    Assemble a message PDU, in API framing or (if air is set) air framing
+    """
+    msgDest = gtPackDest(msgClass, msgAppID, destGID, destTag)
+    msgData = gtPackHead(fromGID, tstamp, seqNo0, seqNo1, crypt) + msgBlob
+
+    if air:
+        if msgClass in MSG_CLASS_WITH_X04:
+            return msgDest + X04_VALUE + msgData
+        return msgDest + msgData
+
+    # Dest, 0x04, Data (Head + Blob), Mesh TTL
+    msgFullPDU = tlvPack(MESG_TLV_DEST, msgDest)
+    if msgClass in MSG_CLASS_WITH_X04:
+        msgFullPDU += tlvPack(MESG_TLV_0x04, X04_VALUE)
+    return (msgFullPDU + tlvPack(MESG_TLV_DATA, msgData) +
+            tlvPack(MESG_TLV_TTL, pack('B', meshTTL)))
+
+
+def gtApiToAir(msgPDU):
+    """
+    Convert an API framed message PDU to air framing, by walking the
+      top-level TLV headers only: nothing inside them is decoded
+    TTL, HOPS and DLR elements have no air equivalent and are dropped
+    """
+    parts = {}
+    pos = 0
+    end = len(msgPDU)
+    while pos < end:
+        if pos + 2 > end:
+            raise ValueError('Invalid TLV')
+        (tlvType, tlvLen) = unpack_from('BB', msgPDU, pos)
+        if pos + 2 + tlvLen > end:
+            raise ValueError('Invalid TLV')
+        parts[tlvType] = msgPDU[pos+2:pos+2+tlvLen]
+        pos += 2 + tlvLen
+
+    try:
+        return (parts[MESG_TLV_DEST] + parts.get(MESG_TLV_0x04, b'') +
+                parts[MESG_TLV_DATA])
+    except KeyError:
+        raise ValueError('Missing DEST or DATA element')
+
+
+def gtAirToApi(msgPDU, meshTTL=3):
+    """
+    Convert an air framed message PDU to API framing, using only the
+      class ID to locate the element boundaries
+    Leading mesh metadata (MXRX/MXTX), which the device strips, is dropped
+    Raises ValueError if the frame is truncated, or too long for a TLV
+    """
+    pos = 0
+    while pos < len(msgPDU) and msgPDU[pos] in (MESG_TLV_MXRX,
+                                                 MESG_TLV_MXTX):
+        if pos + 2 > len(msgPDU):
+            raise ValueError('Air frame too short')
+        pos += 2 + msgPDU[pos+1]
+
+    if pos >= len(msgPDU):
+        raise ValueError('Air frame too short')
+    msgClass = msgPDU[pos]
+    destEnd = pos + gtDestLen(msgClass)
+    if len(msgPDU) < destEnd + HEAD_LEN:
+        raise ValueError('Air frame too short')
+    if len(msgPDU) - destEnd > 0xff:
+        raise ValueError('Air frame too long for a DATA element')
+
+    if msgClass in MSG_CLASS_WITH_X04:
+        msgFullPDU = (tlvPack(MESG_TLV_DEST, msgPDU[pos:destEnd-3]) +
+                      tlvPack(MESG_TLV_0x04, msgPDU[destEnd-3:destEnd]))
+    else:
+        msgFullPDU = tlvPack(MESG_TLV_DEST, msgPDU[pos:destEnd])
+
+    return (msgFullPDU + tlvPack(MESG_TLV_DATA, msgPDU[destEnd:]) +
+            tlvPack(MESG_TLV_TTL, pack('B', meshTTL)))
@@ -0,0 +1,184 @@
+""" Blob compression - part of pyGT https://github.com/sybip/pyGT """
+
+"""
+Opt-in compression of GTA and TAK message blobs, to save airtime.
+
+Blob level: a finished blob (with its CRC) is deflated against a preset
+  dictionary of GTA/TAK vocabulary, and sent behind a marker element:
+
+  GTZ    e2 01 format(1)   followed by the compressed blob
+
+  gtExpandBlob() restores the original blob, which then goes through
+  the usual parsers; blobs without the marker pass through unchanged.
+  Legacy receivers reject compressed blobs (no MSGB_TLV_TYPE, or a bad
+  CRC for TAK ones) instead of misreading them, so compression should
+  only be enabled towards peers known to run this code.
+
+PLI level: a TAK PLI can also be binary packed before (optional)
+  encryption - fixed point lat/lon/hae, the text fields deflated - and
+  is recognized by parseClearText() through its leading 00 byte.
+"""
+
+import zlib
+from struct import pack, unpack
+
+# Blob marker element (pyGT specific)
+GTZ_TLV_HEAD = 0xe2
+GTZ_FMT_DEFLATE = 1     # raw deflate with GTZ_DICT
+
+# Binary PLI marker (cleartext PLIs start with a printable uuid)
+PLI_BIN_MARK = b'\x00\x01'
+PLI_BIN_HEAD = '!iiii'  # lat, lon (1e-6 deg), hae (mm), update
+
+# Preset dictionary: deflate matches favour the end of the dictionary,
+#   so the most common strings go last
+GTZ_DICT = (
+    b' the you and are for have not with this that what when where '
+    b'please copy roger affirmative negative over out moving to at on '
+    b'position location contact enemy friendly help need ETA min '
+    b'White;Yellow;Orange;Magenta;Maroon;Purple;Dark Blue;Teal;'
+    b'Dark Green;Brown;Green;Blue;Red;Cyan;'
+    b'ANDROID-;a-h-G;a-n-G;a-u-G;a-f-G-U-C-I;a-f-G-E-V-C;h-e;h-g-i-g-o;'
+    b'm-g;a-f-G-U-C;ANDROID-'
+    b'\x01\x010\x03\x03API\x04\x01\x010\x03\x01A\x04'
+)
+
+# Raw deflate (no zlib header/checksum, blobs carry their own CRC) with
+#   a 1KB window, which holds the dictionary plus the largest blob: the
+#   default 32KB window costs more to set up than compressing a blob
+GTZ_WBITS = -10
+GTZ_MEMLEVEL = 4
+
+
+def _deflate(data):
+    c = zlib.compressobj(9, zlib.DEFLATED, GTZ_WBITS, GTZ_MEMLEVEL,
+                         zlib.Z_DEFAULT_STRATEGY, GTZ_DICT)
+    return c.compress(data) + c.flush()
+
+
+def _inflate(data, limit):
+    d = zlib.decompressobj(GTZ_WBITS, GTZ_DICT)
+    try:
+        out = d.decompress(data, limit)
+    except zlib.error as e:
+        raise ValueError('Invalid compressed data: %s' % e)
+    if d.unconsumed_tail:
+        raise ValueError('Compressed data exceeds %d bytes' % limit)
+    if not d.eof:
+        raise ValueError('Truncated compressed data')
+    return out
+
+
+def gtCompressBlob(blob):
+    """
+    Compress a finished GTA/TAK blob; returns the original blob if
+      compression doesn't make it smaller
+    """
+    packed = pack('BBB', GTZ_TLV_HEAD, 1, GTZ_FMT_DEFLATE) + _deflate(blob)
+    return packed if len(packed) < len(blob) else blob
+
+
+def gtIsCompressed(blob):
+    return blob[:3] == pack('BBB', GTZ_TLV_HEAD, 1, GTZ_FMT_DEFLATE)
+
+
+def gtExpandBlob(blob, limit=4096):
+    """
+    Undo gtCompressBlob (blobs without the marker are returned as is)
+    Raises ValueError if the compressed data is corrupt, or expands to
+      more than limit bytes
+    """
+    if not gtIsCompressed(blob):
+        return blob
+    return _inflate(blob[3:], limit)
+
+
+def gtPackPLI(uuid, type, callsign, how, lat, lon, hae, team, update):
+    """ Binary PLI, same arguments as compatTAK.gtMakeTAKBlobPLI """
+    return (PLI_BIN_MARK +
+            pack(PLI_BIN_HEAD, int(round(lat * 1e6)), int(round(lon * 1e6)),
+                 int(round(hae * 1e3)), update) +
+            _deflate(b';'.join((uuid, type, callsign, how, team))))
+
+
+def gtUnpackPLI(data):
+    """
+    Binary PLI back to the text form of the TAK plugin
+      (uuid;type;callsign;how;lat;lon;hae;team;update)
+    Raises ValueError if the data is not a valid binary PLI
+    """
+    if data[:2] != PLI_BIN_MARK or len(data) < 18:
+        raise ValueError('Not a binary PLI')
+    (lat, lon, hae, update) = unpack(PLI_BIN_HEAD, data[2:18])
+    text = _inflate(data[18:], 1024).split(b';')
+    if len(text) != 5:
+        raise ValueError('Invalid binary PLI')
+    (uuid, type, callsign, how, team) = text
+    return (b'%s;%s;%s;%s;%.06f;%.06f;%.03f;%s;%d' %
+            (uuid, type, callsign, how, lat / 1e6, lon / 1e6, hae / 1e3,
+             team, update))
+
+
+if __name__ == '__main__':
+    # Bytes on air and CPU cost per message type
+    import os
+    import time
+    from compatGTA import gtMakeGTABlobMsg, gtReadGTABlob
+    from compatTAK import gtMakeTAKBlobPLI, gtMakeTAKBlobMsg, gtReadTAKBlob
+
+    try:
+        from compatTAK import _aes
+        _aes()
+        aesKey = os.urandom(16)
+    except ImportError:
+        aesKey = False
+
+    pli = (b'ANDROID-358240051111110', b'a-f-G-U-C', b'SYBIP', b'm-g',
+           51.948912, 4.053521, 12.5, b'Cyan', 60)
+
+    cases = [
+        ('GTA chat', lambda c: gtMakeGTABlobMsg('On my way, ETA 10 min',
+                                                'SYBIP', compress=c),
+         gtReadGTABlob),
+        ('TAK chat', lambda c: gtMakeTAKBlobMsg(b'SYBIP', b'roger, moving '
+                                                b'to the contact point',
+                                                compress=c),
+         gtReadTAKBlob),
+        ('TAK PLI', lambda c: gtMakeTAKBlobPLI(*pli, compact=c, compress=c),
+         gtReadTAKBlob),
+    ]
+    if aesKey:
+        cases += [
+            ('TAK chat AES', lambda c: gtMakeTAKBlobMsg(
+                b'SYBIP', b'roger, moving to the contact point', aesKey,
+                compress=c),
+             lambda b: gtReadTAKBlob(b, {'k': aesKey})),
+            ('TAK PLI AES', lambda c: gtMakeTAKBlobPLI(
+                *pli, aesKey=aesKey, compact=c, compress=c),
+             lambda b: gtReadTAKBlob(b, {'k': aesKey})),
+        ]
+
+    import io
+    import contextlib
+    n = 2000
+    print("%-14s %6s %6s %9s %9s" %
+          ("", "plain", "packed", "enc us", "dec us"))
+    for (name, make, read) in cases:
+        sizes = []
+        costs = []
+        for c in (False, True):
+            blob = make(c)
+            with contextlib.redirect_stdout(io.StringIO()):
+                assert read(blob), name
+                t0 = time.perf_counter()
+                for i in range(n):
+                    make(c)
+                t1 = time.perf_counter()
+                for i in range(n):
+                    read(blob)
+                t2 = time.perf_counter()
+            sizes.append(len(blob))
+            costs.append(((t1 - t0) / n * 1e6, (t2 - t1) / n * 1e6))
+        print("%-14s %6d %6d %4.0f/%-4.0f %4.0f/%-4.0f" %
+              (name, sizes[0], sizes[1], costs[0][0], costs[1][0],
+               costs[0][1], costs[1][1]))
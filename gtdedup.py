@@ -0,0 +1,129 @@
+""" Mesh duplicate suppression - part of pyGT https://github.com/sybip/pyGT """
+
+"""
+A mesh relays the same message several times via different hops; every
+  copy carries the same HEAD element and therefore the same GTH16 hashID.
+
+gtDedupCache remembers recently seen messages in bounded memory:
+ - a 64K-entry counter table indexed by hashID answers "definitely new"
+   for most messages without touching anything else
+ - exact confirmation on (fromGID, tstamp, seqNo0, seqNo1) weeds out
+   hashID collisions, which are frequent with a 16-bit hash
+"""
+
+import time
+from array import array
+from collections import OrderedDict
+
+_DEDUP_COUNTERS = ('lookups', 'dups', 'frontHits', 'falsePos', 'evictedFull',
+                   'evictedAged')
+
+
+class gtDedupCache():
+    """
+    Time-windowed, fixed-capacity set of seen messages
+      capacity - max messages remembered; the oldest are evicted first
+      window   - seconds a message is remembered for
+    """
+    def __init__(self, capacity=4096, window=3600):
+        self.capacity = capacity
+        self.window = window
+
+        self.front = array('I', bytes(4 * 65536))  # live entries per hashID
+        self.entries = OrderedDict()   # exact key -> (hashID, time seen)
+
+        self.lookups = 0
+        self.dups = 0          # duplicates detected
+        self.frontHits = 0     # hashID known, exact check needed
+        self.falsePos = 0      # ... and it turned out to be a new message
+        self.evictedFull = 0   # forgotten because of capacity
+        self.evictedAged = 0   # forgotten because of the time window
+
+    def seen(self, msg, now=None):
+        """
+        Check a parsed message (gtReadAPIMsg / gtReadAirMsg output)
+        Returns True if it is a duplicate, otherwise remembers it and
+          returns False
+        """
+        if now is None:
+            now = time.monotonic()
+        self.expire(now)
+        self.lookups += 1
+
+        hashID = msg['hashID']
+        key = (msg['fromGID'], msg['tstamp'], msg['seqNo0'], msg['seqNo1'])
+
+        entry = self.entries.get(key)
+        if self.front[hashID]:
+            self.frontHits += 1
+            if entry is not None and entry[0] == hashID:
+                self.dups += 1
+                return True
+            self.falsePos += 1
+
+        if entry is not None:
+            # same key under another hashID: replaced, as the newest
+            del self.entries[key]
+            self.front[entry[0]] -= 1
+        self.entries[key] = (hashID, now)
+        self.front[hashID] += 1
+
+        if len(self.entries) > self.capacity:
+            self._evict()
+            self.evictedFull += 1
+
+        return False
+
+    def expire(self, now=None):
+        """ Forget messages older than the time window """
+        if now is None:
+            now = time.monotonic()
+        entries = self.entries
+        while entries:
+            (hashID, when) = entries[next(iter(entries))]
+            if now - when <= self.window:
+                break
+            self._evict()
+            self.evictedAged += 1
+
+    def _evict(self):
+        (key, (hashID, when)) = self.entries.popitem(last=False)
+        self.front[hashID] -= 1
+
+    def saveState(self):
+        """
+        Entries and counters, as a JSON-serializable dict; only useful
+          with explicit (not monotonic clock) times, e.g. capture times
+        """
+        state = {'entries': [list(key) + [hashID, when] for
+                             (key, (hashID, when)) in self.entries.items()]}
+        for key in _DEDUP_COUNTERS:
+            state[key] = getattr(self, key)
+        return state
+
+    def loadState(self, state):
+        """ Resume from a saveState() dict """
+        self.entries.clear()
+        self.front = array('I', bytes(4 * 65536))
+        for entry in state['entries']:
+            (hashID, when) = entry[4:]
+            self.entries[tuple(entry[:4])] = (hashID, when)
+            self.front[hashID] += 1
+        for key in _DEDUP_COUNTERS:
+            setattr(self, key, state[key])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'lookups': self.lookups,
+            'dups': self.dups,
+            'frontHits': self.frontHits,
+            'falsePos': self.falsePos,
+            'fpRate': (float(self.falsePos) / self.frontHits
+                       if self.frontHits else 0.0),
+            'evictedFull': self.evictedFull,
+            'evictedAged': self.evictedAged,
+        }
@@ -96,6 +96,17 @@ GT_OP_NAME = {
     0x2c: "OP_RSVD_2C",
 }
 
+# Opcode payload formats, for dissectors
+PDU_FMT_TLV = 0         # generic TLVs (the default)
+PDU_FMT_RAW = 1         # raw data, no TLVs
+PDU_FMT_MSG = 2         # message object, envelope-level TLVs (MSG_TLV_NAME)
+
+GT_OP_FORMAT = {
+    OP_SENDMSG: PDU_FMT_MSG,
+    OP_SYSINFO: PDU_FMT_RAW,
+    OP_READMSG: PDU_FMT_MSG,
+}
+
 
 #
 # 3a) API object level (non-message) - some data object defs go in here
@@ -122,6 +133,17 @@ GT_REGION_NAME = {
 # TLVs for API calls
 API_TLV_REGION = 0x1f   # used by OP_SET_GEO and OP_GET_GEO
 
+# OP_SYSINFO result, raw (not TLV): field name, offset, struct format
+# TENTATIVE - the 32-byte length is consistent across devices, the field
+#   offsets are a best guess and not yet confirmed on firmware updates
+SYSINFO_LEN = 0x20
+SYSINFO_FIELDS = (
+    ('fwVersion', 0, '!BBB'),   # major, minor, build
+    ('battery', 3, '!B'),       # percent
+    ('charging', 4, '!B'),      # nonzero while on external power
+    ('serial', 8, '!12s'),      # ASCII, NUL padded
+)
+
 
 #
 # 3b) Message envelope level - main message object components, which
@@ -200,3 +222,50 @@ MSGB_TLV_NAME = {
     MSGB_TLV_LCTN: "LCTN",
     MSGB_TLV_PUBK: "PUBK",
 }
+
+
+#
+# 5) Lookup tables - the name dicts above, flattened into 256-entry
+#     tuples so that any byte value can be looked up by plain indexing
+#
+
+def _nameTable(names, default):
+    return tuple(names.get(i, default) for i in range(256))
+
+
+GT_OP_NAMES = _nameTable(GT_OP_NAME, "OP_UNKNOWN")
+GT_OP_FORMATS = _nameTable(GT_OP_FORMAT, PDU_FMT_TLV)
+GT_REGION_NAMES = _nameTable(GT_REGION_NAME, "Unknown")
+MSG_CLASS_NAMES = _nameTable(MSG_CLASS_NAME, "UNKNOWN")
+MSG_TLV_NAMES = _nameTable(MSG_TLV_NAME, None)
+MSGB_TLV_NAMES = _nameTable(MSGB_TLV_NAME, None)
+
+
+#
+# 6) IntEnum types, for applications which prefer them to bare ints
+#     Created on first access, so that importing gtdefs does not import enum
+#
+
+_ENUMS = {
+    'gtOpcode': GT_OP_NAME,
+    'gtRegion': dict((k, "GT_REGION_" + n) for n, k in
+                     (("US", GT_REGION_US), ("EU", GT_REGION_EU),
+                      ("AU", GT_REGION_AU), ("NZ", GT_REGION_NZ),
+                      ("JP", GT_REGION_JP))),
+    'gtMsgClass': dict((k, "MSG_CLASS_" + n) for k, n in
+                       MSG_CLASS_NAME.items()),
+    'gtMesgTLV': dict((k, "MESG_TLV_" + n.strip()) for k, n in
+                      MSG_TLV_NAME.items()),
+    'gtMsgbTLV': dict((k, "MSGB_TLV_" + n) for k, n in MSGB_TLV_NAME.items()),
+}
+
+
+def __getattr__(name):
+    if name not in _ENUMS:
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, name))
+    from enum import IntEnum
+    value = IntEnum(name, [(n.replace("-", ""), k) for k, n in
+                           sorted(_ENUMS[name].items())], module=__name__)
+    globals()[name] = value
+    return value
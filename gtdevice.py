@@ -1,11 +1,19 @@
 """An open source driver for goTenna Mesh devices over Bluetooth LE"""
 
-from binascii import hexlify
+import os
+import json
+import time
+import queue
+import logging
+import threading
 from struct import pack, unpack
-from bluepy.btle import Peripheral, ADDR_TYPE_RANDOM, DefaultDelegate
-from pycrc16 import crc
+from bluepy.btle import (Peripheral, ADDR_TYPE_RANDOM, DefaultDelegate,
+                         BTLEException)
+from gttrace import gtTrace, gtTraceLogger, hexDump
+from gtframe import gtBtReAsm, gtEncodeFrame, GT_BLE_FRAGMENT
+from gtseq import gtSeqAllocator
 
-from gtdefs import *  # constants, lists and definitions
+from gtdefs import GT_UUID_ST, GT_UUID_TX, GT_UUID_RX
 
 # Dump GATT operations
 debugGATT = False
@@ -16,64 +24,102 @@ debugPDUS = False
 # Dump command/result
 debugCMDS = False
 
+# Persistent GATT handle cache, keyed by MAC (set to None to disable)
+handleCacheFile = os.path.join(os.path.expanduser('~'), '.pygt_handles.json')
 
-class gtBtReAsm():
+# Quiet period that ends notification draining during initialize()
+settleTime = 0.05
+
+# Time allowed for a command result
+commandTimeout = 5.0
+
+log = logging.getLogger(__name__)
+
+
+def debugTrace(trace, addr=None):
     """
-    Reassembly helper for Bluetooth frames
+    Route the legacy debug* switches to a logger on the given trace hooks
     """
-    def __init__(self, preload=""):
-        self.buf = preload
-        self.esc = False  # Escape char indicator
-
-    def receiveFrame(self, raw=""):
-        """
-        Receives frames and assembles data packets
-        """
+    hooks = []
+    if debugGATT:
+        hooks += ['on_tx_fragment', 'on_rx_fragment']
+    if debugPDUS:
+        hooks += ['on_pdu', 'on_crc_error']
+    if debugCMDS:
+        hooks += ['on_command', 'on_result']
+    if not hooks:
+        return None
+
+    # one logger per device, so interleaved output can be told apart
+    logger = logging.getLogger('pyGT.trace.%s' % (addr or 'snoop'))
+    logger.setLevel(logging.DEBUG)
+    if not logging.getLogger().handlers and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(name)s %(message)s'))
+        logger.addHandler(handler)
+    return gtTraceLogger(trace, logger, hooks)
+
+
+class gtHandleCache():
+    """
+    Persistent cache of (hndSt, hndTx, hndRx) by device MAC address,
+      which lets a reconnect skip GATT discovery
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename) as f:
+                self.handles = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.handles = {}
 
-        for i in range(len(raw)):
-            if not self.esc:
-                if raw[i] == '\x10':
-                    self.esc = True
-                else:
-                    self.buf = self.buf + raw[i]  # Just a normal byte
+    def get(self, mac):
+        return self.handles.get(mac.lower())
 
-            else:
-                self.esc = False  # Disarm
+    def put(self, mac, handles):
+        self.handles[mac.lower()] = list(handles)
+        self.save()
 
-                if raw[i] == '\x10':
-                    self.buf = self.buf + raw[i]
+    def drop(self, mac):
+        if self.handles.pop(mac.lower(), None):
+            self.save()
 
-                elif raw[i] == '\x02':  # STX
-                    if (len(self.buf) > 0):
-                        print("WARN: previous unsynced data was lost")
-                        print(hexlify(self.buf))
-                        self.buf = ''
+    def save(self):
+        try:
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.handles, f)
+            os.replace(tmp, self.filename)
+        except (IOError, OSError) as e:
+            log.warning("Could not save handle cache: %s", e)
 
-                elif raw[i] == '\x03':  # ETX
 
-                    # extract sequence number
-                    #seq = ord(self.buf[1])
+class gtCommand():
+    """
+    A command submitted to the I/O thread (see goTennaDev.startIO),
+      completed by it with the result that execute() would return
+    """
+    __slots__ = ('opcode', 'data', 'seq', 'result', 'event')
 
-                    # extract and verify crc
-                    wantcrc = unpack('!H', self.buf[-2:])[0]
-                    havecrc = crc(self.buf[:-2])
-                    if wantcrc != havecrc:
-                        print("ERROR: CRC failed, want=%04x, have=%04x" %
-                              (wantcrc, havecrc))
-                        print("for string=" + hexlify(self.buf[:-2]))
-                        return False
+    def __init__(self, opcode, data=b""):
+        self.opcode = opcode
+        self.data = data
+        self.seq = None
+        self.result = False
+        self.event = threading.Event()
 
-                    # Debug dump
-                    if debugPDUS:
-                        # FIXME! CHEATING + HARDCODED
-                        print("Rx PDU: " + "1002" + hexlify(self.buf) + "1003")
+    def complete(self, result):
+        self.result = result
+        self.event.set()
 
-                    # post the PDU in the numbered box for collection
-                    self.packetHandler(self.buf[:-2])
-                    self.buf = ''
+    def done(self):
+        return self.event.is_set()
 
-    def packetHandler(self, packet):
-        print("unhandled packet")
+    def wait(self, timeout=None):
+        """ Block until completed, returns (code, data) or False """
+        if not self.event.wait(timeout):
+            return False
+        return self.result
 
 
 class goTennaDev(Peripheral, DefaultDelegate):
@@ -81,28 +127,85 @@ class goTennaDev(Peripheral, DefaultDelegate):
     GoTenna device operations
     """
     def __init__(self, addr):
+        # Startup timing: connect, initialize and first command
+        self.tStart = time.monotonic()
+        self.startup = {}
+
         Peripheral.__init__(self, addr, addrType=ADDR_TYPE_RANDOM)
+        self.mac = addr
+        self.startup['connect'] = time.monotonic() - self.tStart
 
         self.hndSt = 0
         self.hndTx = 0
         self.hndRx = 0
-        self.seq = 0      # protocol sequence, 1-byte rolling
-        self.res = {}     # numbered boxes for response strings
+        self.seq = 0      # last protocol sequence used, 1-byte rolling
+        self.seqs = gtSeqAllocator(commandTimeout)  # commands in flight
         self.mwi = 0      # message waiting indication
         self.withDelegate(self)  # handle notifications ourselves
 
+        # Tracing hooks, shared with the reassembler
+        self.trace = gtTrace()
+        debugTrace(self.trace, addr)
+
         # Bluetooth frame reassembly
-        self.frag = gtBtReAsm()
+        self.frag = gtBtReAsm(trace=self.trace)
         self.frag.packetHandler = self.receivePacket
 
+        # I/O thread mode (see startIO)
+        self.ioThread = None
+        self.ioQueue = queue.Queue()
+        self.ioLock = threading.Lock()
+        self.ioError = None
+
+    def reconnect(self):
+        """ Re-establish a dropped connection and initialize again """
+        self.tStart = time.monotonic()
+        self.startup = {}
+        self.connect(self.mac, ADDR_TYPE_RANDOM)
+        self.startup['connect'] = time.monotonic() - self.tStart
+        return self.initialize()
+
     def initialize(self):
+        """
+        Locate and activate the goTenna characteristics; handles cached
+          from an earlier connection are tried first
+        """
+        cache = None
+        if handleCacheFile and self.mac:
+            cache = gtHandleCache(handleCacheFile)
+            cached = cache.get(self.mac)
+            if cached:
+                (self.hndSt, self.hndTx, self.hndRx) = cached
+                log.debug("CACHED HANDLES: hndSt=%x, hndTx=%x, hndRx=%x",
+                          self.hndSt, self.hndTx, self.hndRx)
+                if self.verifyHandles() and self.activate():
+                    self.startup['cached'] = True
+                    self.startup['initialize'] = (time.monotonic() -
+                                                  self.tStart)
+                    return True
+                log.info("Cached handles failed, rediscovering")
+                cache.drop(self.mac)
+
+        if not self.discover():
+            return False
+        if not self.activate():
+            return False
+
+        if cache is not None:
+            cache.put(self.mac, (self.hndSt, self.hndTx, self.hndRx))
+        self.startup['cached'] = False
+        self.startup['initialize'] = time.monotonic() - self.tStart
+        return True
+
+    def discover(self):
+        """ Find the three goTenna handles via GATT discovery """
+        self.hndSt = self.hndTx = self.hndRx = 0
+
         # List characteristics, search for the three handles
-        if debugGATT:
-            print("Enumerating characteristics:")
+        log.debug("Enumerating characteristics:")
         for s in self.getCharacteristics():
-            if debugGATT:
-                print("  %04x-%04x (%02x): %s" %
-                      (s.handle, s.valHandle, s.properties, s.uuid))
+            log.debug("  %04x-%04x (%02x): %s",
+                      s.handle, s.valHandle, s.properties, s.uuid)
             if s.uuid == GT_UUID_ST:
                 self.hndSt = s.valHandle
             elif s.uuid == GT_UUID_TX:
@@ -110,139 +213,277 @@ class goTennaDev(Peripheral, DefaultDelegate):
             elif s.uuid == GT_UUID_RX:
                 self.hndRx = s.valHandle
 
-        if debugGATT:
-            print("HANDLES: hndSt=%x, hndTx=%x, hndRx=%x" %
-                  (self.hndSt, self.hndTx, self.hndRx))
+        log.debug("HANDLES: hndSt=%x, hndTx=%x, hndRx=%x",
+                  self.hndSt, self.hndTx, self.hndRx)
 
         # Any handles missing, bail out
         if self.hndSt == 0 or self.hndTx == 0 or self.hndRx == 0:
-            print("ERROR: Could not locate all handles")
+            log.error("Could not locate all handles")
+            return False
+        return True
+
+    def verifyHandles(self):
+        """
+        Check that the handles still belong to the goTenna characteristics
+          (a firmware update may change the GATT layout), by listing only
+          the characteristics in their range
+        """
+        want = {self.hndSt: GT_UUID_ST, self.hndTx: GT_UUID_TX,
+                self.hndRx: GT_UUID_RX}
+        try:
+            # (declarations come one handle before the values)
+            chars = self.getCharacteristics(min(want) - 1, max(want))
+        except BTLEException as e:
+            log.debug("Cached handle check failed: %s", e)
             return False
+        found = dict((c.valHandle, c.uuid) for c in chars)
+        return all(found.get(hnd) == uuid for (hnd, uuid) in want.items())
 
-        # Activate indication handles
+    def activate(self):
+        """ Enable indications and status notifications """
         try:
-            if debugGATT:
-                print ("write: 0x%04x 0200" % (self.hndRx+1))
+            log.debug("write: 0x%04x 0200", self.hndRx+1)
             self.writeCharacteristic(self.hndRx+1, b'\x02\x00', True)
         except:
-            print("ERROR: hndRx activation failed")
+            log.error("hndRx activation failed")
             return False
         # clear notifications
-        self.waitForNotifications(.5)
+        self.settle()
 
         try:
-            if debugGATT:
-                print("write: 0x%04x 0100 " % (self.hndSt+1))
+            log.debug("write: 0x%04x 0100", self.hndSt+1)
             self.writeCharacteristic(self.hndSt+1, b'\x01\x00', True)
         except:
-            print("ERROR: hndSt activation failed")
+            log.error("hndSt activation failed")
             return False
         # clear notifications
-        self.waitForNotifications(.5)
+        self.settle()
         return True
 
-    def execute(self, opcode, data=""):
+    def settle(self, limit=.5):
+        """
+        Process pending notifications until the link goes quiet for
+          settleTime, or for at most limit seconds
+        """
+        deadline = time.monotonic() + limit
+        while self.waitForNotifications(settleTime):
+            if time.monotonic() >= deadline:
+                break
+
+    def execute(self, opcode, data=b""):
         """
         Takes an opcode and data PDU on input, executes them on gotenna,
         returns a result code and data PDU or False on failure
+        In I/O thread mode, may be called from any number of threads
         """
+        if self.ioThread is not None or self.ioError is not None:
+            # (after an I/O thread failure, commands fail until restarted)
+            if threading.current_thread() is not self.ioThread:
+                return self.submit(opcode, data).wait()
 
-        # Increment sequence index, skip reserved byte 0x10
-        self.seq = (self.seq + 1) & 0xff
-        if self.seq == 0x10:
-            self.seq = 0x11
+        seq = self.sendCommand(opcode, data)
+        if seq is False:
+            return False
 
-        if debugCMDS:
-            print("CMD: %02x " % opcode + hexlify(data))
+        # wait for a response while polling for notifications
+        #   but no longer than commandTimeout (5s) without traffic
+        i = 0
+        while (i < commandTimeout * 10):
+            if not self.waitForNotifications(0.1):
+                i += 1
+            if self.seqs.ready(seq):
+                break
+
+        # collect the response, if any
+        data = self.seqs.take(seq)
+        if data is None:
+            # No data, abandon the sequence number and return empty
+            self.seqs.release(seq)
+            return False
+
+        return self.collectResult(opcode, seq, data)
 
-        txpdu = pack("BB", opcode & 0xff, self.seq) + data
+    def sendCommand(self, opcode, data=b""):
+        """
+        Frame, fragment and write a command; returns its sequence number,
+          or False if the write failed
+        """
 
-        # Calculate and append crc pre-escaping
-        send_crc = crc(txpdu)
-        txpdu += pack("!H", send_crc)
+        # Next free sequence number (never the reserved byte 0x10)
+        seq = self.seqs.allocate(opcode)
+        if seq is None:
+            log.warning("No free sequence number")
+            return False
+        self.seq = seq
 
-        # \x10 characters must be escaped as \x10 \x10
-        txpdu = txpdu.replace(b'\x10', '\x10\x10')
+        for hook in self.trace.on_command:
+            hook(opcode, self.seq, data)
 
-        # Add STX, CRC and ETX
-        txpdu = (pack("!H", GT_BLE_STX) + txpdu +
-                 pack("!H", GT_BLE_ETX))
+        for hook in self.trace.on_pdu:
+            hook('tx', pack("BB", opcode & 0xff, self.seq) + data)
 
-        if debugPDUS:
-            print("Tx PDU: " + hexlify(txpdu))
+        # Add STX, CRC and ETX; \x10 characters are escaped as \x10 \x10
+        txpdu = gtEncodeFrame(opcode, self.seq, data)
 
         # Fragmentation happens here
         sendpos = 0
         while sendpos < len(txpdu):
-            if debugGATT:
-                print("Xmit data: " + hexlify(txpdu[sendpos:sendpos+20]))
+            fragment = txpdu[sendpos:sendpos+GT_BLE_FRAGMENT]
+            for hook in self.trace.on_tx_fragment:
+                hook(self.hndTx, fragment)
             try:
-                self.writeCharacteristic(self.hndTx,
-                                         txpdu[sendpos:sendpos+20],
-                                         False)
+                self.writeCharacteristic(self.hndTx, fragment, False)
             except:
-                print("WARN: Xmit Data Failed")
+                log.warning("Xmit Data Failed")
+                self.seqs.release(seq)
                 return False
-            sendpos = sendpos+20
-
-        # wait for a response while polling for notifications
-        #   but no longer than 5 seconds (50 * 0.1)
-        i = 0
-        while (i < 50):
-            if not self.waitForNotifications(0.1):
-                i += 1
-            if self.seq in self.res:
-                break
+            sendpos = sendpos+GT_BLE_FRAGMENT
 
-        # check numbered box for a response
-        try:
-            data = self.res[self.seq]
-        except KeyError:
-            # No data, return empty
-            return False
+        return seq
 
-        # delete numbered box
-        del self.res[self.seq]
+    def collectResult(self, opcode, seq, pdu):
+        """ Turn a response PDU into the (code, data) result of a command """
 
         # XOR with opcode to normalize result code
-        code = opcode ^ unpack('B', data[0:1])[0]
-        data = data[2:]
+        code = opcode ^ pdu[0]
+        # pdu is a view of the reassembly buffer: copy the result out,
+        #   which lets the buffer be reused for the next response
+        data = bytes(pdu[2:])
 
-        if debugCMDS:
-            print("RES: %02x " % code + hexlify(data))
+        for hook in self.trace.on_result:
+            hook(opcode, code, seq, data)
+
+        if 'firstCommand' not in self.startup:
+            self.startup['firstCommand'] = time.monotonic() - self.tStart
 
         # return in an array - result code and data PDU
         return (code, data)
 
-    def receivePacket(self, buf=""):
+    def startIO(self, poll=0.02):
+        """
+        Hand all Bluetooth operations over to a dedicated I/O thread:
+          execute() then queues the command and waits for its completion,
+          so that any number of threads can share the device
+        Notifications are pumped by the I/O thread, at least every poll
+          seconds; callers must not call waitForNotifications themselves
+        """
+        with self.ioLock:
+            if self.ioThread is not None:
+                return
+            self.ioPoll = poll
+            self.ioError = None
+            self.ioThread = threading.Thread(target=self.ioLoop,
+                                             name='gtIO-%s' % self.mac)
+            self.ioThread.daemon = True
+            self.ioThread.start()
+
+    def stopIO(self):
+        """ Stop the I/O thread, failing any commands still queued """
+        # (the thread drains the queue under ioLock as it exits, so a stop
+        #   request can't be left over for the next thread)
+        with self.ioLock:
+            thread = self.ioThread
+            if thread is None or thread is threading.current_thread():
+                return
+            self.ioQueue.put(None)
+        thread.join()
+
+    def submit(self, opcode, data=b""):
+        """
+        Queue a command for the I/O thread, without waiting
+        Returns a gtCommand; its wait() gives the result
+        """
+        cmd = gtCommand(opcode, data)
+        with self.ioLock:
+            if self.ioThread is None:
+                cmd.complete(False)
+            else:
+                self.ioQueue.put(cmd)
+        return cmd
+
+    def ioLoop(self):
+        """ I/O thread: one command in flight, notifications in between """
+        current = None
+        try:
+            while True:
+                if current is None:
+                    # idle: wake up for the next command, or for polling
+                    try:
+                        cmd = self.ioQueue.get(timeout=self.ioPoll)
+                    except queue.Empty:
+                        cmd = False
+                    if cmd is None:
+                        break
+                    if cmd:
+                        cmd.seq = self.sendCommand(cmd.opcode, cmd.data)
+                        if cmd.seq is False:
+                            cmd.complete(False)
+                        else:
+                            current = cmd
+                            deadline = time.monotonic() + commandTimeout
+                    while self.waitForNotifications(0):
+                        pass
+                else:
+                    self.waitForNotifications(self.ioPoll)
+
+                if current is not None:
+                    if self.seqs.ready(current.seq):
+                        current.complete(self.collectResult(
+                            current.opcode, current.seq,
+                            self.seqs.take(current.seq)))
+                        current = None
+                    elif time.monotonic() > deadline:
+                        self.seqs.release(current.seq)
+                        current.complete(False)
+                        current = None
+        except Exception as e:
+            log.error("I/O thread failed: %s", e)
+            self.ioError = e
+
+        # shut down, failing whatever is left
+        if current is not None:
+            current.complete(False)
+        with self.ioLock:
+            self.ioThread = None
+            while True:
+                try:
+                    cmd = self.ioQueue.get_nowait()
+                except queue.Empty:
+                    break
+                if cmd is not None:
+                    cmd.complete(False)
+
+    def disconnect(self):
+        self.stopIO()
+        Peripheral.disconnect(self)
+
+    def receivePacket(self, buf=b""):
         # called from the packet reassembler when full packet received
 
         # extract sequence number
-        seq = ord(buf[1])
-        # post the PDU in the numbered box for collection
-        self.res[seq] = buf
+        seq = buf[1]
+        # hand the PDU to the command waiting for it, if there is one
+        self.seqs.post(seq, buf)
 
     def mwiChange(self):
         # called on new message waiting indication
-        if debugCMDS:
-            print("MWI has been raised")
+        log.debug("MWI has been raised")
 
     def handleNotification(self, hnd, data):
         """
         Notification handler, called from BT stack
         """
+        for hook in self.trace.on_rx_fragment:
+            hook(hnd, data)
+
         if hnd == self.hndSt:
-            if debugGATT:
-                print("Rcvd status: " + hexlify(data))
             (want_mwi,) = unpack('B', data)
             if self.mwi != want_mwi:
                 self.mwi = want_mwi
                 self.mwiChange()
 
         elif hnd == self.hndRx:
-            if debugGATT:
-                print("Rcvd data: " + hexlify(data))
             # self.receive(data)
             self.frag.receiveFrame(data)
         else:
-            print("WARN: Rcvd via unknown hnd %x: " % hnd + hexlify(data))
+            log.warning("Rcvd via unknown hnd %x: %s", hnd, hexDump(data))
@@ -0,0 +1,305 @@
+""" goTenna BLE framing - part of pyGT https://github.com/sybip/pyGT """
+
+"""
+Byte stuffing used by the goTenna BLE protocol: PDUs are sent as
+  DLE STX <body> DLE ETX, where every DLE (0x10) in the body is doubled
+  and body is opcode(1) seq(1) payload CRC16(2)
+
+Shared by the device driver, the simulator (gtsim) and gtsnoop
+"""
+
+import logging
+from struct import pack
+
+from pycrc16 import crc
+from gttrace import gtTrace, hexDump
+
+log = logging.getLogger(__name__)
+
+GT_DLE = 0x10
+GT_STX = 0x02
+GT_ETX = 0x03
+
+# Max GATT write / notification size
+GT_BLE_FRAGMENT = 20
+
+# Longest PDU accepted (unescaped); longer ones can only be line noise
+GT_MAX_PDU = 4096
+
+
+def gtEscape(data):
+    """ Double every DLE byte in data """
+    return bytes(data).replace(b'\x10', b'\x10\x10')
+
+
+def gtUnescapeScan(data, pos=0, esc=False):
+    """
+    Unescape data from pos, stopping at its end or after a control
+      sequence (DLE followed by anything but DLE)
+    esc is the escape state carried over from the previous chunk
+    Returns (unescaped bytes, new pos, esc, control byte or -1)
+    """
+    if not isinstance(data, (bytes, bytearray)):
+        data = bytes(data)
+    out = bytearray()
+    end = len(data)
+
+    if esc:
+        if pos >= end:
+            return bytes(out), pos, True, -1
+        c = data[pos]
+        pos += 1
+        if c != GT_DLE:
+            return bytes(out), pos, False, c
+        out.append(GT_DLE)
+
+    # copy runs of plain bytes in bulk, stop at each DLE
+    while True:
+        i = data.find(b'\x10', pos)
+        if i < 0:
+            out += data[pos:]
+            return bytes(out), end, False, -1
+        out += data[pos:i]
+        if i + 1 >= end:
+            return bytes(out), end, True, -1
+        c = data[i+1]
+        pos = i + 2
+        if c != GT_DLE:
+            return bytes(out), pos, False, c
+        out.append(GT_DLE)
+
+
+def gtUnescapeInto(out, at, data, pos=0, esc=False):
+    """
+    gtUnescapeScan, writing the unescaped bytes into the bytearray out
+      from offset at, instead of returning them as a new chunk
+    out is grown as needed, never shrunk, so that it can be reused
+    Returns (offset after the last byte written, new pos, esc,
+      control byte or -1)
+    """
+    if not isinstance(data, (bytes, bytearray)):
+        data = bytes(data)
+    if not 0 <= at <= len(out):
+        raise ValueError('offset outside of buffer')
+    view = memoryview(data)
+    end = len(data)
+
+    if esc:
+        if pos >= end:
+            return at, pos, True, -1
+        c = data[pos]
+        pos += 1
+        if c != GT_DLE:
+            return at, pos, False, c
+        out[at:at+1] = b'\x10'
+        at += 1
+
+    while True:
+        i = data.find(b'\x10', pos)
+        if i < 0:
+            out[at:at+end-pos] = view[pos:]
+            return at + end - pos, end, False, -1
+        out[at:at+i-pos] = view[pos:i]
+        at += i - pos
+        if i + 1 >= end:
+            return at, end, True, -1
+        c = data[i+1]
+        pos = i + 2
+        if c != GT_DLE:
+            return at, pos, False, c
+        out[at:at+1] = b'\x10'
+        at += 1
+
+
+# Pure Python versions, kept for reference and equivalence testing
+gtEscapePy = gtEscape
+gtUnescapeScanPy = gtUnescapeScan
+gtUnescapeIntoPy = gtUnescapeInto
+
+try:
+    from _gtaccel import escape as gtEscape  # noqa: F811
+    from _gtaccel import unescape_scan as gtUnescapeScan  # noqa: F811
+    from _gtaccel import unescape_into as gtUnescapeInto  # noqa: F811
+except ImportError:
+    pass
+
+
+def gtEncodeFrame(opcode, seq, payload=b''):
+    """
+    Build a complete, escaped protocol frame (DLE STX ... DLE ETX)
+      for a PDU: opcode, seq, payload and CRC
+    """
+    txpdu = pack('BB', opcode & 0xff, seq & 0xff) + payload
+    txpdu += pack('!H', crc(txpdu))
+    return b'\x10\x02' + gtEscape(txpdu) + b'\x10\x03'
+
+
+def gtFragments(frame, size=GT_BLE_FRAGMENT):
+    """ Split an encoded frame into GATT sized fragments """
+    view = memoryview(frame)
+    return [view[i:i + size] for i in range(0, len(frame), size)]
+
+
+_DECODER_COUNTERS = ('pdus', 'crcErrors', 'runts', 'lostSync', 'overruns')
+
+
+class gtFrameDecoder():
+    """
+    Incremental frame decoder: feed() it raw GATT data with arbitrary
+      chunk boundaries, and it yields each complete, CRC-checked PDU
+      (opcode, seq and payload, without the CRC)
+
+    Fragments are unescaped straight into a buffer, and PDUs yielded as
+      memoryviews of it: nothing is copied on the way. The buffer is
+      reused for the next PDU, unless views of the last one are still
+      held, in which case a new one is started.
+    """
+    def __init__(self, trace=None):
+        self.buf = bytearray()
+        self.fill = 0       # bytes of buf used by the PDU being decoded
+        self.esc = False    # Escape char indicator
+        self.held = False   # buf holds a PDU handed out as a view
+        self.trace = trace if trace is not None else gtTrace()
+
+        self.pdus = 0         # good PDUs decoded
+        self.crcErrors = 0    # PDUs dropped on CRC mismatch
+        self.runts = 0        # PDUs too short to carry a CRC
+        self.lostSync = 0     # partial PDUs discarded on STX
+        self.overruns = 0     # partial PDUs discarded for length
+
+    def saveState(self):
+        """ Partial PDU and counters, as a JSON-serializable dict """
+        state = {'buf': '' if self.held else self.buf[:self.fill].hex(),
+                 'esc': self.esc}
+        for key in _DECODER_COUNTERS:
+            state[key] = getattr(self, key)
+        return state
+
+    def loadState(self, state):
+        """ Resume from a saveState() dict """
+        self.buf = bytearray.fromhex(state['buf'])
+        self.fill = len(self.buf)
+        self.held = False
+        self.esc = state['esc']
+        for key in _DECODER_COUNTERS:
+            setattr(self, key, state[key])
+
+    def feed(self, raw):
+        pos = 0
+        while pos < len(raw):
+            if self.held:
+                self.reclaim()
+
+            # Unescape up to the next control sequence (or end of raw)
+            (self.fill, pos, self.esc, ctrl) = gtUnescapeInto(
+                self.buf, self.fill, raw, pos, self.esc)
+            if self.fill > GT_MAX_PDU:
+                self.overruns += 1
+                self.fill = 0
+
+            if ctrl == GT_STX:
+                if self.fill:
+                    self.lostSync += 1
+                    log.debug("previous unsynced data was lost: %s",
+                              hexDump(self.buf[:self.fill]))
+                    self.fill = 0
+
+            elif ctrl == GT_ETX:
+                pdu = self.endPDU()
+                if pdu is not None:
+                    yield pdu
+                    # drop our reference, so that the buffer can be reused
+                    del pdu
+
+    def endPDU(self):
+        """ Check the PDU in the buffer; returns a view of it, or None """
+        (buf, end) = (self.buf, self.fill)
+        if end < 4:
+            self.runts += 1
+            self.fill = 0
+            return None
+
+        # extract and verify crc
+        self.held = True
+        pdu = memoryview(buf)[:end-2]
+        wantcrc = (buf[end-2] << 8) | buf[end-1]
+        havecrc = crc(pdu)
+        if wantcrc != havecrc:
+            self.crcErrors += 1
+            for hook in self.trace.on_crc_error:
+                hook(wantcrc, havecrc, pdu)
+            return None
+
+        self.pdus += 1
+        for hook in self.trace.on_pdu:
+            hook('rx', pdu)
+        return pdu
+
+    def reclaim(self):
+        """ Make the buffer available for the next PDU """
+        self.held = False
+        self.fill = 0
+        try:
+            # (a bytearray can't be resized while views of it exist)
+            self.buf.append(0)
+            self.buf.pop()
+        except BufferError:
+            # the last PDU is still in use: leave the buffer to it
+            self.buf = bytearray(len(self.buf))
+
+
+class gtBtReAsm(gtFrameDecoder):
+    """
+    Reassembly helper for Bluetooth frames
+      (callback flavour of gtFrameDecoder: each complete PDU is passed
+       to packetHandler, which users are expected to override)
+    """
+    def __init__(self, preload=b"", trace=None):
+        gtFrameDecoder.__init__(self, trace)
+        self.buf = bytearray(preload)
+        self.fill = len(self.buf)
+
+    def receiveFrame(self, raw=b""):
+        """
+        Receives frames and assembles data packets
+        Returns False if a packet was dropped on CRC error
+        """
+        crcErrors = self.crcErrors
+        for pdu in self.feed(raw):
+            # post the PDU in the numbered box for collection
+            self.packetHandler(pdu)
+            del pdu     # (before the next PDU, so the buffer can be reused)
+        if self.crcErrors != crcErrors:
+            return False
+
+    def packetHandler(self, packet):
+        log.warning("unhandled packet: %s", hexDump(packet))
+
+
+if __name__ == '__main__':
+    # Throughput benchmark, plain and escape-heavy payloads
+    import os
+    import time
+
+    payloads = {
+        'random': [os.urandom(200) for i in range(500)],
+        'escape-heavy': [b'\x10\x02\x10\x03' * 50 for i in range(500)],
+    }
+    for name, data in payloads.items():
+        t0 = time.perf_counter()
+        frames = [gtEncodeFrame(0x03, 1, p) for p in data]
+        dt = time.perf_counter() - t0
+        print("%-13s gtEncodeFrame  encode: %7.2f MB/s" %
+              (name, len(data) * 200 / dt / 1e6))
+
+        stream = b''.join(bytes(f) for f in frames)
+        dec = gtFrameDecoder()
+        t0 = time.perf_counter()
+        n = 0
+        for i in range(0, len(stream), GT_BLE_FRAGMENT):
+            for pdu in dec.feed(stream[i:i + GT_BLE_FRAGMENT]):
+                n += 1
+        dt = time.perf_counter() - t0
+        assert n == len(data) and dec.crcErrors == 0
+        print("%-13s gtFrameDecoder decode: %7.2f MB/s" %
+              (name, len(stream) / dt / 1e6))
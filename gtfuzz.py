@@ -0,0 +1,325 @@
+#!/usr/bin/python
+
+""" gtfuzz.py
+Coverage guided fuzzing of the parsers of untrusted radio data, with
+  per-byte time budgets
+
+Each target parser is fed mutations of valid seed inputs; an input which
+  reaches new lines of pyGT code joins the corpus for further mutation.
+  Every execution is checked for:
+ - exceptions other than those the parser documents
+ - output: prints, or log records of WARNING and above (a flood of
+   malformed input must not turn into a log storm)
+Separately, gtScaling() times pathological inputs at growing sizes: the
+  time per byte must stay flat, i.e. no parser may be quadratic.
+
+With atheris installed (pip install atheris), -a hands a target over to
+  libFuzzer instead of the built-in mutator.
+"""
+
+import io
+import os
+import sys
+import time
+import random
+import logging
+import contextlib
+from struct import pack
+
+from pycrc16 import crc
+from pyTLV import tlvRead, tlvPack
+from gtframe import gtBtReAsm, gtEncodeFrame, GT_BLE_FRAGMENT
+from gtapiobj import gtMakeAPIMsg, gtReadAPIMsg
+from gtairobj import gtMakeAirMsg, gtReadAirMsg
+from compatGTA import gtMakeGTABlobMsg, gtReadGTABlob
+from compatTAK import gtMakeTAKBlobMsg, gtMakeTAKBlobPLI, gtReadTAKBlob
+from gtsegment import gtSegment, gtReadSegment
+from gtstate import gtGuessSysInfo, gtReadRegion
+from gtdefs import (MSG_CLASS_P2P, MSG_CLASS_GROUP, MSG_CLASS_SHOUT,
+                    MSG_CLASS_EMERG, API_TLV_REGION, OP_READMSG)
+
+# Largest mutated input
+FUZZ_MAX_LEN = 1024
+
+# Time per byte may grow by at most this factor over an 8x larger input
+FUZZ_SCALING_BUDGET = 3.0
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+def _frames(data):
+    """ Feed raw GATT data to a reassembler, in fragment sized chunks """
+    frag = gtBtReAsm()
+    frag.packetHandler = lambda pdu: None
+    for pos in range(0, len(data), GT_BLE_FRAGMENT):
+        frag.receiveFrame(data[pos:pos+GT_BLE_FRAGMENT])
+
+
+def _tak(data, keys={}):
+    return gtReadTAKBlob(data, keys)
+
+
+def _withCRC(body):
+    return body + pack('!H', crc(body))
+
+
+def _seeds():
+    """ Valid inputs per target """
+    gta = gtMakeGTABlobMsg('Hello world', 'FUZZ')
+    tak = [gtMakeTAKBlobMsg(b'FUZZ', b'roger that'),
+           gtMakeTAKBlobPLI(b'ANDROID-1', b'a-f-G-U-C', b'FUZZ', b'm-g',
+                            51.9, 4.05, 12.5, b'Cyan', 60),
+           gtMakeTAKBlobPLI(b'ANDROID-1', b'a-f-G-U-C', b'FUZZ', b'm-g',
+                            51.9, 4.05, 12.5, b'Cyan', 60, compact=True,
+                            compress=True)]
+    msgs = [(gta, MSG_CLASS_SHOUT, 0), (tak[0], MSG_CLASS_P2P, 0x1234),
+            (tak[1], MSG_CLASS_GROUP, 0x5678), (b'', MSG_CLASS_EMERG, 0)]
+    api = [gtMakeAPIMsg(blob, c, 0x3fff, 0x1122334455, dest)
+           for (blob, c, dest) in msgs]
+    air = [gtMakeAirMsg(blob, c, 0x3fff, 0x1122334455, dest)
+           for (blob, c, dest) in msgs]
+    return {
+        'tlv': [api[0], gta[:-2]],
+        'frame': [gtEncodeFrame(0x40 | OP_READMSG, 7, pdu) for pdu in api] +
+                 [gtEncodeFrame(0x04, 0x0f, b'\x10\x10\x02\x03')],
+        'api': api,
+        'air': air,
+        'gta': [gta, gtMakeGTABlobMsg('compressed text', compress=True)],
+        'tak': tak,
+        'segment': gtSegment(os.urandom(300), codec=0)[1][:2],
+        'sysinfo': [bytes(range(0x20))],
+        'region': [pack('BBB', API_TLV_REGION, 1, 2)],
+    }
+
+
+def _pathological(n):
+    """ Inputs of about n bytes, shaped to maximize work per byte """
+    many = tlvPack(0x04, b'') * (n // 2)
+    return {
+        'tlv': many,
+        'frame': b'\x10' * n,
+        'frame-sync': b'\x10\x02\x00' * (n // 3),
+        'frame-open': b'\x10\x02' + b'\x00' * n,
+        'api': many,
+        'air': b'\x23\x00' * (n // 2) + bytes(20),
+        'gta': _withCRC(many),
+        'tak': _withCRC(b';' * n),
+        'tak-gta': _withCRC(b'\x01\x01\x30\x03\x01' +
+                            tlvPack(0x04, b'A' * 200) * (n // 202)),
+    }
+
+
+# target -> (parser, exceptions it may raise)
+FUZZ_TARGETS = {
+    'tlv': (lambda data: list(tlvRead(data)), (ValueError, )),
+    'frame': (_frames, ()),
+    'api': (gtReadAPIMsg, ()),
+    'air': (gtReadAirMsg, ()),
+    'gta': (gtReadGTABlob, ()),
+    'tak': (_tak, ()),
+    'segment': (gtReadSegment, ()),
+    'sysinfo': (gtGuessSysInfo, ()),
+    'region': (gtReadRegion, ()),
+}
+
+
+def _mutate(rnd, data, corpus):
+    data = bytearray(data)
+    for i in range(rnd.randint(1, 4)):
+        op = rnd.randrange(8)
+        pos = rnd.randint(0, len(data))
+        if op == 0 and data:
+            data[min(pos, len(data)-1)] ^= 1 << rnd.randrange(8)
+        elif op == 1 and data:
+            data[min(pos, len(data)-1)] = rnd.choice(
+                (0, 1, 2, 3, 0x10, 0x7f, 0x80, 0xfb, 0xff))
+        elif op == 2:
+            data[pos:pos] = os.urandom(rnd.randint(1, 8))
+        elif op == 3:
+            del data[pos:pos + rnd.randint(1, 16)]
+        elif op == 4:
+            del data[pos:]
+        elif op == 5 and data:
+            # duplicate a chunk
+            end = rnd.randint(pos, len(data))
+            data[end:end] = data[pos:end]
+        elif op == 6:
+            # splice with another corpus entry
+            other = rnd.choice(corpus)
+            data[pos:] = other[rnd.randint(0, len(other)):]
+        else:
+            data[pos:pos] = rnd.choice((b'\x10', b'\x10\x02', b'\x10\x03',
+                                        b'\xfb\x10', b'\x01\x01\x30\x03'))
+    return bytes(data[:FUZZ_MAX_LEN])
+
+
+class _warnings(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def fuzzCheck(target, data, lines=None):
+    """
+    Run one input through a target
+    Returns None if all is well, else a description of the violation
+    lines - optional set, extended with the (file, line) pairs executed
+    """
+    (parse, allowed) = FUZZ_TARGETS[target]
+    out = io.StringIO()
+    watch = _warnings()
+    root = logging.getLogger()
+    root.addHandler(watch)
+    level = root.level
+    root.setLevel(logging.WARNING)
+
+    def tracer(frame, event, arg):
+        if frame.f_code.co_filename.startswith(_here):
+            lines.add((frame.f_code.co_filename, frame.f_lineno))
+            return tracer
+        return None
+
+    try:
+        if lines is not None:
+            sys.settrace(tracer)
+        with contextlib.redirect_stdout(out):
+            parse(data)
+    except allowed:
+        pass
+    except Exception as e:
+        return "%s: %s" % (type(e).__name__, e)
+    finally:
+        sys.settrace(None)
+        root.removeHandler(watch)
+        root.setLevel(level)
+
+    if out.getvalue():
+        return "printed: %r" % out.getvalue()[:80]
+    if watch.records:
+        return "logged: %s" % watch.records[0].getMessage()[:80]
+    return None
+
+
+def gtFuzz(target, iterations=10000, seed=0, seeds=None):
+    """
+    Fuzz a target; returns {'execs', 'corpus', 'lines', 'failures'},
+      failures being a list of (input, violation)
+    """
+    rnd = random.Random(seed)
+    corpus = list(seeds if seeds is not None else _seeds()[target])
+    execs = len(corpus) + iterations
+    lines = set()
+    failures = []
+    for data in corpus:
+        problem = fuzzCheck(target, data, lines)
+        if problem:
+            failures.append((data, problem))
+
+    for i in range(iterations):
+        data = _mutate(rnd, rnd.choice(corpus), corpus)
+        known = len(lines)
+        problem = fuzzCheck(target, data, lines)
+        if problem:
+            failures.append((data, problem))
+        elif len(lines) > known:
+            corpus.append(data)
+
+    return {'execs': execs, 'corpus': len(corpus),
+            'lines': len(lines), 'failures': failures}
+
+
+def gtScaling(size=8192, factor=8, repeat=3):
+    """
+    Time per byte of each pathological input at size and factor*size
+    Returns {name: (us/byte small, us/byte large, growth)}
+    """
+    def perByte(parse, data):
+        best = None
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            try:
+                parse(data)
+            except ValueError:
+                pass
+            dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        return best / len(data) * 1e6
+
+    small = _pathological(size)
+    large = _pathological(size * factor)
+    res = {}
+    for name in small:
+        (parse, allowed) = FUZZ_TARGETS[name.split('-')[0]]
+        a = perByte(parse, small[name])
+        b = perByte(parse, large[name])
+        res[name] = (a, b, b / a)
+    return res
+
+
+def _atheris(target):
+    import atheris
+    (parse, allowed) = FUZZ_TARGETS[target]
+
+    def one(data):
+        try:
+            parse(data)
+        except allowed:
+            pass
+
+    atheris.Setup(sys.argv[:1] + sys.argv[3:], one)
+    atheris.Fuzz()
+
+
+def giveHelp():
+    print("\npyGT parser fuzzer")
+    print("\nUsage: %s [-n iterations] [-s seed] [target ...]" % sys.argv[0])
+    print("       %s -a target [libFuzzer options]\n" % sys.argv[0])
+    print("  targets: " + " ".join(sorted(FUZZ_TARGETS)))
+
+
+def main():
+    import getopt
+
+    if sys.argv[1:2] == ['-a'] and len(sys.argv) > 2:
+        _atheris(sys.argv[2])
+        return
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:s:")
+        opts = dict(opts)
+        iterations = int(opts.get('-n', 10000))
+        seed = int(opts.get('-s', 0))
+    except (getopt.GetoptError, ValueError):
+        giveHelp()
+        sys.exit(-1)
+    targets = args or sorted(FUZZ_TARGETS)
+    if any(t not in FUZZ_TARGETS for t in targets):
+        giveHelp()
+        sys.exit(-1)
+
+    failed = False
+    for target in targets:
+        t0 = time.perf_counter()
+        res = gtFuzz(target, iterations, seed)
+        dt = time.perf_counter() - t0
+        print("%-8s %6d execs in %5.1fs, corpus %4d, %4d lines, %d failures" %
+              (target, iterations, dt, res['corpus'], res['lines'],
+               len(res['failures'])))
+        for (data, problem) in res['failures'][:5]:
+            failed = True
+            print("  %s <- %s" % (problem, data.hex()))
+
+    print("\n%-10s %10s %10s %7s" % ("input", "us/B", "us/B x8", "growth"))
+    for name, (a, b, growth) in sorted(gtScaling().items()):
+        over = growth > FUZZ_SCALING_BUDGET
+        failed = failed or over
+        print("%-10s %10.3f %10.3f %6.1fx%s" %
+              (name, a, b, growth, "  OVER BUDGET" if over else ""))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+
+""" gtimportbench.py
+Import-time benchmark for the pyGT entry points, via python -X importtime
+
+Each module is imported in a fresh interpreter; reported are its own
+  cumulative import time and whether it dragged in a heavy backend
+"""
+
+import subprocess
+import sys
+
+ENTRY_POINTS = ['pyTLV', 'pycrc16', 'pygth16', 'gtcodec', 'gtapiobj',
+                'gtairobj', 'compatGTA', 'compatTAK', 'gtframe', 'gtdedup',
+                'gtstore', 'gtsnoop', 'gtsim', 'gtdevice']
+
+HEAVY_BACKENDS = ['bluepy', 'cryptography']
+
+
+def importTime(module, python=sys.executable):
+    """
+    Returns (cumulative import time in us, set of heavy backends loaded)
+      or (None, error text) if the import failed
+    """
+    proc = subprocess.run([python, '-X', 'importtime', '-c',
+                           'import %s' % module],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    total = None
+    heavy = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        if name.split('.')[0] in HEAVY_BACKENDS:
+            heavy.add(name.split('.')[0])
+        if name == module:
+            total = int(fields[1])
+    if proc.returncode:
+        return None, proc.stderr.strip().splitlines()[-1]
+    return total, heavy
+
+
+def main():
+    modules = sys.argv[1:] or ENTRY_POINTS
+    print("%-12s %10s  %s" % ("module", "import us", "heavy backends"))
+    for module in modules:
+        (total, heavy) = importTime(module)
+        if total is None:
+            print("%-12s %10s  %s" % (module, "FAILED", heavy))
+        else:
+            print("%-12s %10d  %s" % (module, total,
+                                      ", ".join(sorted(heavy)) or "-"))
+
+
+if __name__ == "__main__":
+    main()
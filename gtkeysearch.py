@@ -0,0 +1,303 @@
+#!/usr/bin/python
+
+""" gtkeysearch.py
+Find which of a set of candidate keys decrypts each encrypted TAK blob
+  of an archive, for after-action review
+
+Instead of fully decrypting every blob with every key (what
+  gtReadTAKBlob does, one blob at a time), only the first ciphertext
+  block is tried: for each key, the first blocks of all blobs go through
+  a single AES-ECB call and are XORed with their IVs, and the resulting
+  16 bytes must look like the start of a PLI or chat text. The rare
+  candidates that pass are confirmed by a full decryption and parse.
+  Keys are spread across a process pool.
+"""
+
+import sys
+import time
+import codecs
+from binascii import a2b_base64, unhexlify
+
+from pycrc16 import crc
+from gtcompress import gtExpandBlob, PLI_BIN_MARK
+from compatTAK import (_aes, aesDecrypt, parseClearText, BLOCK_SIZE,
+                       GTAK_TYPE_MSG, GTAK_TYPE_PLI)
+from compatGTA import gtReadGTABlob, gtKeyring
+from gtdefs import MSGB_TLV_TEXT
+
+
+def takCipherGram(blob):
+    """
+    Extract the encrypted payload (IV + ciphertext) of a TAK blob
+    Returns (objType, cipherGram), or None if the blob is invalid,
+      in cleartext, or of a length that can't be AES-CBC
+    """
+    try:
+        blob = gtExpandBlob(blob)
+    except ValueError:
+        return None
+    if len(blob) < 2 or int.from_bytes(blob[-2:], 'big') != crc(blob[:-2]):
+        return None
+
+    if blob[:4] == b'\x01\x01\x30\x03':
+        m = gtReadGTABlob(blob)
+        if not m or MSGB_TLV_TEXT not in m:
+            return None
+        (objType, payload) = (GTAK_TYPE_MSG, m[MSGB_TLV_TEXT])
+        if parseClearText(payload, objType):
+            return None
+        try:
+            payload = a2b_base64(payload)
+        except ValueError:
+            return None
+    else:
+        (objType, payload) = (GTAK_TYPE_PLI, blob[:-2])
+        if parseClearText(payload, objType):
+            return None
+
+    if len(payload) < 2 * BLOCK_SIZE or len(payload) % BLOCK_SIZE:
+        return None
+    return (objType, payload)
+
+
+_utf8 = codecs.getincrementaldecoder('utf8')
+
+
+def plausiblePrefix(block, objType, last=False):
+    """
+    Could block be the first 16 bytes of a cleartext of this type?
+      PLIs start with a printable uuid (or the binary PLI mark), chats
+      with printable UTF-8 text (possibly cut inside a character)
+    last - the block is also the last one, and ends in PKCS padding
+    """
+    if last:
+        pad = block[-1]
+        if not 1 <= pad <= BLOCK_SIZE or block[-pad:] != block[-1:] * pad:
+            return False
+        block = block[:-pad]
+    if objType == GTAK_TYPE_PLI:
+        return block[:2] == PLI_BIN_MARK or all(
+            0x20 <= c < 0x7f for c in block)
+    try:
+        return _utf8().decode(block, False).isprintable()
+    except UnicodeDecodeError:
+        return False
+
+
+def _table(good):
+    """ bytes.translate table: 1 for the byte values in good, else 0 """
+    return bytes(1 if c in good else 0 for c in range(256))
+
+
+# Byte values which may appear in the first block, by object type
+_ASCII = range(0x20, 0x7f)
+_PLAUSIBLE = {
+    GTAK_TYPE_PLI: _table(_ASCII),
+    GTAK_TYPE_MSG: _table(set(_ASCII) | set(range(0x80, 0x100))),
+}
+_BINMARK = (_table((PLI_BIN_MARK[0], )), _table((PLI_BIN_MARK[1], )))
+# Same, for single block payloads (which end in PKCS padding)
+_PADDING = range(1, BLOCK_SIZE + 1)
+_PLAUSIBLE_LAST = {
+    GTAK_TYPE_PLI: _table(set(_ASCII) | set(_PADDING)),
+    GTAK_TYPE_MSG: _table(set(_ASCII) | set(_PADDING) |
+                          set(range(0x80, 0x100))),
+}
+
+
+def _prefilter(clear, objType, last=False):
+    """
+    Indices of the blocks of clear which pass a byte class check,
+      computed a column at a time (byte k of every block) on big ints
+      so that no Python code runs per block
+    """
+    n = len(clear) // BLOCK_SIZE
+    table = (_PLAUSIBLE_LAST if last else _PLAUSIBLE)[objType]
+    acc = -1
+    for k in range(BLOCK_SIZE):
+        acc &= int.from_bytes(clear[k::BLOCK_SIZE].translate(table), 'big')
+        if not acc:
+            break
+    if objType == GTAK_TYPE_PLI:
+        acc |= (int.from_bytes(clear[0::BLOCK_SIZE].translate(_BINMARK[0]),
+                               'big') &
+                int.from_bytes(clear[1::BLOCK_SIZE].translate(_BINMARK[1]),
+                               'big'))
+    if not acc:
+        return []
+    mask = acc.to_bytes(n, 'big')
+    found = []
+    pos = mask.find(1)
+    while pos >= 0:
+        found.append(pos)
+        pos = mask.find(1, pos + 1)
+    return found
+
+
+# Corpus of the current worker (set by _workerInit)
+_corpus = None
+
+
+def _workerInit(types, grams):
+    """
+    Group the corpus by object type and whether the payload is a single
+      block: (type, single, indices, IVs, first blocks)
+    """
+    global _corpus
+    _corpus = []
+    groups = {}
+    for (i, gram) in enumerate(grams):
+        key = (types[i], len(gram) == 2 * BLOCK_SIZE)
+        groups.setdefault(key, []).append(i)
+    for ((objType, single), idx) in groups.items():
+        ivs = b''.join(grams[i][:BLOCK_SIZE] for i in idx)
+        blocks = b''.join(grams[i][BLOCK_SIZE:2*BLOCK_SIZE] for i in idx)
+        _corpus.append((objType, single, idx, int.from_bytes(ivs, 'big'),
+                        blocks))
+    _corpus.append(grams)
+
+
+def _searchKeys(keys):
+    """
+    Try keys [(keyID, key), ...] on the worker's corpus
+    Returns (matches [(blob index, keyID), ...], candidates tried)
+    """
+    (Cipher, algorithms, modes, backend) = _aes()
+    grams = _corpus[-1]
+    matches = []
+    candidates = 0
+    for (keyID, key) in keys:
+        ecb = Cipher(algorithms.AES(key), modes.ECB(), backend).decryptor()
+        for (objType, single, idx, ivs, blocks) in _corpus[:-1]:
+            clear = (int.from_bytes(ecb.update(blocks), 'big') ^
+                     ivs).to_bytes(len(blocks), 'big')
+            for j in _prefilter(clear, objType, single):
+                block = clear[j*BLOCK_SIZE:(j+1)*BLOCK_SIZE]
+                if not plausiblePrefix(block, objType, single):
+                    continue
+                candidates += 1
+                payload = aesDecrypt(grams[idx[j]], key)
+                if payload and parseClearText(payload, objType):
+                    matches.append((idx[j], keyID))
+    return (matches, candidates)
+
+
+def gtKeySearch(blobs, keys, processes=0, chunk=64):
+    """
+    Match encrypted TAK blobs with their keys
+      blobs     - list of TAK blobs (as from gtReadAPIMsg()['msgBlob'])
+      keys      - {keyID: key} or a compatGTA.gtKeyring
+      processes - size of the process pool, 0 to search in-process
+    Returns (mapping {blob index: keyID}, stats); blobs which aren't
+      encrypted TAK blobs, or match no key, are not in the mapping
+    """
+    if isinstance(keys, gtKeyring):
+        keys = keys.keys
+    keyList = [(keyID, bytes(key)) for keyID, key in keys.items()]
+
+    index = []
+    types = []
+    grams = []
+    for (i, blob) in enumerate(blobs):
+        res = takCipherGram(blob)
+        if res is not None:
+            index.append(i)
+            types.append(res[0])
+            grams.append(res[1])
+
+    chunks = [keyList[i:i+chunk] for i in range(0, len(keyList), chunk)]
+    t0 = time.perf_counter()
+    if processes and grams and chunks:
+        from multiprocessing import Pool
+        with Pool(processes, _workerInit, (types, grams)) as pool:
+            results = pool.map(_searchKeys, chunks)
+    else:
+        _workerInit(types, grams)
+        results = [_searchKeys(c) for c in chunks]
+    dt = time.perf_counter() - t0
+
+    mapping = {}
+    candidates = 0
+    for (matches, tried) in results:
+        candidates += tried
+        for (i, keyID) in matches:
+            mapping.setdefault(index[i], keyID)
+
+    trials = len(grams) * len(keyList)
+    stats = {
+        'blobs': len(blobs),
+        'encrypted': len(grams),
+        'keys': len(keyList),
+        'matched': len(mapping),
+        'candidates': candidates,
+        'seconds': dt,
+        'trialsPerSec': trials / dt if dt else 0,
+    }
+    return (mapping, stats)
+
+
+def loadBlobs(filename):
+    """
+    Blobs from a gtstore database (msgBlob column), or from a text file
+      with one hex encoded blob per line
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(16)
+    if magic == b'SQLite format 3\0':
+        import sqlite3
+        db = sqlite3.connect(filename)
+        try:
+            return [bytes(row[0]) for row in
+                    db.execute("SELECT msgBlob FROM msgs ORDER BY id")
+                    if row[0] is not None]
+        finally:
+            db.close()
+    with open(filename) as f:
+        return [unhexlify(line.strip()) for line in f if line.strip()]
+
+
+def loadKeys(filename):
+    """ Keys from a text file, one per line: [name] hexkey """
+    keys = {}
+    with open(filename) as f:
+        for (n, line) in enumerate(f):
+            fields = line.split()
+            if fields:
+                keys[fields[0] if len(fields) > 1 else str(n + 1)] = \
+                    unhexlify(fields[-1])
+    return keys
+
+
+def giveHelp():
+    print("\nTAK archive key search")
+    print("\nUsage: %s [-p processes] keyfile blobfile\n" % sys.argv[0])
+    print("  keyfile:  one key per line, [name] hexkey")
+    print("  blobfile: gtstore database, or one hex blob per line")
+
+
+def main():
+    import getopt
+    import os
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "p:")
+        processes = int(dict(opts).get('-p', os.cpu_count() or 1))
+    except (getopt.GetoptError, ValueError):
+        args = []
+    if len(args) != 2:
+        giveHelp()
+        sys.exit(-1)
+
+    keys = loadKeys(args[0])
+    blobs = loadBlobs(args[1])
+    (mapping, stats) = gtKeySearch(blobs, keys, processes)
+    for i in sorted(mapping):
+        print("%d %s" % (i, mapping[i]))
+    print("%(matched)d of %(encrypted)d encrypted blobs (%(blobs)d total) "
+          "matched, %(keys)d keys, %(candidates)d candidates, "
+          "%(seconds).2fs, %(trialsPerSec).0f blob-keys/sec" % stats,
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
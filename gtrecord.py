@@ -0,0 +1,187 @@
+""" Live session recorder - part of pyGT https://github.com/sybip/pyGT """
+
+"""
+Records the GATT traffic of a goTennaDev (every TX fragment and every RX
+  notification) into a btsnoop file that gtsnoop.py can read back
+
+The BLE callback only timestamps the fragment and appends it to a bounded
+  ring buffer; formatting and disk I/O happen in a background thread.
+  When the ring is full the oldest records are dropped (and counted)
+  rather than stalling the radio.
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import deque
+from struct import pack
+
+log = logging.getLogger(__name__)
+
+# btsnoop timestamps are microseconds since 0000-01-01 (proleptic)
+BTSNOOP_EPOCH_DELTA = 0x00dcddb30f2f8000
+
+BTSNOOP_MAGIC = b'btsnoop\0'
+BTSNOOP_VERSION = 1
+BTSNOOP_DLT_H4 = 0x3ea     # HCI UART (H4), as expected by gtsnoop
+
+# btsnoop packet flags
+BTSNOOP_FLAG_SENT = 0
+BTSNOOP_FLAG_RCVD = 1
+
+# ATT opcodes used to carry goTenna traffic
+ATT_OP_WRITE_CMD = 0x52    # TX fragments (write without response)
+ATT_OP_NOTIFY = 0x1b       # status (MWI) notifications
+ATT_OP_INDICATE = 0x1d     # RX data indications
+
+HCI_ACL_HANDLE = 0x0040    # nominal; gtsnoop does not look at it
+L2CAP_CID_ATT = 0x0004
+
+
+def btSnoopHeader():
+    """ File header for a btsnoop v1, H4 datalink capture """
+    return BTSNOOP_MAGIC + pack('>II', BTSNOOP_VERSION, BTSNOOP_DLT_H4)
+
+
+def btSnoopRecord(flags, time64, attOp, hnd, value):
+    """
+    Wrap an ATT PDU into an H4 ACL packet and a btsnoop record header
+    """
+    attLen = 3 + len(value)
+    pkt = (pack('<BHHHHBH', 0x02, HCI_ACL_HANDLE | 0x2000, attLen + 4,
+                attLen, L2CAP_CID_ATT, attOp, hnd) + value)
+    return pack('>IIIIq', len(pkt), len(pkt), flags, 0, time64) + pkt
+
+
+class gtRecorder():
+    """
+    Bounded, background-flushed btsnoop recorder for goTennaDev sessions
+      maxRecords  - ring buffer size; oldest records are dropped when full
+      flushEvery  - seconds between background flushes
+      maxBytes    - rotate when the current file would exceed this size
+      maxAge      - rotate when the current file is older (seconds)
+      backupCount - number of rotated files to keep (.1 is the newest)
+    """
+    def __init__(self, filename, maxRecords=4096, flushEvery=0.5,
+                 maxBytes=0, maxAge=0, backupCount=5):
+        self.filename = filename
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+        self.backupCount = backupCount
+        self.flushEvery = flushEvery
+
+        self.ring = deque(maxlen=maxRecords)
+        self.dropped = 0     # records lost to ring overflow
+        self.written = 0     # records committed to disk
+
+        # monotonic clock, anchored once to the wall clock for the file
+        self.monoBase = time.monotonic()
+        self.wallBase = time.time()
+
+        self.f = None
+        self.fileStart = 0
+        self.hooks = {}
+
+        self.lock = threading.Lock()   # serializes flush vs close
+        self.wake = threading.Event()
+        self.done = False
+        self.thread = None
+
+    def start(self):
+        """ Open the output file and start the background flusher """
+        self._open()
+        self.thread = threading.Thread(target=self._run,
+                                       name='gtRecorder', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Flush everything still buffered, stop the flusher, close """
+        self.done = True
+        self.wake.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        try:
+            self.flush()
+        finally:
+            with self.lock:
+                if self.f:
+                    self.f.close()
+                    self.f = None
+
+    def attach(self, dev):
+        """ Start recording the traffic of a goTennaDev """
+        def onTx(hnd, data):
+            self.record(BTSNOOP_FLAG_SENT, ATT_OP_WRITE_CMD, hnd, data)
+
+        def onRx(hnd, data):
+            self.record(BTSNOOP_FLAG_RCVD, ATT_OP_NOTIFY
+                        if hnd == dev.hndSt else ATT_OP_INDICATE, hnd, data)
+
+        self.hooks[id(dev)] = (onTx, onRx)
+        dev.trace.subscribe('on_tx_fragment', onTx)
+        dev.trace.subscribe('on_rx_fragment', onRx)
+
+    def detach(self, dev):
+        """ Stop recording a goTennaDev """
+        (onTx, onRx) = self.hooks.pop(id(dev), (None, None))
+        dev.trace.unsubscribe('on_tx_fragment', onTx)
+        dev.trace.unsubscribe('on_rx_fragment', onRx)
+
+    def record(self, flags, attOp, hnd, data):
+        """
+        Queue one fragment; called from the BLE callback, never blocks
+        """
+        if len(self.ring) == self.ring.maxlen:
+            self.dropped += 1
+        self.ring.append((time.monotonic(), flags, attOp, hnd, bytes(data)))
+
+    def flush(self):
+        """ Write all buffered records to disk, rotating as needed """
+        with self.lock:
+            if not self.f:
+                return
+            while self.ring:
+                (mono, flags, attOp, hnd, data) = self.ring.popleft()
+                time64 = BTSNOOP_EPOCH_DELTA + int(
+                    (self.wallBase + mono - self.monoBase) * 1000000)
+                rec = btSnoopRecord(flags, time64, attOp, hnd, data)
+
+                if self._dueRollover(len(rec)):
+                    self._rotate()
+                self.f.write(rec)
+                self.written += 1
+            self.f.flush()
+
+    def _run(self):
+        while not self.done:
+            self.wake.wait(self.flushEvery)
+            try:
+                self.flush()
+            except (IOError, OSError) as e:
+                log.error("recorder flush failed: %s", e)
+
+    def _open(self):
+        self.f = open(self.filename, 'wb')
+        self.f.write(btSnoopHeader())
+        self.fileStart = time.monotonic()
+
+    def _dueRollover(self, recLen):
+        if self.maxBytes and self.f.tell() + recLen > self.maxBytes:
+            # never rotate an empty file, a single record may be too big
+            return self.f.tell() > len(btSnoopHeader())
+        if self.maxAge and time.monotonic() - self.fileStart >= self.maxAge:
+            return True
+        return False
+
+    def _rotate(self):
+        self.f.close()
+        if self.backupCount > 0:
+            for i in range(self.backupCount - 1, 0, -1):
+                src = "%s.%d" % (self.filename, i)
+                if os.path.exists(src):
+                    os.replace(src, "%s.%d" % (self.filename, i + 1))
+            os.replace(self.filename, self.filename + ".1")
+        self._open()
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+
+""" gtreplay.py
+Replay a btsnoop capture (from gtrecord, bluez hcidump or Android HCI
+  snoop) through the receive stack of a goTennaDev, for stress testing
+
+Received fragments are delivered to handleNotification exactly as the
+  Bluetooth stack would deliver them, so they travel through gtBtReAsm,
+  receivePacket and, for OP_READMSG results, gtReadAPIMsg.
+"""
+
+import sys
+import time
+from struct import unpack
+
+from gtdefs import GT_OP_SUCCESS, OP_READMSG
+from gtapiobj import gtReadAPIMsg
+from gtsnoop import btSnoopFrames
+
+# ATT opcodes carrying goTenna traffic from the device
+ATT_OP_NOTIFY = 0x1b
+ATT_OP_INDICATE = 0x1d
+
+# Replay stages, for CPU accounting
+REPLAY_STAGES = ('reasm', 'packet', 'decode')
+
+
+def loadCapture(filename):
+    """
+    Read the device-to-host fragments of a capture into memory
+      (so that file I/O stays out of the measurements)
+    Returns a list of (time64, attOp, handle, value)
+    """
+    with open(filename, "rb") as f:
+        return [(time64, cmd, handle, value) for flags, time64, cmd, handle,
+                value in btSnoopFrames(f, (ATT_OP_NOTIFY, ATT_OP_INDICATE))
+                if flags == 1]
+
+
+class gtReplay():
+    """
+    Deterministic replay driver for a goTennaDev
+      speed: 1 = real time, 10 = ten times faster, 0 = as fast as possible
+    The device does not need to be connected; goTennaDev(None) will do
+    """
+    def __init__(self, dev, frames, speed=0):
+        self.dev = dev
+        self.frames = frames
+        self.speed = speed
+
+        self.fragments = 0
+        self.pdus = 0
+        self.msgs = 0
+        self.cpu = dict((stage, 0.0) for stage in REPLAY_STAGES)
+        self.elapsed = 0.0
+        self.rx = []      # PDUs received, for the decode stage
+
+        # account for the packet stage separately from reassembly
+        self.packetHandler = dev.frag.packetHandler
+        dev.frag.packetHandler = self.timedPacket
+
+    def timedPacket(self, pdu):
+        t0 = time.process_time()
+        self.packetHandler(pdu)
+        self.cpu['packet'] += time.process_time() - t0
+        self.pdus += 1
+        self.rx.append(pdu)
+
+    def deliver(self, attOp, hnd, value):
+        dev = self.dev
+        # Map capture handles onto the device, adopting them if unset
+        if attOp == ATT_OP_NOTIFY:
+            if not dev.hndSt:
+                dev.hndSt = hnd
+            hnd = dev.hndSt
+        else:
+            if not dev.hndRx:
+                dev.hndRx = hnd
+            hnd = dev.hndRx
+
+        t0 = time.process_time()
+        dev.handleNotification(hnd, value)
+        self.cpu['reasm'] += time.process_time() - t0
+        self.fragments += 1
+
+        # Decode any received messages (the device itself drops the
+        #   responses, as no commands are in flight)
+        for pdu in self.rx:
+            (opCode, ) = unpack('B', pdu[0:1])
+            if ((opCode & 0x3f) == OP_READMSG and
+                    (opCode & 0xc0) == GT_OP_SUCCESS and len(pdu) > 2):
+                t0 = time.process_time()
+                msg = gtReadAPIMsg(pdu[2:])
+                self.cpu['decode'] += time.process_time() - t0
+                if msg:
+                    self.msgs += 1
+        del self.rx[:]
+
+    def run(self, loops=1):
+        start = time.monotonic()
+        for loop in range(loops):
+            base = None
+            for (time64, attOp, hnd, value) in self.frames:
+                if self.speed:
+                    if base is None:
+                        base = (time.monotonic(), time64)
+                    due = (base[0] +
+                           (time64 - base[1]) / 1000000. / self.speed)
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.deliver(attOp, hnd, value)
+        self.elapsed += time.monotonic() - start
+        return self.report()
+
+    def report(self):
+        """ Totals over all runs so far """
+        rep = {
+            'fragments': self.fragments,
+            'pdus': self.pdus,
+            'msgs': self.msgs,
+            'elapsed': self.elapsed,
+            'pdusPerSec': self.pdus / self.elapsed if self.elapsed else 0,
+        }
+        for stage in REPLAY_STAGES:
+            rep['cpu_' + stage] = self.cpu[stage]
+        # packet stage time is also included in the reassembly time
+        rep['cpu_reasm'] -= self.cpu['packet']
+        return rep
+
+
+def giveHelp():
+    print("\ngoTenna capture replay driver")
+    print("\nUsage: %s [-s speed] [-n loops] filename\n" % sys.argv[0])
+    print("  speed: 1 = real time, 10 = 10x, 0 = as fast as possible")
+
+
+def main():
+    import getopt
+    import gtdevice
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "s:n:")
+        opts = dict(opts)
+        speed = float(opts.get('-s', 0))
+        loops = int(opts.get('-n', 1))
+    except (getopt.GetoptError, ValueError):
+        args = []
+
+    if len(args) != 1:
+        giveHelp()
+        sys.exit(-1)
+
+    replay = gtReplay(gtdevice.goTennaDev(None), loadCapture(args[0]), speed)
+    rep = replay.run(loops)
+
+    print("Fragments: %d, PDUs: %d, messages: %d" %
+          (rep['fragments'], rep['pdus'], rep['msgs']))
+    print("Elapsed: %.03fs, sustained %.0f PDUs/sec" %
+          (rep['elapsed'], rep['pdusPerSec']))
+    for stage in REPLAY_STAGES:
+        print("  %-6s CPU %.03fs (%.1f us/PDU)" %
+              (stage, rep['cpu_' + stage],
+               rep['cpu_' + stage] * 1e6 / rep['pdus'] if rep['pdus'] else 0))
+
+
+if __name__ == "__main__":
+    main()
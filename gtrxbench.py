@@ -0,0 +1,121 @@
+#!/usr/bin/python
+
+""" gtrxbench.py
+Memory cost of the receive path, from BLE notification to parsed message
+
+OP_READMSG responses are fed, fragment by fragment, to the notification
+  handler of a simulated goTennaDev; the result is collected as execute()
+  does and parsed with gtReadAPIMsg. tracemalloc measures, per message,
+  the peak of memory allocated on the way (every live copy of the
+  payload counts) and the number of blocks left allocated afterwards.
+Needs bluepy, like gtsim.
+"""
+
+import time
+import tracemalloc
+
+from gtapiobj import gtMakeAPIMsg, gtReadAPIMsg
+from gtframe import gtEncodeFrame, gtFragments
+from gtdefs import GT_OP_SUCCESS, OP_READMSG, MSG_CLASS_SHOUT
+
+# Stages of the receive path, and all of it
+RX_STAGES = ('decode', 'collect', 'parse', 'all')
+
+
+def rxFrames(blobLen):
+    """
+    OP_READMSG responses carrying a message with a blobLen byte payload,
+      as notification fragments, for every sequence number
+    Returns (message PDU length, {seq: fragments})
+    """
+    msgPDU = gtMakeAPIMsg(bytes(range(256))[:blobLen], MSG_CLASS_SHOUT,
+                          0x3fff, 0x1122334455)
+    frames = {}
+    for seq in range(256):
+        frame = gtEncodeFrame(GT_OP_SUCCESS | OP_READMSG, seq, msgPDU)
+        frames[seq] = [bytes(f) for f in gtFragments(frame)]
+    return (len(msgPDU), frames)
+
+
+def rxBench(dev, blobLen=200, count=200):
+    """
+    Returns {'pdu': message PDU length, 'us': time per message, 'blocks':
+      blocks left allocated per message, and per stage ('decode':
+      notifications to PDU, 'collect': PDU to execute() result, 'parse':
+      result to message dict, 'all' of them) the peak bytes allocated}
+    """
+    (pduLen, frames) = rxFrames(blobLen)
+    peaks = dict.fromkeys(RX_STAGES, 0)
+
+    def mark(stage=None, base=None):
+        """ Account for the peak of a stage, start the next one """
+        if stage is not None:
+            peaks[stage] += tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    def receive(trace=False):
+        seq = dev.seqs.allocate(OP_READMSG)
+        if trace:
+            base = mark()
+        for fragment in frames[seq]:
+            dev.handleNotification(dev.hndRx, fragment)
+        if trace:
+            base = mark('decode', base)
+        (code, data) = dev.collectResult(OP_READMSG, seq,
+                                         dev.seqs.take(seq))
+        if trace:
+            base = mark('collect', base)
+        msg = gtReadAPIMsg(data)
+        if trace:
+            mark('parse', base)
+        return msg
+
+    # warm up (caches, first buffers), then time
+    for i in range(10):
+        receive()
+    t0 = time.perf_counter()
+    for i in range(count):
+        receive()
+    dt = time.perf_counter() - t0
+
+    # whole path peaks, and blocks kept (the results are held)
+    results = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(count):
+        base = mark()
+        results.append(receive())
+        mark('all', base)
+    after = tracemalloc.take_snapshot()
+    # per stage peaks
+    for i in range(count):
+        receive(True)
+    tracemalloc.stop()
+    blocks = sum(s.count_diff for s in after.compare_to(before, 'filename'))
+    del results
+
+    res = dict((stage, peak / float(count)) for stage, peak in peaks.items())
+    res.update({'pdu': pduLen, 'us': dt / count * 1e6,
+                'blocks': blocks / float(count)})
+    return res
+
+
+def main():
+    from gtsim import gtSimDev, gtSimRadio
+
+    dev = gtSimDev(gtSimRadio())
+    dev.initialize()
+    print("Peak bytes allocated per message, by stage\n")
+    print("%6s " % "PDU" + " ".join("%8s" % s for s in RX_STAGES) +
+          " %10s %8s" % ("blocks/msg", "us/msg"))
+    for blobLen in (20, 100, 200):
+        res = rxBench(dev, blobLen)
+        print("%6d " % res['pdu'] +
+              " ".join("%8.0f" % res[s] for s in RX_STAGES) +
+              " %10.1f %8.1f" % (res['blocks'], res['us']))
+    dev.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/python
+
+""" gtscan.py
+Discover goTenna devices in range and connect to several of them at once
+
+Discovery goes through a scanner backend (bluepyScanner by default, or
+  any object with a scan(timeout) method returning gtAdvert tuples), so
+  that it can be driven by a fake scanner in tests.
+"""
+
+import sys
+import time
+import queue
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+from gtdefs import GT_UUID_ST, GT_UUID_TX, GT_UUID_RX
+
+log = logging.getLogger(__name__)
+
+# One advertisement: address, signal strength, advertised 128-bit service
+#   UUIDs (lowercase strings) and local name (or None)
+gtAdvert = namedtuple('gtAdvert', 'addr rssi uuids name')
+
+# Advertised UUIDs which identify a goTenna
+GT_SCAN_UUIDS = (GT_UUID_ST, GT_UUID_TX, GT_UUID_RX)
+
+# AD types of 128-bit service UUID lists, and of local names
+AD_UUID128 = (0x06, 0x07)
+AD_NAME = (0x09, 0x08)
+
+
+class scanBackend(ABC):
+    """ Discovery backend interface """
+    @abstractmethod
+    def scan(self, timeout):
+        """ Scan for timeout seconds, return a list of gtAdvert """
+
+
+class bluepyScanner(scanBackend):
+    """ bluepy's Scanner (needs root, or cap_net_admin on bluepy-helper) """
+    def __init__(self, iface=0):
+        self.iface = iface
+
+    def scan(self, timeout):
+        from bluepy.btle import Scanner
+        adverts = []
+        for entry in Scanner(self.iface).scan(timeout):
+            uuids = []
+            for adtype in AD_UUID128:
+                value = entry.getValue(adtype)
+                if isinstance(value, str):
+                    value = value.split(',')
+                uuids += [str(u).lower() for u in value or ()]
+            name = None
+            for adtype in AD_NAME:
+                name = name or entry.getValueText(adtype)
+            adverts.append(gtAdvert(entry.addr, entry.rssi, tuple(uuids),
+                                    name))
+        return adverts
+
+
+def gtRankAdverts(adverts, minRSSI=None, uuids=GT_SCAN_UUIDS):
+    """
+    Keep goTenna advertisements only (one per address, the strongest),
+      strongest signal first
+    """
+    best = {}
+    for adv in adverts:
+        if not any(u in adv.uuids for u in uuids):
+            continue
+        if minRSSI is not None and adv.rssi < minRSSI:
+            continue
+        addr = adv.addr.lower()
+        if addr not in best or adv.rssi > best[addr].rssi:
+            best[addr] = adv
+    return sorted(best.values(), key=lambda adv: -adv.rssi)
+
+
+def _goTennaDev(addr):
+    # deferred, so that gtscan can be imported (and tested) without bluepy
+    from gtdevice import goTennaDev
+    return goTennaDev(addr)
+
+
+class gtScanManager():
+    """
+    Scan, rank and connect
+      backend - scanner backend, default bluepyScanner()
+      factory - callable(addr) returning a connected device, not yet
+                initialized; default goTennaDev
+    """
+    def __init__(self, backend=None, factory=None):
+        self.backend = backend or bluepyScanner()
+        self.factory = factory or _goTennaDev
+        self.lock = threading.Lock()
+
+    def discover(self, timeout=5.0, minRSSI=None):
+        """ goTenna advertisements in range, strongest first """
+        return gtRankAdverts(self.backend.scan(timeout), minRSSI)
+
+    def connect(self, adverts, timeout=15.0, maxParallel=4):
+        """
+        Connect to and initialize the given devices, up to maxParallel
+          at a time; each one gets timeout seconds from its start
+        Returns (devices, failures): the ready devices, in the order
+          given, and {addr: reason} for the others
+        Connections still in progress at their timeout are abandoned,
+          and disconnected whenever they complete; until then, they
+          still count towards maxParallel
+        """
+        pending = list(adverts)
+        running = {}            # addr -> (slot, deadline)
+        abandoned = set()       # addrs of timed out connections, running
+        done = queue.Queue()
+        ready = {}
+        failures = {}
+
+        while pending or running:
+            while pending and len(running) + len(abandoned) < maxParallel:
+                adv = pending.pop(0)
+                slot = {'addr': adv.addr, 'abandoned': False}
+                running[adv.addr] = (slot, time.monotonic() + timeout)
+                thread = threading.Thread(target=self.connectOne,
+                                          args=(slot, done),
+                                          name='gtConnect-%s' % adv.addr)
+                thread.daemon = True
+                thread.start()
+
+            if running:
+                nearest = min(deadline for (slot, deadline)
+                              in running.values())
+                wait = max(0, nearest - time.monotonic())
+            else:
+                wait = None     # all slots held by abandoned connections
+            try:
+                slot = done.get(timeout=wait)
+            except queue.Empty:
+                slot = None
+
+            if slot is not None and slot['addr'] in running:
+                del running[slot['addr']]
+                if 'dev' in slot:
+                    ready[slot['addr']] = slot['dev']
+                else:
+                    failures[slot['addr']] = slot['error']
+            elif slot is not None:
+                abandoned.discard(slot['addr'])
+
+            now = time.monotonic()
+            with self.lock:
+                for addr, (slot, deadline) in list(running.items()):
+                    if now >= deadline and not ('dev' in slot or
+                                                'error' in slot):
+                        slot['abandoned'] = True
+                        failures[addr] = 'timeout'
+                        del running[addr]
+                        abandoned.add(addr)
+
+        devices = [ready[adv.addr] for adv in adverts if adv.addr in ready]
+        for addr, reason in failures.items():
+            log.warning("Could not connect to %s: %s", addr, reason)
+        return (devices, failures)
+
+    def connectOne(self, slot, done):
+        """ Connection thread: connect and initialize one device """
+        dev = None
+        try:
+            dev = self.factory(slot['addr'])
+            ok = dev.initialize()
+            error = None if ok else 'initialize failed'
+        except Exception as e:
+            error = e
+
+        with self.lock:
+            abandoned = slot['abandoned']
+            if not abandoned:
+                if error is None:
+                    slot['dev'] = dev
+                else:
+                    slot['error'] = error
+        if dev is not None and (abandoned or error is not None):
+            try:
+                dev.disconnect()
+            except Exception:
+                pass
+        done.put(slot)
+
+    def scanAndConnect(self, count=None, scanTime=5.0, minRSSI=None,
+                       timeout=15.0, maxParallel=4):
+        """
+        Discover, then connect to the count strongest devices (all if
+          None); returns the list of ready goTennaDev objects
+        """
+        adverts = self.discover(scanTime, minRSSI)
+        if count is not None:
+            adverts = adverts[:count]
+        return self.connect(adverts, timeout, maxParallel)[0]
+
+
+def giveHelp():
+    print("\ngoTenna scanner")
+    print("\nUsage: %s [-t scantime] [-r minrssi] [-c count]\n" % sys.argv[0])
+    print("  count: connect to the strongest count devices and report")
+
+
+def main():
+    import getopt
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "t:r:c:")
+        opts = dict(opts)
+        scanTime = float(opts.get('-t', 5))
+        minRSSI = int(opts['-r']) if '-r' in opts else None
+        count = int(opts.get('-c', 0))
+    except (getopt.GetoptError, ValueError):
+        giveHelp()
+        sys.exit(-1)
+
+    mgr = gtScanManager()
+    adverts = mgr.discover(scanTime, minRSSI)
+    for adv in adverts:
+        print("%s  %4d dBm  %s" % (adv.addr, adv.rssi, adv.name or ''))
+
+    if count:
+        (devices, failures) = mgr.connect(adverts[:count])
+        for dev in devices:
+            print("%s ready, startup %s" % (dev.mac, dev.startup))
+            dev.disconnect()
+        for addr, reason in failures.items():
+            print("%s failed: %s" % (addr, reason))
+
+
+if __name__ == "__main__":
+    main()
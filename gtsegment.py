@@ -0,0 +1,352 @@
+""" Segmentation/reassembly - part of pyGT https://github.com/sybip/pyGT """
+
+"""
+Payloads larger than one message (files, CoT XML, map tiles...) are
+  optionally compressed, then split into numbered segments, each sent
+  as the blob of a separate message:
+
+  SEGH   e0 07 xferID(2) index(2) count(2) codec(1)
+  SEGD   e1 nn chunk
+  CRC    crc16 of the above, as in GTA blobs
+
+Segment blobs carry no MSGB_TLV_TYPE element, so GTA-compatible
+  receivers which don't know about them drop them as invalid.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from struct import pack, unpack
+
+from pycrc16 import crc
+from pyTLV import tlvPack
+
+# Segment blob elements (pyGT specific)
+SEG_TLV_HEAD = 0xe0
+SEG_TLV_DATA = 0xe1
+SEG_HEAD_LEN = 7
+
+# Largest segment blob, matching the chat body limit of the TAK plugin
+SEG_MAX_BLOB = 230
+# SEGH + SEGD headers + CRC
+SEG_OVERHEAD = 2 + SEG_HEAD_LEN + 2 + 2
+
+# Compression codecs
+SEG_CODEC_NONE = 0
+SEG_CODEC_ZLIB = 1
+SEG_CODEC_LZ4 = 2
+
+SEG_CODEC_NAME = {
+    SEG_CODEC_NONE: "none",
+    SEG_CODEC_ZLIB: "zlib",
+    SEG_CODEC_LZ4: "lz4",
+}
+
+
+def _lz4():
+    """ lz4.frame if installed (pip install lz4), else None """
+    try:
+        import lz4.frame
+    except ImportError:
+        return None
+    return lz4.frame
+
+
+def segCodecs():
+    """ Codecs usable in this environment """
+    codecs = [SEG_CODEC_NONE, SEG_CODEC_ZLIB]
+    if _lz4() is not None:
+        codecs.append(SEG_CODEC_LZ4)
+    return codecs
+
+
+def segCompress(payload, codec):
+    if codec == SEG_CODEC_ZLIB:
+        import zlib
+        return zlib.compress(payload, 9)
+    if codec == SEG_CODEC_LZ4:
+        return _lz4().compress(payload, compression_level=9)
+    return payload
+
+
+def segDecompress(data, codec, limit=0):
+    """
+    Raises ValueError for unknown codecs or corrupt data, or if the
+      result would exceed limit bytes (0 = no limit)
+    """
+    try:
+        if codec == SEG_CODEC_ZLIB:
+            import zlib
+            d = zlib.decompressobj()
+            payload = d.decompress(data, limit)
+            if d.unconsumed_tail:
+                raise ValueError('exceeds %d bytes' % limit)
+            if not d.eof:
+                raise ValueError('truncated data')
+            return payload
+        if codec == SEG_CODEC_LZ4 and _lz4() is not None:
+            d = _lz4().LZ4FrameDecompressor()
+            payload = d.decompress(data, limit or -1)
+            if not d.eof:
+                if limit and len(payload) == limit:
+                    raise ValueError('exceeds %d bytes' % limit)
+                raise ValueError('truncated data')
+            return payload
+    except Exception as e:
+        raise ValueError('Decompression failed: %s' % e)
+    if codec != SEG_CODEC_NONE:
+        raise ValueError('Unsupported codec %d' % codec)
+    return data
+
+
+_xferID = [unpack('!H', os.urandom(2))[0]]
+
+
+def gtSegment(payload, maxBlob=SEG_MAX_BLOB, codec=None, xferID=None):
+    """
+    Split a payload into segment blobs, each no larger than maxBlob
+      codec: SEG_CODEC_*, or None to use the best available codec,
+             if (and only if) it makes the payload smaller
+    Returns (xferID, [blob, ...])
+    """
+    if codec is None:
+        codec = SEG_CODEC_NONE
+        data = payload
+        for c in segCodecs()[1:]:
+            packed = segCompress(payload, c)
+            if len(packed) < len(data):
+                (codec, data) = (c, packed)
+    else:
+        data = segCompress(payload, codec)
+
+    if xferID is None:
+        _xferID[0] = xferID = (_xferID[0] + 1) & 0xffff
+
+    size = min(maxBlob - SEG_OVERHEAD, 255)
+    if size <= 0:
+        raise ValueError('maxBlob too small')
+    count = max(1, -(-len(data) // size))
+    if count > 0xffff:
+        raise ValueError('Payload too large')
+
+    blobs = []
+    for index in range(count):
+        blob = (tlvPack(SEG_TLV_HEAD,
+                        pack('!HHHB', xferID, index, count, codec)) +
+                tlvPack(SEG_TLV_DATA, data[index*size:(index+1)*size]))
+        blobs.append(blob + pack('!H', crc(blob)))
+    return (xferID, blobs)
+
+
+def gtIsSegment(blob):
+    return blob[:2] == pack('BB', SEG_TLV_HEAD, SEG_HEAD_LEN)
+
+
+def gtReadSegment(blob):
+    """
+    Parse a segment blob, returns (xferID, index, count, codec, chunk)
+      or None if it's not a valid segment
+    """
+    if not gtIsSegment(blob) or len(blob) < SEG_OVERHEAD:
+        return None
+    if unpack('!H', blob[-2:])[0] != crc(blob[:-2]):
+        return None
+    (xferID, index, count, codec) = unpack('!HHHB', blob[2:9])
+    (dtype, dlen) = unpack('BB', blob[9:11])
+    if dtype != SEG_TLV_DATA or 11 + dlen != len(blob) - 2 or index >= count:
+        return None
+    return (xferID, index, count, codec, blob[11:11+dlen])
+
+
+class gtReassembler():
+    """
+    Receive side: collects segments (in any order, duplicates allowed)
+      per (sender GID, xferID) until a transfer is complete
+    Memory is bounded by maxBytes of buffered chunks across transfers;
+      the oldest transfers are evicted to make room, and transfers with
+      no progress for timeout seconds are expired
+    Decompressed payloads are limited to maxPayload bytes
+    """
+    def __init__(self, maxBytes=1 << 20, timeout=120, maxCount=4096,
+                 maxPayload=16 << 20):
+        self.maxBytes = maxBytes
+        self.maxPayload = maxPayload
+        self.timeout = timeout
+        self.maxCount = maxCount
+        self.xfers = OrderedDict()  # key -> [count, codec, chunks, last]
+        self.buffered = 0
+        # recently completed transfers, to recognize late duplicates
+        self.done = OrderedDict()   # key -> completion time
+
+        self.completed = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def feed(self, blob, fromGID=0, now=None):
+        """
+        Process one received blob; returns the reassembled (and
+          decompressed) payload when it completes a transfer, else None
+        """
+        seg = gtReadSegment(blob)
+        if seg is None:
+            self.invalid += 1
+            return None
+        (xferID, index, count, codec, chunk) = seg
+        if now is None:
+            now = time.monotonic()
+        self.expire(now)
+
+        if count > self.maxCount or len(chunk) > self.maxBytes:
+            self.invalid += 1
+            return None
+
+        key = (fromGID, xferID)
+        if key in self.done:
+            self.duplicates += 1
+            return None
+        xfer = self.xfers.get(key)
+        if xfer is None:
+            xfer = self.xfers[key] = [count, codec, {}, now]
+        elif xfer[0] != count or xfer[1] != codec:
+            # inconsistent with the transfer in progress
+            self.invalid += 1
+            return None
+
+        chunks = xfer[2]
+        if index in chunks:
+            self.duplicates += 1
+            return None
+
+        while self.buffered + len(chunk) > self.maxBytes:
+            self._evict()
+            self.evicted += 1
+            if key not in self.xfers:
+                # evicted ourselves: start over with this segment alone
+                xfer = self.xfers[key] = [count, codec, {}, now]
+                chunks = xfer[2]
+
+        chunks[index] = chunk
+        xfer[3] = now
+        self.buffered += len(chunk)
+        self.xfers.move_to_end(key)
+
+        if len(chunks) < count:
+            return None
+
+        del self.xfers[key]
+        self.done[key] = now
+        if len(self.done) > self.maxCount:
+            self.done.popitem(last=False)
+        data = b''.join(chunks[i] for i in range(count))
+        self.buffered -= len(data)
+        try:
+            payload = segDecompress(data, codec, self.maxPayload)
+        except ValueError:
+            self.invalid += 1
+            return None
+        self.completed += 1
+        return payload
+
+    def _evict(self):
+        """ Drop the least recently updated transfer """
+        (key, xfer) = self.xfers.popitem(last=False)
+        self.buffered -= sum(len(c) for c in xfer[2].values())
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        while self.done:
+            if now - next(iter(self.done.values())) < self.timeout:
+                break
+            self.done.popitem(last=False)
+        # least recently updated transfers come first
+        while self.xfers:
+            (key, xfer) = next(iter(self.xfers.items()))
+            if now - xfer[3] < self.timeout:
+                break
+            self._evict()
+            self.expired += 1
+
+    def pending(self):
+        """ Transfers in progress: {key: (received, count)} """
+        return dict((key, (len(x[2]), x[0])) for key, x in self.xfers.items())
+
+    def stats(self):
+        return {
+            'pending': len(self.xfers),
+            'buffered': self.buffered,
+            'completed': self.completed,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
+
+
+def gtSendPayload(dev, payload, fromGID, msgClass, msgAppID, destGID=0,
+                  codec=None, maxBlob=SEG_MAX_BLOB):
+    """
+    Send a payload as a series of segment messages through a goTennaDev
+    Returns the number of messages sent, or False if one failed
+    """
+    from gtapiobj import gtMakeAPIMsg
+    from gtdefs import OP_SENDMSG, GT_OP_SUCCESS
+
+    (xferID, blobs) = gtSegment(payload, maxBlob, codec)
+    for blob in blobs:
+        res = dev.execute(OP_SENDMSG, gtMakeAPIMsg(blob, msgClass, msgAppID,
+                                                   fromGID, destGID))
+        if not res or res[0] != GT_OP_SUCCESS:
+            return False
+    return len(blobs)
+
+
+if __name__ == '__main__':
+    # Throughput and airtime of segmented transfers, on a simulated device
+    #   (loopback: everything sent is received back and reassembled)
+    from gtsim import gtSimDev, gtSimRadio
+    from gtapiobj import gtReadAPIMsg
+    from gtdefs import (OP_READMSG, OP_NEXTMSG, GT_OP_SUCCESS,
+                        MSG_CLASS_SHOUT)
+    import random
+
+    random.seed(1)
+    words = [b'<event', b'version="2.0"', b'uid=', b'type="a-f-G-U-C"',
+             b'<point', b'lat=', b'lon=', b'hae=', b'<detail>', b'/>',
+             b'<contact', b'callsign=', b'</event>']
+    payloads = {
+        'CoT XML 8KB': b' '.join(random.choice(words) +
+                                 str(random.random()).encode()
+                                 for i in range(500))[:8192],
+        'random 8KB': os.urandom(8192),
+    }
+
+    for name, payload in payloads.items():
+        for codec in segCodecs():
+            radio = gtSimRadio(loopback=True)
+            dev = gtSimDev(radio)
+            dev.initialize()
+            reasm = gtReassembler()
+
+            t0 = time.perf_counter()
+            sent = gtSendPayload(dev, payload, 0x1234, MSG_CLASS_SHOUT,
+                                 0x3fff, codec=codec)
+            got = None
+            while radio.inbox:
+                (code, data) = dev.execute(OP_READMSG)
+                if code == GT_OP_SUCCESS:
+                    msg = gtReadAPIMsg(data)
+                    if msg and 'msgBlob' in msg:
+                        got = (reasm.feed(msg['msgBlob'], msg['fromGID']) or
+                               got)
+                dev.execute(OP_NEXTMSG)
+            dt = time.perf_counter() - t0
+
+            assert got == payload
+            print("%-12s %-5s %3d msgs, %6d bytes on air, airtime %.2fs "
+                  "(%.0f us/byte), %.0f KB/s through the stack" %
+                  (name, SEG_CODEC_NAME[codec], sent, radio.airBytes,
+                   radio.airtime(), radio.airtime() * 1e6 / len(payload),
+                   len(payload) / dt / 1024))
@@ -0,0 +1,146 @@
+""" Command sequence numbers - part of pyGT https://github.com/sybip/pyGT """
+
+"""
+Every command carries a 1-byte sequence number, echoed in its response.
+gtSeqAllocator hands them out to commands in flight and matches the
+  responses back, so that after the sequence wraps around a late
+  response to an abandoned command can't be taken for the response to
+  a newer command with the same number.
+
+Slots of commands abandoned without a response (timed out) are kept in
+  quarantine for a while before reuse; responses arriving for them, or
+  for any number not in flight, are counted and dropped.
+"""
+
+import time
+import logging
+from collections import OrderedDict
+
+
+# Never used as sequence numbers (0x10 is DLE, the framing escape)
+SEQ_RESERVED = (0x10, )
+
+log = logging.getLogger(__name__)
+
+
+class seqSlot():
+    __slots__ = ('opcode', 'started', 'pdu')
+
+    def __init__(self, opcode, started):
+        self.opcode = opcode
+        self.started = started
+        self.pdu = None
+
+
+class gtSeqAllocator():
+    """
+    Sequence numbers for commands in flight, and their responses
+      timeout    - in-flight slots older than this are abandoned
+      quarantine - abandoned slots are not reused for this long
+    All state is bounded by the 256 sequence numbers. Not thread safe:
+      goTennaDev uses it from a single thread (the caller of execute,
+      or the I/O thread)
+    """
+    def __init__(self, timeout=5.0, quarantine=None, reserved=SEQ_RESERVED):
+        self.timeout = timeout
+        self.quarantine = timeout if quarantine is None else quarantine
+        self.usable = tuple(s not in reserved for s in range(256))
+        self.next = 1
+        self.inflight = {}          # seq -> seqSlot
+        self.stale = OrderedDict()  # seq -> time abandoned
+
+        self.orphans = 0        # responses to numbers never allocated
+        self.late = 0           # responses to abandoned commands
+        self.mismatched = 0     # responses with the wrong opcode
+        self.duplicates = 0     # second response to the same command
+        self.abandoned = 0      # commands which got no response
+
+    def allocate(self, opcode, now=None):
+        """
+        Reserve the next free sequence number for a command
+          (skipping those in flight or in quarantine)
+        Returns None if all are in use
+        """
+        if now is None:
+            now = time.monotonic()
+        self.expire(now)
+
+        for i in range(256):
+            seq = self.next
+            self.next = (self.next + 1) & 0xff
+            if (self.usable[seq] and seq not in self.inflight and
+                    seq not in self.stale):
+                self.inflight[seq] = seqSlot(opcode, now)
+                return seq
+        return None
+
+    def post(self, seq, pdu):
+        """
+        Deliver a response PDU; returns False (and counts it) if it
+          doesn't belong to a command in flight
+        """
+        slot = self.inflight.get(seq)
+        if slot is None:
+            if seq in self.stale:
+                self.late += 1
+                log.debug("Late response for seq %02x dropped", seq)
+            else:
+                self.orphans += 1
+                log.debug("Orphan response for seq %02x dropped", seq)
+            return False
+
+        if (pdu[0] & 0x3f) != (slot.opcode & 0x3f):
+            self.mismatched += 1
+            log.debug("Response opcode %02x for seq %02x, expected %02x",
+                      pdu[0] & 0x3f, seq, slot.opcode & 0x3f)
+            return False
+
+        if slot.pdu is not None:
+            self.duplicates += 1
+            return False
+
+        slot.pdu = pdu
+        return True
+
+    def ready(self, seq):
+        slot = self.inflight.get(seq)
+        return slot is not None and slot.pdu is not None
+
+    def take(self, seq):
+        """ Collect a response and free its slot; None if not ready """
+        slot = self.inflight.get(seq)
+        if slot is None or slot.pdu is None:
+            return None
+        del self.inflight[seq]
+        return slot.pdu
+
+    def release(self, seq, now=None):
+        """ Abandon a command: its slot goes into quarantine """
+        if self.inflight.pop(seq, None) is None:
+            return
+        self.stale[seq] = time.monotonic() if now is None else now
+        self.stale.move_to_end(seq)
+        self.abandoned += 1
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        for seq in [seq for seq, slot in self.inflight.items()
+                    if now - slot.started >= self.timeout]:
+            self.release(seq, now)
+        while self.stale:
+            (seq, since) = next(iter(self.stale.items()))
+            if now - since < self.quarantine:
+                break
+            del self.stale[seq]
+
+    def stats(self):
+        return {
+            'inflight': len(self.inflight),
+            'quarantined': len(self.stale),
+            'orphans': self.orphans,
+            'late': self.late,
+            'mismatched': self.mismatched,
+            'duplicates': self.duplicates,
+            'abandoned': self.abandoned,
+        }
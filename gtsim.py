@@ -0,0 +1,234 @@
+""" Simulated goTenna device - part of pyGT https://github.com/sybip/pyGT """
+
+"""
+gtSimRadio models the device side of the Bluetooth API: it decodes the
+  frames written to the TX characteristic, executes a subset of the
+  opcodes, and answers with notifications on the RX characteristic.
+
+gtSimDev is a goTennaDev wired to a gtSimRadio instead of a Bluetooth
+  connection, for tests, benchmarks and demos without hardware.
+"""
+
+import threading
+import time
+from collections import deque
+from struct import pack, unpack
+
+from gtdefs import (GT_UUID_ST, GT_UUID_TX, GT_UUID_RX, GT_OP_SUCCESS,
+                    OP_FLASH, OP_SET_GID, OP_SENDMSG, OP_SYSINFO, OP_READMSG,
+                    OP_NEXTMSG, OP_RST_GID, OP_DEL_GID, OP_SET_APP,
+                    OP_SET_GEO, OP_GET_GEO, GT_REGION_US, API_TLV_REGION,
+                    MESG_TLV_HOPS)
+from gtframe import (gtEncodeFrame, gtFrameDecoder, gtFragments,
+                     GT_BLE_FRAGMENT)
+from gtcodec import gtApiToAir
+
+# Handles used by the simulated GATT server
+SIM_HND_ST = 0x0022
+SIM_HND_TX = 0x0025
+SIM_HND_RX = 0x0028
+
+# Result code for failed commands (success is GT_OP_SUCCESS)
+SIM_OP_FAILED = 0x80
+
+# Canned OP_SYSINFO result (raw, as returned by the device)
+SIM_SYSINFO = bytes(bytearray(range(0x20)))
+
+# goTenna Mesh air data rate, used for airtime estimates (bits/sec)
+SIM_AIR_BITRATE = 24000
+
+
+class simCharacteristic():
+    """ Just enough of bluepy's Characteristic for goTennaDev """
+    def __init__(self, uuid, handle):
+        self.uuid = uuid
+        self.handle = handle - 1
+        self.valHandle = handle
+        self.properties = 0
+
+
+class gtSimRadio():
+    """
+    Device side model
+      loopback - messages sent with OP_SENDMSG are also received back
+      notify   - callable(hnd, data) delivering notifications to the host
+    """
+    def __init__(self, loopback=False):
+        self.loopback = loopback
+        self.notify = None
+        self.decoder = gtFrameDecoder()
+
+        self.gid = None
+        self.appID = None
+        self.region = GT_REGION_US
+        self.inbox = deque()    # received messages, API framed
+        self.sent = []          # messages sent, API framed
+
+        self.commands = 0
+        self.airBytes = 0       # bytes put on air (air framing)
+
+    def characteristics(self):
+        return [simCharacteristic(GT_UUID_ST, SIM_HND_ST),
+                simCharacteristic(GT_UUID_TX, SIM_HND_TX),
+                simCharacteristic(GT_UUID_RX, SIM_HND_RX)]
+
+    def write(self, hnd, data):
+        """ GATT write from the host """
+        if hnd != SIM_HND_TX:
+            return
+        for pdu in self.decoder.feed(data):
+            self.commands += 1
+            (opcode, seq) = unpack('BB', pdu[0:2])
+            (code, result) = self.execute(opcode, bytes(pdu[2:]))
+            self.send(gtEncodeFrame(code | opcode, seq, result))
+
+    def send(self, frame):
+        for fragment in gtFragments(frame, GT_BLE_FRAGMENT):
+            self.notify(SIM_HND_RX, bytes(fragment))
+
+    def receive(self, msgPDU, meshHops=1, rssi=0x40):
+        """ Inject a message as if received over the air """
+        self.inbox.append(msgPDU + pack('BBBB', MESG_TLV_HOPS, 2,
+                                        meshHops, rssi))
+        self.updateMWI()
+
+    def updateMWI(self):
+        self.notify(SIM_HND_ST, pack('B', 1 if self.inbox else 0))
+
+    def airtime(self, bitrate=SIM_AIR_BITRATE):
+        """ Seconds of airtime used by all messages sent so far """
+        return self.airBytes * 8. / bitrate
+
+    def execute(self, opcode, data):
+        """ Run one command, returns (result code, result data) """
+        if opcode in (OP_FLASH, OP_DEL_GID):
+            return GT_OP_SUCCESS, b''
+
+        elif opcode == OP_SET_GID:
+            self.gid = data
+            return GT_OP_SUCCESS, b''
+
+        elif opcode == OP_RST_GID:
+            self.gid = None
+            return GT_OP_SUCCESS, b''
+
+        elif opcode == OP_SET_APP:
+            self.appID = data
+            return GT_OP_SUCCESS, b''
+
+        elif opcode == OP_SYSINFO:
+            return GT_OP_SUCCESS, SIM_SYSINFO
+
+        elif opcode == OP_SET_GEO:
+            if data[0:2] != pack('BB', API_TLV_REGION, 1):
+                return SIM_OP_FAILED, b''
+            self.region = bytearray(data)[2]
+            return GT_OP_SUCCESS, b''
+
+        elif opcode == OP_GET_GEO:
+            return GT_OP_SUCCESS, pack('BBB', API_TLV_REGION, 1, self.region)
+
+        elif opcode == OP_SENDMSG:
+            try:
+                self.airBytes += len(gtApiToAir(data))
+            except ValueError:
+                return SIM_OP_FAILED, b''
+            self.sent.append(data)
+            if self.loopback:
+                self.receive(data)
+            return GT_OP_SUCCESS, b''
+
+        elif opcode == OP_READMSG:
+            if not self.inbox:
+                return SIM_OP_FAILED, b''
+            return GT_OP_SUCCESS, self.inbox[0]
+
+        elif opcode == OP_NEXTMSG:
+            if self.inbox:
+                self.inbox.popleft()
+            self.updateMWI()
+            return GT_OP_SUCCESS, b''
+
+        return SIM_OP_FAILED, b''
+
+
+def gtSimDev(radio=None):
+    """
+    Create a goTennaDev connected to a simulated radio
+      (a gtSimRadio is created if none is given)
+    """
+    # deferred, so that gtsim can be imported without bluepy
+    from gtdevice import goTennaDev
+
+    class simDev(goTennaDev):
+        def __init__(self, radio):
+            self.radio = radio
+            self.pending = deque()
+            self.event = threading.Event()
+            radio.notify = self.pushNotification
+            goTennaDev.__init__(self, None)
+
+        def pushNotification(self, hnd, data):
+            self.pending.append((hnd, data))
+            self.event.set()
+
+        def getCharacteristics(self, startHnd=1, endHnd=0xffff, uuid=None):
+            return [c for c in self.radio.characteristics()
+                    if startHnd <= c.handle <= endHnd]
+
+        def writeCharacteristic(self, handle, val, withResponse=False,
+                                *args):
+            if handle in (SIM_HND_ST + 1, SIM_HND_RX + 1):
+                return  # CCCD writes, subscriptions are implicit
+            self.radio.write(handle, val)
+
+        def waitForNotifications(self, timeout):
+            if not self.pending:
+                self.event.clear()
+                if not self.pending and not self.event.wait(timeout):
+                    return False
+            (hnd, data) = self.pending.popleft()
+            self.handleNotification(hnd, data)
+            return True
+
+        def disconnect(self):
+            self.stopIO()
+
+    return simDev(radio or gtSimRadio())
+
+
+if __name__ == '__main__':
+    dev = gtSimDev(gtSimRadio(loopback=True))
+    dev.initialize()
+    t0 = time.perf_counter()
+    n = 1000
+    for i in range(n):
+        dev.execute(OP_SYSINFO, b'')
+    dt = time.perf_counter() - t0
+    print("%d commands in %.03fs, %.0f commands/sec" % (n, dt, n / dt))
+
+    # Shared between threads, through the I/O thread
+    dev.startIO()
+    nThreads = 8
+    errors = []
+
+    def worker(i):
+        for j in range(n // nThreads):
+            (opcode, want) = ((OP_SYSINFO, SIM_SYSINFO) if (i + j) % 2 else
+                              (OP_GET_GEO, pack('BBB', API_TLV_REGION, 1,
+                                                GT_REGION_US)))
+            res = dev.execute(opcode, b'')
+            if res != (GT_OP_SUCCESS, want):
+                errors.append((i, j, res))
+
+    threads = [threading.Thread(target=worker, args=(i, ))
+               for i in range(nThreads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    dt = time.perf_counter() - t0
+    dev.disconnect()
+    print("%d commands from %d threads in %.03fs, %.0f commands/sec, "
+          "%d wrong or lost" % (n, nThreads, dt, n / dt, len(errors)))
@@ -5,12 +5,18 @@ Parse a btsnoop log (from bluez hcidump or Android HCI snoop)
   to extract and analyze goTenna protocol packets
 """
 
+import os
 import sys
+import json
+import hashlib
 from binascii import hexlify
 from struct import unpack
-from pycrc16 import crc
-from gtdefs import *  # constants, lists and definitions
-from gtdevice import gtBtReAsm
+from gtdefs import (GT_OP_NAMES, GT_OP_FORMATS, GT_OP_SUCCESS, MSG_TLV_NAMES,
+                    OP_READMSG, PDU_FMT_MSG, PDU_FMT_RAW)
+from gtframe import gtBtReAsm
+from gtapiobj import gtReadAPIMsg
+from gtdedup import gtDedupCache
+from gtstats import gtSnoopStats
 
 # Dump protocol packets
 debugPDUS = False
@@ -18,8 +24,39 @@ debugPDUS = False
 # Make dump parsing (even more) verbose
 debugDUMP = False
 
-# Opcodes known to contain/return NON-TLV data
-nonTLVops = [0x04, ]
+# Mesh duplicate detection (set to a gtDedupCache to enable)
+dedupCache = None
+
+# Statistics mode (set to a gtSnoopStats to replace the dump with them)
+snoopStats = None
+
+# Capture time of the frame being processed, in seconds
+snoopTime = 0
+
+# Checkpoint format version
+SNOOP_CHECKPOINT_VERSION = 1
+
+# Bytes hashed at the start of a log and before a checkpoint's offset
+SNOOP_PRINT_LEN = 4096
+
+# TLV labels per opcode, built on first use (see tlvLabels)
+_tlvLabels = {}
+
+
+def tlvLabels(opCode):
+    """
+    256-entry tuple of display labels for the TLVs of an opcode's payload
+      (message TLV names where the payload is a message object)
+    """
+    labels = _tlvLabels.get(opCode)
+    if labels is None:
+        names = (MSG_TLV_NAMES if GT_OP_FORMATS[opCode] == PDU_FMT_MSG
+                 else (None, ) * 256)
+        labels = tuple("  -> %s: " % names[t] if names[t] else
+                       "  -> TYPE_%02x_%02x: " % (opCode, t)
+                       for t in range(256))
+        _tlvLabels[opCode] = labels
+    return labels
 
 
 def opDissect(opCode, data):
@@ -27,36 +64,26 @@ def opDissect(opCode, data):
     Analyze a goTenna packet payload and display its elements
     """
 
-    # Most payloads are TLV formatted (which ones?)
-
     if len(data) < 3:
         # Data too short to contain TLVs
         return
 
-    if opCode in nonTLVops:
+    if GT_OP_FORMATS[opCode] == PDU_FMT_RAW:
         # No TLVs expected
         return
 
-    # try TLV parsing
-    while data:
-        try:
-            type, length = unpack('BB', data[:2])
-            value = unpack('%is' % length, data[2:2+length])[0]
-        except:
+    labels = tlvLabels(opCode)
+    pos = 0
+    end = len(data)
+    while pos < end:
+        if pos + 2 > end or pos + 2 + data[pos+1] > end:
             # Fail gracefully
-            print "  -> INVALID_TLV: " + hexlify(data)
+            print("  -> INVALID_TLV: " + hexlify(data[pos:]).decode())
             break
-
-        if (opCode in [OP_SENDMSG, OP_READMSG, ]):
-            # Show TLV names if known
-            try:
-                print "  -> %s: " % MSG_TLV_NAME[type] + hexlify(value)
-            except KeyError:
-                print "  -> TYPE_%02x_%02x: " % (opCode, type) + hexlify(value)
-        else:
-            print "  -> TYPE_%02x_%02x: " % (opCode, type) + hexlify(value)
-
-        data = data[2+length:]
+        length = data[pos+1]
+        print(labels[data[pos]] +
+              hexlify(data[pos+2:pos+2+length]).decode())
+        pos += 2 + length
 
 
 def pduDissect(pdu):
@@ -67,41 +94,44 @@ def pduDissect(pdu):
 
     if (opCode < 0x40):
         # is a command (ME->GT)
-        print "ME:CMD(%02x): %02x    " % (seqNo, opCode) + hexlify(pdu[2:])
-        try:
-            print "  " + GT_OP_NAME[opCode]
-        except KeyError:
-            print "  OP_UNKNOWN"
+        print("ME:CMD(%02x): %02x    " % (seqNo, opCode) + hexlify(pdu[2:]).decode())
+        print("  " + GT_OP_NAMES[opCode])
         if len(pdu) > 2:
-            print "  DATA: " + hexlify(pdu[2:])
+            print("  DATA: " + hexlify(pdu[2:]).decode())
         if len(pdu) >= 5:
             opDissect(opCode, pdu[2:])
         # Visual delimiter
-        print "-" * 70
+        print("-" * 70)
 
     else:
         # is a response (GT->ME)
         resCode = opCode & 0xc0
         opCode = opCode & 0x3f
-        print ("GT:RES(%02x): %02x|%02x " % (seqNo, opCode, resCode) +
-               hexlify(pdu[2:]))
-        try:
-            print ("  " + GT_OP_NAME[opCode] + " " +
-                   ("OK" if resCode == GT_OP_SUCCESS else "FAILED"))
-        except KeyError:
-            print ("  OP_UNKNOWN " +
-                   ("OK" if resCode == GT_OP_SUCCESS else "FAILED"))
+        print("GT:RES(%02x): %02x|%02x " % (seqNo, opCode, resCode) +
+              hexlify(pdu[2:]).decode())
+        print("  " + GT_OP_NAMES[opCode] + " " +
+              ("OK" if resCode == GT_OP_SUCCESS else "FAILED"))
         if len(pdu) > 2:
-            print "  DATA: " + hexlify(pdu[2:])
+            print("  DATA: " + hexlify(pdu[2:]).decode())
         if len(pdu) > 5:
             opDissect(opCode, pdu[2:])
+        if (dedupCache is not None and opCode == OP_READMSG and
+                resCode == GT_OP_SUCCESS):
+            msg = gtReadAPIMsg(pdu[2:])
+            if msg and 'hashID' in msg and dedupCache.seen(msg, snoopTime):
+                print("  DUPLICATE: hashID %04x" % msg['hashID'])
         # Visual delimiter
-        print "=" * 70
+        print("=" * 70)
 
 
-def parseBTSnoop(filename):
+def btSnoopRecords(f, offset=None):
     """
-    Parse btsnoop_hci.log binary data
+    Iterate over the records of an open btsnoop_hci.log binary file,
+      yielding (flags, time64, data) for each one
+    offset - start at this position (end of a record) instead of the
+      first record
+    At the end, f is left after the last complete record, so that a
+      log still being written can be resumed from f.tell()
 
     This function is based on https://github.com/robotika/jessica
       (Copyright (c) 2013 robotika.cz | MIT License)
@@ -110,77 +140,233 @@ def parseBTSnoop(filename):
       from http://tools.ietf.org/html/rfc1761
     """
 
-    try:
-        f = open(filename, "rb")
-    except:
-        print "Unable to open file: %s" % filename
-        return
-
-    assert f.read(8) == "btsnoop\0"
+    assert f.read(8) == b"btsnoop\0"
     version, datalinkType = unpack(">II", f.read(8))
     assert version == 1, version
     assert datalinkType == 0x3EA, datalinkType
+    if offset is not None:
+        f.seek(offset)
 
     i = 0
-    startTime = None
-
-    # Bluetooth frame reassembly
-    frag = gtBtReAsm()
-
-    # Pass packet to pduDissect when complete
-    frag.packetHandler=pduDissect
-
     while True:
         header = f.read(24)  # is the header size
         if len(header) < 24:
+            f.seek(-len(header), 1)
             break
         origLen, incLen, flags, drops, time64 = unpack(">IIIIq", header)
         assert origLen == incLen, (origLen, incLen)
         assert drops == 0, drops
         assert flags in [0, 1, 2, 3], (i, flags)
 
-        if startTime is None:
-            startTime = time64
-
         data = f.read(origLen)
+        if len(data) != origLen:  # Short read?
+            f.seek(-24 - len(data), 1)
+            break
 
-        if ((len(data) != origLen) or        # Short read?
-            (flags not in [0, 1]) or
-            (data[0] != '\x02') or           # Only keep type TYPE_ACL (2)
-            (ord(data[9]) not in [0x52, 0x1d, ])):
-                # include 0x1b above to also capture MWI notifs
-                continue
+        yield flags, time64, data
+        i += 1
 
-        if len(data) < 12:
-            continue
+
+def btSnoopFrames(f, attOps=(0x52, 0x1d), offset=None):
+    """
+    Iterate over the ATT PDUs in an open btsnoop file which may carry
+      goTenna traffic, yielding (flags, time64, attOp, handle, value)
+    Default attOps are write command (0x52) and indication (0x1d);
+      include 0x1b to also capture MWI notifications
+    """
+    for flags, time64, data in btSnoopRecords(f, offset):
+        if ((flags not in [0, 1]) or
+            (data[0:1] != b'\x02') or       # Only keep type TYPE_ACL (2)
+            (len(data) < 12) or
+            (bytearray(data)[9] not in attOps)):
+                continue
 
         totalLen, dataLen, CID, cmd, handle = unpack(
             '<HHHBH', data[3:12])
 
         # Sanity check on length fields etc
         if dataLen == totalLen-4 == len(data)-9:
-            if debugDUMP:
-                t = ((time64-startTime)/1000)/1000.
-                print ("IN  " if flags == 1 else "OUT ") + "%.03f" % t
-                print hexlify(data[0x0c:])
+            yield flags, time64, cmd, handle, data[0x0c:]
+
+
+def snoopFingerprint(f, offset):
+    """
+    Identify the first offset bytes of an open log by hashes of their
+      start and end: a log which has only grown since keeps them, a
+      rotated or replaced one doesn't
+    """
+    pos = f.tell()
+    f.seek(0)
+    head = hashlib.sha1(f.read(min(offset, SNOOP_PRINT_LEN))).hexdigest()
+    f.seek(max(offset - SNOOP_PRINT_LEN, 0))
+    tail = hashlib.sha1(f.read(min(offset, SNOOP_PRINT_LEN))).hexdigest()
+    f.seek(pos)
+    return {'offset': offset, 'head': head, 'tail': tail}
 
-            # send frame to packet reassembly routine
-            frag.receiveFrame(data[0x0c:])
+
+def snoopConfig():
+    """ Analysis options a checkpoint is only valid for """
+    return {'stats': snoopStats.window if snoopStats is not None else None,
+            'dedup': dedupCache is not None}
+
+
+def loadCheckpoint(filename, f):
+    """
+    Read a checkpoint and check it against an open log
+    Returns the checkpoint, or None if there is none or it doesn't
+      apply (log rotated or replaced, other options)
+    """
+    try:
+        with open(filename) as cp:
+            state = json.load(cp)
+        if (state['version'] != SNOOP_CHECKPOINT_VERSION or
+                state['config'] != snoopConfig()):
+            return None
+        offset = state['fingerprint']['offset']
+        if (os.fstat(f.fileno()).st_size < offset or
+                snoopFingerprint(f, offset) != state['fingerprint']):
+            print("Log changed since checkpoint, full rescan")
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return state
+
+
+def saveCheckpoint(filename, f, packets, startTime, frags):
+    """ Write a checkpoint at the current position of an open log """
+    state = {
+        'version': SNOOP_CHECKPOINT_VERSION,
+        'config': snoopConfig(),
+        'fingerprint': snoopFingerprint(f, f.tell()),
+        'packets': packets,
+        'startTime': startTime,
+        'frags': [frag.saveState() for frag in frags],
+        'stats': snoopStats.saveState() if snoopStats is not None else None,
+        'dedup': dedupCache.saveState() if dedupCache is not None else None,
+    }
+    # write and rename, so that an interrupted run leaves the old one
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as cp:
+        json.dump(state, cp)
+    os.replace(tmp, filename)
+
+
+def parseBTSnoop(filename, checkpoint=None):
+    """
+    Parse btsnoop_hci.log binary data
+    checkpoint - file to resume from, when it matches the log, and to
+      save the processing state to at the end, so that a later run
+      only processes what was appended since
+    """
+    global snoopTime
+
+    try:
+        f = open(filename, "rb")
+    except:
+        print("Unable to open file: %s" % filename)
+        return
+
+    i = 0
+    startTime = None
+    attOps = (0x52, 0x1d)
+
+    # Bluetooth frame reassembly
+    frag = gtBtReAsm()
+
+    # Pass packet to pduDissect when complete
+    frag.packetHandler=pduDissect
+    frags = (frag, )
+
+    if snoopStats is not None:
+        # one reassembler per direction (flags 0 sent, 1 received), and
+        #   status notifications for the MWI
+        attOps = (0x52, 0x1d, 0x1b)
+        frags = (gtBtReAsm(), gtBtReAsm())
+        for frag in frags:
+            frag.packetHandler = lambda pdu: snoopStats.feed(pdu, snoopTime)
+            frag.trace.subscribe('on_crc_error', lambda want, have, buf:
+                                 snoopStats.crcError(snoopTime))
+
+    offset = None
+    resume = loadCheckpoint(checkpoint, f) if checkpoint else None
+    if resume is not None:
+        offset = resume['fingerprint']['offset']
+        (i, startTime) = (resume['packets'], resume['startTime'])
+        for (frag, state) in zip(frags, resume['frags']):
+            frag.loadState(state)
+        if snoopStats is not None:
+            snoopStats.loadState(resume['stats'])
+        if dedupCache is not None:
+            dedupCache.loadState(resume['dedup'])
+        print("Resuming at offset %d, after %d packets" % (offset, i))
+
+    for flags, time64, cmd, handle, value in btSnoopFrames(f, attOps,
+                                                           offset):
+        if startTime is None:
+            startTime = time64
+        snoopTime = time64 / 1000000.
+
+        if snoopStats is not None:
+            if cmd == 0x1b:
+                if len(value) == 1:
+                    snoopStats.mwiUpdate(bytearray(value)[0], snoopTime)
+            else:
+                frags[flags].receiveFrame(value)
+            i += 1
+            continue
+
+        if debugDUMP:
+            t = ((time64-startTime)/1000)/1000.
+            print(("IN  " if flags == 1 else "OUT ") + "%.03f" % t)
+            print(hexlify(value).decode())
+
+        # send frame to packet reassembly routine
+        frag.receiveFrame(value)
 
         i += 1
 
-    print "Total packets: ", i
+    if checkpoint:
+        saveCheckpoint(checkpoint, f, i, startTime, frags)
+    f.close()
+    if snoopStats is not None:
+        snoopStats.finish()
+        for line in snoopStats.report():
+            print(line)
+    print("Total packets: ", i)
+    if dedupCache is not None:
+        print("Duplicates: %(dups)d of %(lookups)d messages" %
+              dedupCache.stats())
     return i
 
 
 def giveHelp():
-    print "\ngoTenna Bluetooth API protocol analyzer"
-    print "\nUsage: %s filename\n" % sys.argv[0]
+    print("\ngoTenna Bluetooth API protocol analyzer")
+    print("\nUsage: %s [-d] [-s [-w window]] [-c checkpoint] filename\n" %
+          sys.argv[0])
+    print("  -d  flag mesh duplicates among received messages")
+    print("  -s  print protocol statistics instead of packets")
+    print("  -w  statistics window, in seconds (default 60)")
+    print("  -c  resume from (and update) a checkpoint file, to process")
+    print("      only what was added to the log since the last run")
 
 
 def main():
-    if len(sys.argv) >= 2:
-        parseBTSnoop(sys.argv[1])
+    import getopt
+    global dedupCache, snoopStats
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "dsw:c:")
+        opts = dict(opts)
+        window = float(opts.get('-w', 60))
+    except (getopt.GetoptError, ValueError):
+        args = []
+
+    if len(args) >= 1:
+        if '-d' in opts:
+            dedupCache = gtDedupCache()
+        if '-s' in opts:
+            snoopStats = gtSnoopStats(window)
+        parseBTSnoop(args[0], opts.get('-c'))
     else:
         giveHelp()
         sys.exit(-1)
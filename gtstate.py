@@ -0,0 +1,227 @@
+""" Device state cache - part of pyGT https://github.com/sybip/pyGT """
+
+"""
+Decoders for the non-message query results (OP_SYSINFO, OP_GET_GEO), and
+  gtDeviceState, which keeps the last values of a goTennaDev with a
+  time-to-live, so that monitoring code can read them without a round
+  trip to the device on every look.
+
+SYSINFO is kept raw: its field layout is a guess (gtdefs.SYSINFO_FIELDS)
+  which hasn't been checked against real devices, so the typed fields
+  are only available through gtGuessSysInfo.
+
+The GID is not queried (there is no opcode for it): it is tracked from
+  successful OP_SET_GID/OP_RST_GID commands seen on the trace hooks, as
+  is the region after OP_SET_GEO.
+"""
+
+import time
+import logging
+import threading
+from struct import unpack_from, calcsize
+
+from pyTLV import tlvRead
+from gtdefs import (OP_SYSINFO, OP_GET_GEO, OP_SET_GEO, OP_SET_GID,
+                    OP_RST_GID, GT_OP_SUCCESS, API_TLV_REGION,
+                    GT_REGION_NAMES, SYSINFO_LEN, SYSINFO_FIELDS)
+
+log = logging.getLogger(__name__)
+
+
+def gtReadSysInfo(data):
+    """
+    The OP_SYSINFO result, as raw bytes: its layout is not confirmed
+      (see gtGuessSysInfo for a tentative decoding)
+    """
+    if len(data) != SYSINFO_LEN:
+        log.debug("SYSINFO: unexpected length %d", len(data))
+    return bytes(data)
+
+
+def gtGuessSysInfo(data):
+    """
+    TENTATIVE decoding of an OP_SYSINFO result into a dict of
+      SYSINFO_FIELDS (None for fields beyond the end of a short result),
+      plus 'raw'; the offsets are unconfirmed, so the values may be wrong
+    """
+    info = {'raw': bytes(data)}
+    for (name, offset, fmt) in SYSINFO_FIELDS:
+        if offset + calcsize(fmt) > len(data):
+            info[name] = None
+            continue
+        value = unpack_from(fmt, data, offset)
+        info[name] = value[0] if len(value) == 1 else value
+    if info['serial'] is not None:
+        info['serial'] = info['serial'].rstrip(b'\0').decode('ascii',
+                                                              'replace')
+    if info['charging'] is not None:
+        info['charging'] = bool(info['charging'])
+    return info
+
+
+def gtReadRegion(data):
+    """
+    Decode an OP_GET_GEO result (or OP_SET_GEO argument)
+    Returns (region ID, region name), or None if there is no region TLV
+    """
+    try:
+        for (type, length, value) in tlvRead(data):
+            if type == API_TLV_REGION and length == 1:
+                region = bytearray(value)[0]
+                return (region, GT_REGION_NAMES[region])
+    except ValueError:
+        pass
+    return None
+
+
+# Cached items: key -> (opcode, decoder)
+STATE_QUERIES = {
+    'sysinfo': (OP_SYSINFO, gtReadSysInfo),
+    'region': (OP_GET_GEO, gtReadRegion),
+}
+
+
+class gtDeviceState():
+    """
+    Cached state of a goTennaDev
+      ttl - values older than this (seconds) are refreshed on access,
+            or by the background refresher
+    get() with wait=False never talks to the device: it returns the
+      cached value (possibly stale, or None) and leaves the refresh to
+      the background refresher, which must be running for it to happen
+    """
+    def __init__(self, dev, ttl=60.0):
+        self.dev = dev
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.values = {}        # key -> (value, time fetched)
+        self.gid = None         # last GID set, raw
+        self.pending = {}       # seq -> (opcode, data) of tracked commands
+
+        self.hits = 0
+        self.queries = 0
+        self.failures = 0
+
+        self.refresher = None
+        self.wakeup = threading.Event()
+        self.stopping = False
+
+        dev.trace.subscribe('on_command', self.onCommand)
+        dev.trace.subscribe('on_result', self.onResult)
+
+    def close(self):
+        self.stopRefresh()
+        self.dev.trace.unsubscribe('on_command', self.onCommand)
+        self.dev.trace.unsubscribe('on_result', self.onResult)
+
+    def fresh(self, key, now=None):
+        entry = self.values.get(key)
+        if entry is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return now - entry[1] < self.ttl
+
+    def get(self, key, wait=True):
+        """
+        The cached value of key ('sysinfo' or 'region'), queried from the
+          device first if stale and wait is set
+        Returns None if never fetched (or, with wait, if the query failed)
+        """
+        with self.lock:
+            entry = self.values.get(key)
+            if self.fresh(key):
+                self.hits += 1
+                return entry[0]
+        if wait:
+            return self.refresh(key)
+        self.wakeup.set()
+        return entry[0] if entry else None
+
+    def refresh(self, key):
+        """ Query the device for key now; returns the new value or None """
+        (opcode, decode) = STATE_QUERIES[key]
+        self.queries += 1
+        res = self.dev.execute(opcode, b'')
+        if not res or res[0] != GT_OP_SUCCESS:
+            self.failures += 1
+            log.debug("State query %s failed: %s", key, res)
+            return None
+        value = decode(res[1])
+        self.store(key, value)
+        return value
+
+    def store(self, key, value):
+        with self.lock:
+            self.values[key] = (value, time.monotonic())
+
+    def sysinfo(self, wait=True):
+        return self.get('sysinfo', wait)
+
+    def region(self, wait=True):
+        return self.get('region', wait)
+
+    # Trace hooks (called from whichever thread executes commands)
+
+    def onCommand(self, opcode, seq, data):
+        if opcode in (OP_SET_GID, OP_RST_GID, OP_SET_GEO):
+            self.pending[seq] = (opcode, data)
+
+    def onResult(self, opcode, code, seq, data):
+        (sent, args) = self.pending.pop(seq, (None, None))
+        if sent != opcode or code != GT_OP_SUCCESS:
+            return
+        if opcode == OP_SET_GID:
+            self.gid = args
+        elif opcode == OP_RST_GID:
+            self.gid = None
+        elif opcode == OP_SET_GEO:
+            region = gtReadRegion(args)
+            if region is not None:
+                self.store('region', region)
+
+    # Background refresh
+
+    def startRefresh(self, interval=None):
+        """
+        Refresh stale values in a background thread, every interval
+          seconds (default ttl/2) or as soon as get(wait=False) misses
+        Queries go through the device's I/O thread, which is started if
+          needed, so they queue up with other commands instead of
+          blocking their callers
+        """
+        if self.refresher is not None:
+            return
+        self.dev.startIO()
+        self.interval = self.ttl / 2. if interval is None else interval
+        self.stopping = False
+        self.refresher = threading.Thread(target=self.refreshLoop,
+                                          name='gtState-%s' % self.dev.mac)
+        self.refresher.daemon = True
+        self.refresher.start()
+
+    def stopRefresh(self):
+        thread = self.refresher
+        if thread is None:
+            return
+        self.stopping = True
+        self.wakeup.set()
+        thread.join()
+        self.refresher = None
+
+    def refreshLoop(self):
+        while not self.stopping:
+            self.wakeup.clear()
+            for key in STATE_QUERIES:
+                if self.stopping:
+                    break
+                if not self.fresh(key):
+                    self.refresh(key)
+            self.wakeup.wait(self.interval)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'queries': self.queries,
+            'failures': self.failures,
+        }
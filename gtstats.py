@@ -0,0 +1,264 @@
+""" Protocol statistics - part of pyGT https://github.com/sybip/pyGT """
+
+"""
+gtSnoopStats aggregates a stream of timestamped PDUs (from a btsnoop
+  capture, or live from the trace hooks) into protocol statistics:
+ - command/response latency per opcode, pairing them by sequence number
+ - result codes per opcode, commands without a response, retries
+ - MWI raises
+ - traffic per fixed time window
+
+Everything is incremental and bounded: latencies go into fixed
+  histograms, at most 256 commands are awaiting a response, and only
+  the most recent windows are kept, so that arbitrarily long captures
+  are processed in constant memory.
+"""
+
+from collections import deque
+
+from gtdefs import GT_OP_NAMES, GT_OP_SUCCESS
+
+# Latency histogram bucket upper bounds, in seconds (last one open)
+STATS_LAT_BOUNDS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02,
+                    0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+# Per-window counters
+STATS_WINDOW_KEYS = ('commands', 'responses', 'failed', 'unanswered',
+                     'bytes', 'crcErrors', 'mwi')
+
+# gtSnoopStats attributes saved as they are
+_STATS_SCALARS = ('window', 'pdus', 'orphans', 'mismatched', 'crcErrors',
+                  'mwi', 'mwiState', 'first', 'last')
+
+
+class opStats():
+    """ Counters and latency histogram of one opcode """
+    __slots__ = ('commands', 'ok', 'failed', 'codes', 'unanswered',
+                 'retries', 'latN', 'latSum', 'latMin', 'latMax', 'hist')
+
+    def __init__(self):
+        self.commands = 0
+        self.ok = 0
+        self.failed = 0
+        self.codes = {}         # failure result code -> count
+        self.unanswered = 0
+        self.retries = 0
+        self.latN = 0
+        self.latSum = 0.
+        self.latMin = None
+        self.latMax = None
+        self.hist = [0] * (len(STATS_LAT_BOUNDS) + 1)
+
+    def latency(self, dt):
+        self.latN += 1
+        self.latSum += dt
+        if self.latMin is None or dt < self.latMin:
+            self.latMin = dt
+        if self.latMax is None or dt > self.latMax:
+            self.latMax = dt
+        for (i, bound) in enumerate(STATS_LAT_BOUNDS):
+            if dt <= bound:
+                break
+        else:
+            i = len(STATS_LAT_BOUNDS)
+        self.hist[i] += 1
+
+    def percentile(self, p):
+        """ Upper bound of the bucket holding the p-th percentile """
+        if not self.latN:
+            return None
+        rank = p / 100. * self.latN
+        seen = 0
+        for (i, n) in enumerate(self.hist):
+            seen += n
+            if seen >= rank and n:
+                if i < len(STATS_LAT_BOUNDS):
+                    return min(STATS_LAT_BOUNDS[i], self.latMax)
+                return self.latMax
+        return self.latMax
+
+
+class gtSnoopStats():
+    """
+    Incremental statistics over a PDU stream
+      window     - length of the traffic windows, in seconds
+      maxWindows - number of closed windows kept (older ones are only
+                   passed to onWindow, if set)
+    """
+    def __init__(self, window=60.0, maxWindows=60):
+        self.window = window
+        self.ops = {}           # opcode -> opStats
+        self.pending = {}       # seq -> (opcode, time, payload)
+        self.lastFailed = {}    # opcode -> payload of a failed command
+        self.windows = deque(maxlen=maxWindows)
+        self.current = None     # [start, counters]
+        self.onWindow = None    # callable(start, counters)
+
+        self.pdus = 0
+        self.orphans = 0        # responses to no pending command
+        self.mismatched = 0     # responses with another opcode
+        self.crcErrors = 0
+        self.mwi = 0
+        self.mwiState = 0
+        self.first = None
+        self.last = None
+
+    def op(self, opcode):
+        stats = self.ops.get(opcode)
+        if stats is None:
+            stats = self.ops[opcode] = opStats()
+        return stats
+
+    def tick(self, now):
+        """ Advance the clock to now, closing the window if it has ended """
+        if self.first is None:
+            self.first = now
+        self.last = now
+        start = now - (now - self.first) % self.window
+        if self.current is not None and self.current[0] == start:
+            return self.current[1]
+        if self.current is not None:
+            self.windows.append(tuple(self.current))
+            if self.onWindow is not None:
+                self.onWindow(*self.current)
+        self.current = [start, dict.fromkeys(STATS_WINDOW_KEYS, 0)]
+        return self.current[1]
+
+    def feed(self, pdu, now):
+        """ Account for one PDU (command or response) seen at time now """
+        win = self.tick(now)
+        self.pdus += 1
+        win['bytes'] += len(pdu)
+        if len(pdu) < 2:
+            return
+        (opcode, seq) = (pdu[0], pdu[1])
+
+        if opcode < 0x40:
+            # command: a previous one still pending on the same sequence
+            #   number will never be matched
+            win['commands'] += 1
+            stats = self.op(opcode)
+            stats.commands += 1
+            self.unanswered(seq, win)
+            payload = bytes(pdu[2:])
+            if self.lastFailed.pop(opcode, None) == payload:
+                stats.retries += 1
+            self.pending[seq] = (opcode, now, payload)
+            return
+
+        win['responses'] += 1
+        (code, opcode) = (opcode & 0xc0, opcode & 0x3f)
+        cmd = self.pending.pop(seq, None)
+        if cmd is None:
+            self.orphans += 1
+            return
+        if cmd[0] != opcode:
+            self.mismatched += 1
+            self.pending[seq] = cmd
+            return
+        stats = self.op(opcode)
+        stats.latency(now - cmd[1])
+        if code == GT_OP_SUCCESS:
+            stats.ok += 1
+        else:
+            stats.failed += 1
+            stats.codes[code] = stats.codes.get(code, 0) + 1
+            win['failed'] += 1
+            self.lastFailed[opcode] = cmd[2]
+
+    def unanswered(self, seq, win):
+        cmd = self.pending.pop(seq, None)
+        if cmd is not None:
+            self.op(cmd[0]).unanswered += 1
+            self.lastFailed[cmd[0]] = cmd[2]
+            win['unanswered'] += 1
+
+    def crcError(self, now):
+        self.tick(now)['crcErrors'] += 1
+        self.crcErrors += 1
+
+    def mwiUpdate(self, value, now):
+        """ Status notification: count raises of the MWI """
+        if value and not self.mwiState:
+            self.tick(now)['mwi'] += 1
+            self.mwi += 1
+        self.mwiState = value
+
+    def finish(self):
+        """ End of stream: close the current window """
+        if self.current is not None:
+            self.windows.append(tuple(self.current))
+            if self.onWindow is not None:
+                self.onWindow(*self.current)
+            self.current = None
+
+    def saveState(self):
+        """ Accumulators as a JSON-serializable dict (see loadState) """
+        state = {key: getattr(self, key) for key in _STATS_SCALARS}
+        state['ops'] = []
+        for (opcode, s) in self.ops.items():
+            values = {k: getattr(s, k) for k in opStats.__slots__}
+            values['codes'] = list(s.codes.items())     # int keys
+            state['ops'].append([opcode, values])
+        state['pending'] = [[seq, opcode, when, payload.hex()] for
+                            (seq, (opcode, when, payload))
+                            in self.pending.items()]
+        state['lastFailed'] = [[opcode, payload.hex()] for
+                               (opcode, payload) in self.lastFailed.items()]
+        state['windows'] = list(self.windows)
+        state['current'] = self.current
+        return state
+
+    def loadState(self, state):
+        """ Resume from a saveState() dict """
+        for key in _STATS_SCALARS:
+            setattr(self, key, state[key])
+        self.ops = {}
+        for (opcode, values) in state['ops']:
+            s = self.op(opcode)
+            for k in opStats.__slots__:
+                setattr(s, k, values[k])
+            s.codes = dict(s.codes)
+        self.pending = {seq: (opcode, when, bytes.fromhex(payload)) for
+                        (seq, opcode, when, payload) in state['pending']}
+        self.lastFailed = {opcode: bytes.fromhex(payload) for
+                           (opcode, payload) in state['lastFailed']}
+        self.windows.clear()
+        self.windows.extend(tuple(w) for w in state['windows'])
+        self.current = state['current']
+
+    def report(self):
+        """ Summary as a list of text lines """
+        lines = []
+        span = (self.last - self.first) if self.first is not None else 0
+        lines.append("%d PDUs over %.3fs, %d orphan and %d mismatched "
+                     "responses, %d CRC errors, %d MWI raises" %
+                     (self.pdus, span, self.orphans, self.mismatched,
+                      self.crcErrors, self.mwi))
+        lines.append("%-16s %6s %6s %6s %6s %6s %8s %8s %8s %8s" %
+                     ("opcode", "cmds", "ok", "fail", "noresp", "retry",
+                      "mean ms", "p50 ms", "p99 ms", "max ms"))
+
+        def ms(value):
+            return "%8.2f" % (value * 1e3) if value is not None else \
+                "%8s" % "-"
+
+        for opcode in sorted(self.ops):
+            s = self.ops[opcode]
+            mean = s.latSum / s.latN if s.latN else None
+            lines.append("%-16s %6d %6d %6d %6d %6d %s %s %s %s" %
+                         (GT_OP_NAMES[opcode], s.commands, s.ok, s.failed,
+                          s.unanswered, s.retries, ms(mean),
+                          ms(s.percentile(50)), ms(s.percentile(99)),
+                          ms(s.latMax)))
+            for code, n in sorted(s.codes.items()):
+                lines.append("  result %02x: %d" % (code, n))
+
+        if self.windows:
+            lines.append("%-10s " % "window" +
+                         " ".join("%9s" % k for k in STATS_WINDOW_KEYS))
+            for (start, counters) in self.windows:
+                lines.append("%10.1f " % (start - self.first) +
+                             " ".join("%9d" % counters[k]
+                                      for k in STATS_WINDOW_KEYS))
+        return lines
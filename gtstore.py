@@ -0,0 +1,227 @@
+""" Received message store - part of pyGT https://github.com/sybip/pyGT """
+
+"""
+Append-only SQLite store for parsed messages (gtReadAPIMsg output),
+  indexed on fromGID, destGID, appID, classID, tstamp and hashID
+
+Inserts are batched; rows are only ever removed by compact()
+GIDs are unsigned 64-bit, SQLite integers signed: they are stored as
+  their two's complement, and converted back by query()
+"""
+
+import time
+import logging
+import sqlite3
+import threading
+from struct import unpack
+
+from gtdefs import OP_READMSG, GT_OP_SUCCESS
+from gtapiobj import gtReadAPIMsg
+
+log = logging.getLogger(__name__)
+
+# Message fields kept in the store, in column order
+#   (msgBlob is stored verbatim, everything else is an integer)
+MSG_STORE_FIELDS = ('classID', 'appID', 'destGID', 'destTag', 'fromGID',
+                    'tstamp', 'seqNo0', 'seqNo1', 'cryptFlag', 'hashID',
+                    'meshHops', 'dChRSSI', 'msgBlob')
+
+# Fields which can be used as equality filters in query()
+MSG_STORE_INDEXED = ('fromGID', 'destGID', 'appID', 'classID', 'hashID')
+
+# Unsigned 64-bit fields, stored as signed
+MSG_STORE_U64 = ('fromGID', 'destGID')
+
+_SCHEMA = ("CREATE TABLE IF NOT EXISTS msgs (id INTEGER PRIMARY KEY, "
+           "rxtime REAL, " + ", ".join(MSG_STORE_FIELDS) + ")")
+
+
+def _toSigned(value):
+    if value is None or value < (1 << 63):
+        return value
+    return value - (1 << 64)
+
+
+def _toUnsigned(value):
+    if value is None or value >= 0:
+        return value
+    return value + (1 << 64)
+
+
+class gtMsgStore():
+    """
+    Embedded message store
+      path      - SQLite database file, or ':memory:'
+      batchSize - messages buffered before they are written out
+    """
+    def __init__(self, path=':memory:', batchSize=100):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.batchSize = batchSize
+        self.pending = []
+
+        self.db.execute(_SCHEMA)
+        for field in MSG_STORE_INDEXED + ('tstamp', ):
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_%s ON msgs(%s)" %
+                            (field, field))
+        self.db.commit()
+
+        self._insert = ("INSERT INTO msgs (rxtime, %s) VALUES (?%s)" %
+                        (", ".join(MSG_STORE_FIELDS),
+                         ", ?" * len(MSG_STORE_FIELDS)))
+
+    def add(self, msg, rxtime=None):
+        """ Queue a parsed message for storage """
+        if rxtime is None:
+            rxtime = time.time()
+        row = (rxtime, ) + tuple(
+            _toSigned(msg.get(field)) if field in MSG_STORE_U64 else
+            msg.get(field) for field in MSG_STORE_FIELDS)
+        with self.lock:
+            self.pending.append(row)
+            if len(self.pending) >= self.batchSize:
+                self._flush()
+
+    def addMany(self, msgs, rxtime=None):
+        """ Store an iterable of parsed messages """
+        for msg in msgs:
+            self.add(msg, rxtime)
+        self.flush()
+
+    def flush(self):
+        """ Write out all queued messages """
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        # a batch which fails is dropped, not retried on every call
+        (batch, self.pending) = (self.pending, [])
+        try:
+            self.db.executemany(self._insert, batch)
+            self.db.commit()
+        except (sqlite3.Error, OverflowError, ValueError):
+            self.db.rollback()
+            log.error("%d messages not stored", len(batch))
+            raise
+
+    def query(self, since=None, until=None, limit=None, **match):
+        """
+        Return stored messages as dicts, oldest first
+          since, until - tstamp range (inclusive, Unix time)
+          match        - equality filters on MSG_STORE_INDEXED fields,
+                         e.g. query(fromGID=0x123456789, since=t-3600)
+        """
+        where = []
+        args = []
+        for field, value in match.items():
+            if field not in MSG_STORE_INDEXED:
+                raise ValueError('Not an indexed field: %s' % field)
+            where.append("%s = ?" % field)
+            args.append(_toSigned(value) if field in MSG_STORE_U64 else
+                         value)
+        if since is not None:
+            where.append("tstamp >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("tstamp <= ?")
+            args.append(until)
+
+        sql = "SELECT rxtime, %s FROM msgs" % ", ".join(MSG_STORE_FIELDS)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY tstamp, id"
+        if limit:
+            sql += " LIMIT %d" % limit
+
+        with self.lock:
+            self._flush()
+            rows = self.db.execute(sql, args).fetchall()
+
+        res = []
+        for row in rows:
+            msg = {'rxtime': row[0]}
+            for field, value in zip(MSG_STORE_FIELDS, row[1:]):
+                if value is not None:
+                    msg[field] = (_toUnsigned(value)
+                                  if field in MSG_STORE_U64 else value)
+            res.append(msg)
+        return res
+
+    def count(self):
+        with self.lock:
+            self._flush()
+            return self.db.execute("SELECT COUNT(*) FROM msgs").fetchone()[0]
+
+    def compact(self, maxAge, now=None, vacuum=False):
+        """
+        Retention: drop messages with a tstamp older than maxAge seconds
+        Returns the number of messages removed
+        """
+        if now is None:
+            now = time.time()
+        limit = now - maxAge
+        with self.lock:
+            self._flush()
+            cur = self.db.execute("DELETE FROM msgs WHERE tstamp < ?",
+                                  (limit, ))
+            self.db.commit()
+            if vacuum:
+                self.db.execute("VACUUM")
+        return cur.rowcount
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def feedPDU(self, pdu, dedup=None, rxtime=None):
+        """
+        Store the message carried by a received protocol PDU, if any
+          (i.e. a successful OP_READMSG result); gtBtReAsm packet handler
+        """
+        (opCode, ) = unpack('B', pdu[0:1])
+        if ((opCode & 0x3f) == OP_READMSG and
+                (opCode & 0xc0) == GT_OP_SUCCESS and len(pdu) > 2):
+            self.feedMsg(gtReadAPIMsg(pdu[2:]), dedup, rxtime)
+
+    def feedMsg(self, msg, dedup=None, rxtime=None):
+        if msg and 'fromGID' in msg:
+            if dedup is None or not dedup.seen(msg):
+                self.add(msg, rxtime)
+
+    def attach(self, dev, dedup=None):
+        """
+        Store every message read from a goTennaDev via OP_READMSG
+          (optionally dropping mesh duplicates, using a gtDedupCache)
+        """
+        def onResult(opcode, code, seq, data):
+            # runs inside execute(), possibly on the I/O thread: a store
+            #   failure must not fail the command, or end the thread
+            if opcode == OP_READMSG and code == GT_OP_SUCCESS and data:
+                try:
+                    self.feedMsg(gtReadAPIMsg(data), dedup)
+                except Exception as e:
+                    log.error("Message not stored: %s", e)
+
+        dev.trace.subscribe('on_result', onResult)
+        return onResult
+
+    def loadSnoop(self, filename, dedup=None):
+        """
+        Store all messages read from the device in a btsnoop capture,
+          with the capture time of their last fragment as rxtime
+        """
+        from gtsnoop import btSnoopFrames
+        from gtframe import gtBtReAsm
+        from gtrecord import BTSNOOP_EPOCH_DELTA
+
+        rxtime = [None]
+        frag = gtBtReAsm()
+        frag.packetHandler = lambda pdu: self.feedPDU(pdu, dedup, rxtime[0])
+        with open(filename, "rb") as f:
+            for flags, time64, cmd, handle, value in btSnoopFrames(f):
+                if flags == 1:
+                    rxtime[0] = (time64 - BTSNOOP_EPOCH_DELTA) / 1000000.
+                    frag.receiveFrame(value)
+        self.flush()
@@ -0,0 +1,81 @@
+""" Tracing hooks - part of pyGT https://github.com/sybip/pyGT """
+
+import logging
+from binascii import hexlify
+
+# Hook points, in the order a command normally travels through them
+GT_TRACE_HOOKS = (
+    'on_command',       # (opcode, seq, data)      command about to be sent
+    'on_tx_fragment',   # (hnd, data)              GATT write, one fragment
+    'on_rx_fragment',   # (hnd, data)              GATT notification
+    'on_pdu',           # (direction, pdu)         complete PDU, 'tx' or 'rx'
+    'on_crc_error',     # (wantcrc, havecrc, buf)  reassembled PDU dropped
+    'on_result',        # (opcode, code, seq, data) result returned to caller
+)
+
+
+class hexDump():
+    """
+    Deferred hex rendering: hexlify only runs if the value is formatted,
+      so passing one to a disabled logger costs nothing but the wrapper
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return hexlify(bytes(self.data)).decode()
+
+
+class gtTrace():
+    """
+    Per-device set of tracing hook points
+    Each hook is a plain list of subscribers; an empty list means the
+      hook is disabled and emitting it costs a single truth test
+    """
+    def __init__(self):
+        for hook in GT_TRACE_HOOKS:
+            setattr(self, hook, [])
+
+    def subscribe(self, hook, func):
+        if hook not in GT_TRACE_HOOKS:
+            raise ValueError('Unknown trace hook: %s' % hook)
+        getattr(self, hook).append(func)
+
+    def unsubscribe(self, hook, func):
+        try:
+            getattr(self, hook).remove(func)
+        except (AttributeError, ValueError):
+            pass
+
+
+def gtTraceLogger(trace, logger=None, hooks=GT_TRACE_HOOKS):
+    """
+    Subscribe a logging.Logger to the selected hooks of a gtTrace
+      (hex formatting is lazy, and happens only if DEBUG is enabled)
+    Returns the logger, so the caller can adjust its level or handlers
+    """
+    if logger is None:
+        logger = logging.getLogger('pyGT.trace')
+
+    handlers = {
+        'on_command': lambda opcode, seq, data:
+            logger.debug("CMD(%02x): %02x %s", seq, opcode, hexDump(data)),
+        'on_tx_fragment': lambda hnd, data:
+            logger.debug("Xmit data(%04x): %s", hnd, hexDump(data)),
+        'on_rx_fragment': lambda hnd, data:
+            logger.debug("Rcvd data(%04x): %s", hnd, hexDump(data)),
+        'on_pdu': lambda direction, pdu:
+            logger.debug("%s PDU: %s", direction.capitalize(), hexDump(pdu)),
+        'on_crc_error': lambda wantcrc, havecrc, buf:
+            logger.warning("CRC failed, want=%04x, have=%04x for %s",
+                           wantcrc, havecrc, hexDump(buf)),
+        'on_result': lambda opcode, code, seq, data:
+            logger.debug("RES(%02x): %02x %s", seq, code, hexDump(data)),
+    }
+
+    for hook in hooks:
+        trace.subscribe(hook, handlers[hook])
+
+    return logger
@@ -1,6 +1,6 @@
 """ Python TLV functions - part of pyGT https://github.com/sybip/pyGT """
 
-from struct import pack, unpack
+from struct import pack
 from binascii import hexlify
 
 try:
@@ -10,18 +10,57 @@ except NameError:  # Python3 doesn't know basestring
 
 
 def tlvRead(data):
-    while data:
-        try:
-            type, length = unpack('BB', data[:2])
-            value = unpack('%is' % length, data[2:2+length])[0]
-        except:
+    """
+    Iterate over the (type, length, value) elements of a TLV buffer
+    Raises ValueError at the first element which overruns the buffer
+    """
+    # walk by offset: slicing off each element would copy the rest of
+    #   the buffer every time, quadratic in the number of elements
+    data = bytes(data)
+    pos = 0
+    end = len(data)
+    while pos < end:
+        if pos + 2 > end or pos + 2 + data[pos+1] > end:
             raise ValueError('Invalid TLV')
+        length = data[pos+1]
+        yield data[pos], length, data[pos+2:pos+2+length]
+        pos += 2 + length
 
-        yield type, length, value
-        data = data[2+length:]
+
+def tlvOffsets(data):
+    """
+    Iterate over the (type, offset, length) of the elements of a TLV
+      buffer, for parsers which read values in place rather than slice
+      them out (value is data[offset:offset+length])
+    Raises ValueError at the first element which overruns the buffer
+    """
+    pos = 0
+    end = len(data)
+    while pos < end:
+        if pos + 2 > end or pos + 2 + data[pos+1] > end:
+            raise ValueError('Invalid TLV')
+        yield data[pos], pos + 2, data[pos+1]
+        pos += 2 + data[pos+1]
 
 
 def tlvPack(dtype, data):
     if (type(data) is basestring):
         data = data.encode('utf8')
     return pack('BB', dtype, len(data)) + data
+
+
+# Pure Python version, kept for reference and equivalence testing
+tlvReadPy = tlvRead
+
+try:
+    from _gtaccel import tlv_scan as _tlvScan
+except ImportError:
+    _tlvScan = None
+
+if _tlvScan is not None:
+    def tlvRead(data):  # noqa: F811
+        items, end = _tlvScan(data)
+        for item in items:
+            yield item
+        if end != len(data):
+            raise ValueError('Invalid TLV')
@@ -37,3 +37,12 @@ def crc(str):
     for c in bytearray(str):
         crc = _update_crc(crc, c)
     return crc
+
+
+# Pure Python version, kept for reference and equivalence testing
+crcPy = crc
+
+try:
+    from _gtaccel import crc16 as crc  # noqa: F811
+except ImportError:
+    pass
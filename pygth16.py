@@ -17,3 +17,12 @@ def gtAlgoH16(str):
     # Derive 16-bit value from 32-bit hash by XORing its two halves
     r = ((h & 0xFFFF0000) >> 16) ^ (h & 0xFFFF)
     return r
+
+
+# Pure Python version, kept for reference and equivalence testing
+gtAlgoH16Py = gtAlgoH16
+
+try:
+    from _gtaccel import gth16 as gtAlgoH16  # noqa: F811
+except ImportError:
+    pass
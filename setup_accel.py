@@ -0,0 +1,14 @@
+""" Build the optional C accelerator for pyGT, in place:
+
+    python setup_accel.py build_ext --inplace
+
+pycrc16, pygth16, pyTLV and gtframe fall back to pure Python if the
+  resulting _gtaccel module is not present
+"""
+
+from setuptools import setup, Extension
+
+setup(
+    name='pyGT-accel',
+    ext_modules=[Extension('_gtaccel', sources=['_gtaccel.c'])],
+)
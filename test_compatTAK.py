@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+""" Tests for the TAK plugin objects (compatTAK) and group keyrings
+    (compatGTA) - encryption needs cryptography
+"""
+
+import os
+import unittest
+from struct import pack
+
+try:
+    from compatTAK import _aes
+    _aes()
+except ImportError:
+    _aes = None
+
+from compatTAK import (aesContext, aesDecrypt, aesEncrypt, gtMakeTAKBlobMsg,
+                       gtMakeTAKBlobPLI, gtReadTAKBlob, pad, BLOCK_SIZE)
+from compatGTA import (gtKeyring, gtReadGTAContent, gtMakeGTABlobMsg,
+                       GTA_CONTENT_GROUP_KEY)
+from pyTLV import tlvPack
+from pycrc16 import crc
+from gtdefs import MSGB_TLV_TYPE, MSGB_TLV_NICK
+
+
+class contentTest(unittest.TestCase):
+
+    def test_text(self):
+        res = gtReadGTAContent(gtMakeGTABlobMsg('hello', 'NICK'))
+        self.assertEqual((res['nick'], res['text']), ('NICK', 'hello'))
+
+    def test_group_key(self):
+        # group setup content is not decoded beyond the common fields
+        blob = (tlvPack(MSGB_TLV_TYPE, b'%d' % GTA_CONTENT_GROUP_KEY) +
+                tlvPack(MSGB_TLV_NICK, b'NICK') + tlvPack(0x07, bytes(32)))
+        blob += pack('!H', crc(blob))
+        self.assertEqual(gtReadGTAContent(blob),
+                         {'contentType': GTA_CONTENT_GROUP_KEY,
+                          'nick': 'NICK'})
+
+
+@unittest.skipIf(_aes is None, "cryptography not installed")
+class aesTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        key = os.urandom(32)
+        ctx = aesContext(key)
+        for n in (0, 1, 15, 16, 17, 100):
+            text = os.urandom(n)
+            for k in (key, ctx):
+                cipherGram = aesEncrypt(text, k)
+                self.assertEqual(len(cipherGram) % BLOCK_SIZE, 0)
+                self.assertEqual(aesDecrypt(cipherGram, key), text)
+                self.assertEqual(aesDecrypt(cipherGram, ctx), text)
+                self.assertEqual(ctx.decrypt(cipherGram), text)
+
+    def test_cbc(self):
+        # same result as a plain AES-CBC cipher, both ways
+        (Cipher, algorithms, modes, backend) = _aes()
+        key = os.urandom(16)
+        iv = os.urandom(BLOCK_SIZE)
+        text = os.urandom(40)
+
+        enc = Cipher(algorithms.AES(key), modes.CBC(iv), backend).encryptor()
+        cipherGram = iv + enc.update(pad(text)) + enc.finalize()
+        self.assertEqual(aesDecrypt(cipherGram, key), text)
+        self.assertEqual(aesDecrypt(cipherGram, aesContext(key)), text)
+
+        cipherGram = aesContext(key).encrypt(text)
+        (iv, cipherText) = (cipherGram[:BLOCK_SIZE], cipherGram[BLOCK_SIZE:])
+        dec = Cipher(algorithms.AES(key), modes.CBC(iv), backend).decryptor()
+        self.assertEqual(dec.update(cipherText) + dec.finalize(), pad(text))
+
+    def test_bad_length(self):
+        key = os.urandom(16)
+        self.assertIs(aesDecrypt(os.urandom(BLOCK_SIZE + 5), key), False)
+        self.assertIs(aesContext(key).decrypt(os.urandom(BLOCK_SIZE + 5)),
+                      False)
+
+    def test_keyring(self):
+        ring = gtKeyring()
+        (good, bad) = (os.urandom(16), os.urandom(16))
+        ring.add(0x11, bad)
+        ring.add(0x22, good, (1, 2))
+        self.assertEqual((len(ring), 0x22 in ring, 0x33 in ring),
+                         (2, True, False))
+        # contexts are prepared once per key
+        ctx = ring[0x22]
+        self.assertIs(ring.context(0x22), ctx)
+        ring.add(0x22, good)
+        self.assertIs(ring.context(0x22), ctx)
+        ring.add(0x22, bad)
+        self.assertIsNot(ring.context(0x22), ctx)
+        ring.add(0x22, good)
+
+        msg = gtReadTAKBlob(gtMakeTAKBlobMsg(b'CS', b'hi', good), ring)
+        self.assertEqual((msg['crypt'], msg['keyID']), (True, 0x22))
+        pli = gtReadTAKBlob(gtMakeTAKBlobPLI(
+            b'ANDROID-1', b'a-f-G-U-C', b'CS', b'm-g', 51.9, 4.0, 1.0,
+            b'Cyan', 60, ring[0x22]), ring)
+        self.assertEqual(pli['keyID'], 0x22)
+
+        ring.drop(0x22)
+        self.assertIs(gtReadTAKBlob(gtMakeTAKBlobMsg(b'CS', b'hi', good),
+                                    ring), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+
+""" Equivalence tests: C accelerator (_gtaccel) vs pure Python versions
+    Build the accelerator first:  python setup_accel.py build_ext --inplace
+"""
+
+import random
+import unittest
+
+import pycrc16
+import pygth16
+import pyTLV
+import gtframe
+
+try:
+    import _gtaccel
+except ImportError:
+    _gtaccel = None
+
+ROUNDS = 2000
+
+
+def randomBytes(rnd, maxlen=300):
+    n = rnd.randint(0, maxlen)
+    if rnd.random() < 0.3:
+        # escape-heavy input
+        return bytes(rnd.choice(b'\x10\x10\x02\x03\x00\xff') for i in range(n))
+    return bytes(rnd.getrandbits(8) for i in range(n))
+
+
+def randomTLVs(rnd):
+    data = b''
+    for i in range(rnd.randint(0, 8)):
+        value = bytes(rnd.getrandbits(8) for j in range(rnd.randint(0, 40)))
+        data += pyTLV.tlvPack(rnd.randint(0, 255), value)
+    if rnd.random() < 0.5:
+        data = data[:rnd.randint(0, len(data))]  # often truncated
+    return data
+
+
+def tlvList(reader, data):
+    res = []
+    try:
+        for item in reader(data):
+            res.append(item)
+    except ValueError:
+        res.append('ValueError')
+    return res
+
+
+@unittest.skipIf(_gtaccel is None, "_gtaccel not built")
+class accelEquivalence(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(0x6007)
+
+    def test_autoselect(self):
+        self.assertIs(pycrc16.crc, _gtaccel.crc16)
+        self.assertIs(pygth16.gtAlgoH16, _gtaccel.gth16)
+        self.assertIs(gtframe.gtEscape, _gtaccel.escape)
+
+    def test_crc16(self):
+        for i in range(ROUNDS):
+            data = randomBytes(self.rnd)
+            self.assertEqual(_gtaccel.crc16(data), pycrc16.crcPy(data))
+
+    def test_gth16(self):
+        for i in range(ROUNDS):
+            data = randomBytes(self.rnd)
+            self.assertEqual(_gtaccel.gth16(data), pygth16.gtAlgoH16Py(data))
+
+    def test_escape(self):
+        for i in range(ROUNDS):
+            data = randomBytes(self.rnd)
+            self.assertEqual(_gtaccel.escape(data), gtframe.gtEscapePy(data))
+
+    def test_unescape_scan(self):
+        for i in range(ROUNDS):
+            data = randomBytes(self.rnd)
+            pos = self.rnd.randint(0, len(data))
+            esc = self.rnd.random() < 0.5
+            self.assertEqual(_gtaccel.unescape_scan(data, pos, esc),
+                             gtframe.gtUnescapeScanPy(data, pos, esc))
+
+    def test_unescape_into(self):
+        for i in range(ROUNDS):
+            data = randomBytes(self.rnd)
+            pos = self.rnd.randint(0, len(data))
+            esc = self.rnd.random() < 0.5
+            out = bytearray(randomBytes(self.rnd, 40))
+            at = self.rnd.randint(0, len(out))
+            (outC, outPy) = (bytearray(out), bytearray(out))
+            resC = _gtaccel.unescape_into(outC, at, data, pos, esc)
+            resPy = gtframe.gtUnescapeIntoPy(outPy, at, data, pos, esc)
+            self.assertEqual(resC, resPy)
+            self.assertEqual(outC[:resC[0]], outPy[:resPy[0]])
+            self.assertEqual(outC[:at], out[:at])
+
+    def test_tlv_scan(self):
+        for i in range(ROUNDS):
+            data = randomTLVs(self.rnd)
+            self.assertEqual(tlvList(pyTLV.tlvRead, data),
+                             tlvList(pyTLV.tlvReadPy, data))
+
+
+if __name__ == '__main__':
+    unittest.main()
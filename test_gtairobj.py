@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+""" Tests for the air frame parsers (gtairobj) """
+
+import unittest
+from struct import pack
+
+from gtairobj import (gtMakeAirMsg, gtReadAirMsg, gtAirParse, gtReadAirMsgs,
+                      AIR_ERR_SHORT, AIR_ERR_META, AIR_ERR_HEAD)
+from gtdefs import (MSG_CLASS_P2P, MSG_CLASS_GROUP, MSG_CLASS_SHOUT,
+                    MSG_CLASS_EMERG, MESG_TLV_MXRX, MESG_TLV_MXTX)
+
+MXRX = pack('BB', MESG_TLV_MXRX, 3) + b'\x01\x02\x03'
+MXTX = pack('BB', MESG_TLV_MXTX, 1) + b'\x09'
+
+
+def _airMsg(blob=b'hello', msgClass=MSG_CLASS_SHOUT, destGID=0):
+    return gtMakeAirMsg(blob, msgClass, 0x3fff, 0x1122334455, destGID, 7,
+                        seqNo0=0x1234, seqNo1=0x56)
+
+
+class airParseTest(unittest.TestCase):
+
+    def test_classes(self):
+        for msgClass in (MSG_CLASS_P2P, MSG_CLASS_GROUP, MSG_CLASS_SHOUT,
+                         MSG_CLASS_EMERG):
+            msg = gtReadAirMsg(_airMsg(b'blob', msgClass, 0xaabbccddee))
+            self.assertEqual((msg['classID'], msg['appID'], msg['fromGID'],
+                              msg['seqNo0'], msg['seqNo1'], msg['msgBlob']),
+                             (msgClass, 0x3fff, 0x1122334455, 0x1234, 0x56,
+                              b'blob'))
+            if msgClass in (MSG_CLASS_P2P, MSG_CLASS_GROUP):
+                self.assertEqual((msg['destGID'], msg['destTag']),
+                                 (0xaabbccddee, 7))
+            else:
+                self.assertNotIn('destGID', msg)
+            self.assertEqual('tlv_04' in msg, msgClass == MSG_CLASS_P2P)
+
+    def test_mesh_metadata(self):
+        frame = _airMsg()
+        (msg, err) = gtAirParse(MXRX + MXTX + frame)
+        self.assertIsNone(err)
+        self.assertEqual((msg['meshRX'], msg['meshTX']),
+                         (b'\x01\x02\x03', b'\x09'))
+        self.assertEqual(msg['msgBlob'], b'hello')
+        self.assertEqual(msg['hashID'], gtAirParse(frame)[0]['hashID'])
+
+    def test_errors(self):
+        frame = _airMsg()
+        for (pdu, want) in ((b'', AIR_ERR_SHORT),
+                            (frame[:20], AIR_ERR_SHORT),
+                            (MXRX[:1], AIR_ERR_META),
+                            (MXRX[:4], AIR_ERR_META),
+                            (frame[:3] + b'\x00' + frame[4:], AIR_ERR_HEAD)):
+            self.assertEqual(gtAirParse(pdu), (None, want))
+            self.assertIs(gtReadAirMsg(pdu), False)
+        # an empty blob is fine
+        self.assertEqual(gtReadAirMsg(_airMsg(b''))['msgBlob'], b'')
+
+
+class airBatchTest(unittest.TestCase):
+
+    def frames(self):
+        good = [_airMsg(b'%d' % i) for i in range(20)]
+        return (good[:5] + [b'\x02\x3f'] + good[5:15] +
+                [MXRX[:4], _airMsg()[:3] + b'\x00' * 20] + good[15:])
+
+    def test_batch(self):
+        frames = self.frames()
+        stats = {}
+        msgs = list(gtReadAirMsgs(frames, stats))
+        self.assertEqual([m['msgBlob'] for m in msgs],
+                         [b'%d' % i for i in range(20)])
+        self.assertEqual(stats, {'frames': 23, 'decoded': 20, 'malformed': 3,
+                                 AIR_ERR_SHORT: 1, AIR_ERR_META: 1,
+                                 AIR_ERR_HEAD: 1})
+
+    def test_pool(self):
+        frames = self.frames()
+        stats = {}
+        msgs = list(gtReadAirMsgs(iter(frames), stats, processes=2,
+                                  chunksize=4))
+        self.assertEqual(msgs, list(gtReadAirMsgs(frames)))
+        self.assertEqual(stats['malformed'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
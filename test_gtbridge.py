@@ -0,0 +1,286 @@
+#!/usr/bin/python
+
+""" Tests for the CoT gateway: conversions, and end to end between a
+    simulated device (needs bluepy) and local sockets
+"""
+
+import os
+import time
+import socket
+import threading
+import unittest
+
+from gtbridge import (pliToCoT, chatToCoT, cotToBlob, cotTransport, cotUDP,
+                      cotTCP, gtCoTBridge, COT_MAX_BLOB)
+from gtapiobj import gtMakeAPIMsg, gtReadAPIMsg
+from compatTAK import (gtReadTAKBlob, gtMakeTAKBlobPLI, gtMakeTAKBlobMsg,
+                       GTAK_TYPE_PLI, GTAK_TYPE_MSG)
+from gtdefs import MSG_CLASS_SHOUT
+
+try:
+    from compatTAK import _aes
+    _aes()
+except ImportError:
+    _aes = None
+
+try:
+    import gtdevice  # noqa: F401
+    from gtsim import gtSimDev, gtSimRadio
+except ImportError:
+    gtSimDev = None
+
+PLI = dict(uuid='ANDROID-1', type='a-f-G-U-C', callsign='ALPHA', how='m-g',
+           lat='51.900000', lon='4.050000', hae='12.500', team='Cyan',
+           update='60')
+
+
+def _pliEvent(uid, lat):
+    return ('<event version="2.0" uid="%s" type="a-f-G-U-C" how="m-g">'
+            '<point lat="%f" lon="4.05" hae="3.0" ce="9" le="9"/>'
+            '<detail><contact callsign="BRAVO"/><__group name="Red"/>'
+            '</detail></event>' % (uid, lat)).encode()
+
+
+CHAT = (b'<event version="2.0" uid="GeoChat.x" type="b-t-f" how="h-g-i-g-o">'
+        b'<point lat="0" lon="0" hae="0" ce="9" le="9"/><detail>'
+        b'<__chat senderCallsign="BRAVO"/><remarks>all good</remarks>'
+        b'</detail></event>')
+
+
+def _chatEvent(text):
+    return CHAT.replace(b'all good', text)
+
+
+def _waitFor(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cond():
+            return True
+        time.sleep(0.01)
+    return cond()
+
+
+class conversionTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        self.assertIsNone(cotToBlob(b'<event type="t-x-c"/>'))
+        self.assertIsNone(cotToBlob(b'not xml'))
+        (key, blob) = cotToBlob(pliToCoT(PLI))
+        self.assertEqual(key, ('pli', 'ANDROID-1'))
+        pli = gtReadTAKBlob(blob)
+        for k in ('uuid', 'type', 'callsign', 'how', 'team'):
+            self.assertEqual(pli[k], PLI[k])
+        self.assertAlmostEqual(float(pli['lat']), 51.9)
+
+        (key, blob) = cotToBlob(chatToCoT({'callsign': 'ALPHA',
+                                           'message': 'roger'}, 0x1234))
+        self.assertIsNone(key)
+        chat = gtReadTAKBlob(blob)
+        self.assertEqual((chat['callsign'], chat['message']),
+                         ('ALPHA', 'roger'))
+
+    def test_oversized(self):
+        # fields which don't fit a message: dropped, not raised
+        self.assertIsNone(cotToBlob(_pliEvent('A' * 400, 50.)))
+        (key, blob) = cotToBlob(_pliEvent('A' * 100, 50.))
+        self.assertLessEqual(len(blob), COT_MAX_BLOB)
+        # chat text is cut short instead (not within a UTF-8 sequence)
+        for text in (b'x' * 400, u'\xe9'.encode('utf8') * 200):
+            (key, blob) = cotToBlob(_chatEvent(text))
+            self.assertLessEqual(len(blob), COT_MAX_BLOB)
+            message = gtReadTAKBlob(blob)['message']
+            self.assertTrue(text.decode('utf8').startswith(message))
+            self.assertGreater(len(message), 100)
+
+    @unittest.skipIf(_aes is None, "cryptography not installed")
+    def test_oversized_encrypted(self):
+        key = os.urandom(16)
+        for n in (100, 200, 400):
+            (k, blob) = cotToBlob(_chatEvent(b'x' * n), key)
+            self.assertLessEqual(len(blob), COT_MAX_BLOB)
+            message = gtReadTAKBlob(blob, {'k': key})['message']
+            self.assertEqual(message, 'x' * min(n, len(message)))
+            self.assertGreater(len(message), min(n - 1, 100))
+
+
+@unittest.skipIf(gtSimDev is None, "bluepy not installed")
+class bridgeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.radio = gtSimRadio()
+        self.dev = gtSimDev(self.radio)
+        self.dev.initialize()
+        self.net = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.net.bind(('127.0.0.1', 0))
+        self.net.settimeout(5)
+        self.bridge = None
+
+    def tearDown(self):
+        if self.bridge is not None:
+            self.bridge.stop()
+        self.dev.disconnect()
+        self.net.close()
+
+    def startUDP(self, **kwargs):
+        transport = cotUDP(self.net.getsockname(), ('127.0.0.1', 0))
+        self.bridge = gtCoTBridge(self.dev, transport, 0x1122, **kwargs)
+        self.bridge.start()
+        return transport.rx.getsockname()
+
+    def test_radio_to_net(self):
+        self.startUDP()
+        blob = gtMakeTAKBlobPLI(b'ANDROID-9', b'a-f-G-U-C', b'ZULU', b'm-g',
+                                51.9, 4.05, 12.5, b'Cyan', 60)
+        self.radio.receive(gtMakeAPIMsg(blob, MSG_CLASS_SHOUT, 0x3fff, 0x99))
+        self.radio.receive(gtMakeAPIMsg(gtMakeTAKBlobMsg(b'ZULU', b'hi'),
+                                        MSG_CLASS_SHOUT, 0x3fff, 0x99))
+        pli = self.net.recv(65536)
+        chat = self.net.recv(65536)
+        self.assertIn(b'uid="ANDROID-9"', pli)
+        self.assertIn(b'callsign="ZULU"', pli)
+        self.assertIn(b'type="b-t-f"', chat)
+        self.assertIn(b'>hi</remarks>', chat)
+        self.assertTrue(_waitFor(lambda: not self.radio.inbox))
+        self.assertEqual(self.bridge.stats()['netTx'], 2)
+
+    def test_net_to_radio(self):
+        listen = self.startUDP(batchWindow=0.3)
+        for lat in (50.0, 50.1, 50.2):
+            self.net.sendto(_pliEvent('ANDROID-7', lat), listen)
+        self.net.sendto(CHAT, listen)
+        self.net.sendto(b'<event type="t-x-c-t"/>', listen)
+        self.assertTrue(_waitFor(lambda: len(self.radio.sent) == 2))
+        objs = [gtReadTAKBlob(gtReadAPIMsg(pdu)['msgBlob'])
+                for pdu in self.radio.sent]
+        self.assertEqual(objs[0]['objType'], GTAK_TYPE_PLI)
+        self.assertAlmostEqual(float(objs[0]['lat']), 50.2)
+        self.assertEqual(objs[1]['objType'], GTAK_TYPE_MSG)
+        self.assertEqual(objs[1]['message'], 'all good')
+        stats = self.bridge.stats()
+        self.assertEqual(stats['coalesced'], 2)
+        self.assertEqual(stats['unparsed'], 1)
+        self.assertEqual(stats['radioTx'], 2)
+
+    def test_oversized_event(self):
+        listen = self.startUDP(batchWindow=0.)
+        self.net.sendto(_pliEvent('A' * 400, 50.), listen)
+        self.assertTrue(_waitFor(lambda: self.bridge.stats()['unparsed']))
+        # the sender thread survived it
+        self.net.sendto(_pliEvent('ANDROID-7', 50.), listen)
+        self.assertTrue(_waitFor(lambda: len(self.radio.sent) == 1))
+        self.assertEqual(gtReadTAKBlob(gtReadAPIMsg(
+            self.radio.sent[0])['msgBlob'])['uuid'], 'ANDROID-7')
+        self.assertEqual(self.bridge.stats()['unparsed'], 1)
+
+    def test_udp_overflow(self):
+        listen = self.startUDP(queueSize=4, batchWindow=0.,
+                               minInterval=0.05)
+        for n in range(40):
+            self.net.sendto(_pliEvent('ANDROID-%d' % n, 50.), listen)
+        self.assertTrue(_waitFor(lambda: self.bridge.stats()['netRx'] == 40))
+        self.assertTrue(_waitFor(lambda: not self.bridge.stats()['toRadio']))
+        stats = self.bridge.stats()
+        self.assertGreater(stats['netDropped'], 0)
+        self.assertTrue(_waitFor(lambda: self.bridge.stats()['radioTx'] ==
+                                 40 - stats['netDropped']))
+
+    def test_radio_backpressure(self):
+        transport = cotUDP(self.net.getsockname())
+        transport.send = lambda event: time.sleep(0.2)
+        self.bridge = gtCoTBridge(self.dev, transport, 0x1122, queueSize=1)
+        self.bridge.start()
+        for n in range(5):
+            self.radio.receive(gtMakeAPIMsg(
+                gtMakeTAKBlobMsg(b'ZULU', b'%d' % n), MSG_CLASS_SHOUT,
+                0x3fff, 0x99))
+        # messages wait on the device, not in the bridge
+        self.assertTrue(_waitFor(lambda: self.bridge.stats()['radioWaits']))
+        self.assertGreater(len(self.radio.inbox), 1)
+        self.assertTrue(_waitFor(lambda: not self.radio.inbox))
+
+    def test_tcp(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        transport = cotTCP(server.getsockname())
+        (conn, addr) = server.accept()
+        server.close()
+        self.bridge = gtCoTBridge(self.dev, transport, 0x1122,
+                                  batchWindow=0.)
+        self.bridge.start()
+        try:
+            # an event split across segments, then two in one
+            conn.sendall(CHAT[:50])
+            time.sleep(0.05)
+            conn.sendall(CHAT[50:] + _pliEvent('A', 1.) + _pliEvent('B', 2.))
+            self.assertTrue(_waitFor(lambda: len(self.radio.sent) == 3))
+
+            self.radio.receive(gtMakeAPIMsg(gtMakeTAKBlobMsg(b'Z', b'ok'),
+                                            MSG_CLASS_SHOUT, 0x3fff, 0x99))
+            conn.settimeout(5)
+            data = b''
+            while b'</event>' not in data:
+                data += conn.recv(4096)
+            self.assertIn(b'>ok</remarks>', data)
+        finally:
+            conn.close()
+
+
+class transportTest(unittest.TestCase):
+
+    def test_abstract(self):
+        class sendOnly(cotTransport):
+            def send(self, event):
+                pass
+        with self.assertRaises(TypeError):
+            sendOnly()
+
+    def test_tcp_send_blocked(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        transport = cotTCP(server.getsockname())
+        (conn, addr) = server.accept()
+        server.close()
+        received = []
+        transport.start(received.append)
+        big = b'x' * (8 << 20)
+        sender = threading.Thread(target=transport.send, args=(big, ))
+        sender.start()
+        try:
+            # the server isn't reading: the send waits, without touching
+            #   the timeout the receiver thread relies on
+            time.sleep(0.3)
+            self.assertTrue(sender.is_alive())
+            self.assertEqual(transport.sock.gettimeout(), 0.2)
+            conn.sendall(CHAT)
+            self.assertTrue(_waitFor(lambda: received == [CHAT]))
+
+            conn.settimeout(5)
+            got = 0
+            while got < len(big):
+                got += len(conn.recv(1 << 16))
+            sender.join(5)
+            self.assertFalse(sender.is_alive())
+        finally:
+            conn.close()
+            transport.close()
+            sender.join()
+
+    def test_counters(self):
+        bridge = gtCoTBridge(None, None, 0x1122)
+
+        def worker():
+            for i in range(10000):
+                bridge.count('netRx')
+
+        threads = [threading.Thread(target=worker) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(bridge.stats()['netRx'], 80000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+""" Tests for the shared message codec (gtcodec), and its API and air
+    framing conversions
+"""
+
+import unittest
+from struct import pack
+
+from gtcodec import (gtEncodeMsg, gtApiToAir, gtAirToApi, gtPackDest,
+                     gtUnpackDest, gtPackHead, gtUnpackHead, gtDestLen,
+                     DEST_LEN_SHORT, DEST_LEN_LONG, HEAD_LEN)
+from gtapiobj import gtReadAPIMsg
+from gtairobj import gtReadAirMsg
+from gtdefs import (MSG_CLASS_P2P, MSG_CLASS_GROUP, MSG_CLASS_SHOUT,
+                    MSG_CLASS_EMERG, MESG_TLV_MXRX, MESG_TLV_MXTX,
+                    MESG_TLV_HOPS)
+
+MSG_CLASSES = (MSG_CLASS_P2P, MSG_CLASS_GROUP, MSG_CLASS_SHOUT,
+               MSG_CLASS_EMERG)
+
+
+def _encode(blob, msgClass, air=False, meshTTL=3):
+    return gtEncodeMsg(blob, msgClass, 0x3fff, 0x1122334455, 0xaabbccddee,
+                       9, meshTTL, 0x1234, 0x56, 1, 1500000000, air=air)
+
+
+class elementTest(unittest.TestCase):
+
+    def test_dest(self):
+        for msgClass in MSG_CLASSES:
+            value = gtPackDest(msgClass, 0x3fff, 0xaabbccddee, 9)
+            msg = gtUnpackDest(b'xx' + value, {}, 2)
+            self.assertEqual((msg['classID'], msg['appID']),
+                             (msgClass, 0x3fff))
+            if msgClass in (MSG_CLASS_P2P, MSG_CLASS_GROUP):
+                self.assertEqual(len(value), DEST_LEN_LONG)
+                self.assertEqual((msg['destGID'], msg['destTag']),
+                                 (0xaabbccddee, 9))
+            else:
+                self.assertEqual(len(value), DEST_LEN_SHORT)
+                self.assertNotIn('destGID', msg)
+        self.assertEqual(gtDestLen(MSG_CLASS_P2P), DEST_LEN_LONG + 3)
+
+    def test_head(self):
+        head = gtPackHead(0x1122334455, 1500000000, 0x1234, 0x56, 1)
+        self.assertEqual(len(head), HEAD_LEN)
+        msg = gtUnpackHead(head, {}, 2)
+        self.assertEqual((msg['cryptFlag'], msg['fromGID'], msg['tstamp'],
+                          msg['seqNo0'], msg['seqNo1']),
+                         (1, 0x1122334455, 1500000000, 0x1234, 0x56))
+        # hashID covers the whole element value
+        other = gtUnpackHead(gtPackHead(0x1122334455, 1500000000, 0x1234,
+                                        0x57, 1), {}, 2)
+        self.assertNotEqual(msg['hashID'], other['hashID'])
+
+
+class framingTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for msgClass in MSG_CLASSES:
+            for blob in (b'', b'hello', bytes(range(256))[:237]):
+                api = _encode(blob, msgClass)
+                air = _encode(blob, msgClass, air=True)
+                self.assertEqual(gtApiToAir(api), air)
+                self.assertEqual(gtAirToApi(air), api)
+                self.assertEqual(gtAirToApi(air, meshTTL=5),
+                                 _encode(blob, msgClass, meshTTL=5))
+
+                # both parsers agree on every field
+                self.assertEqual(gtReadAPIMsg(api), gtReadAirMsg(air))
+
+    def test_metadata(self):
+        air = _encode(b'relayed', MSG_CLASS_SHOUT, air=True)
+        meta = (pack('BB', MESG_TLV_MXRX, 2) + b'\x01\x02' +
+                pack('BB', MESG_TLV_MXTX, 0))
+        self.assertEqual(gtAirToApi(meta + air), gtAirToApi(air))
+        # elements the air framing doesn't carry are dropped
+        api = _encode(b'relayed', MSG_CLASS_SHOUT)
+        self.assertEqual(gtApiToAir(api + pack('BBBB', MESG_TLV_HOPS, 2, 1,
+                                               0x40)), air)
+
+    def test_errors(self):
+        air = _encode(b'x', MSG_CLASS_P2P, air=True)
+        for pdu in (b'', air[:DEST_LEN_LONG + 3 + HEAD_LEN - 1],
+                    pack('B', MESG_TLV_MXRX),
+                    pack('BB', MESG_TLV_MXRX, 5) + air[:5],
+                    _encode(bytes(240), MSG_CLASS_P2P, air=True)):
+            with self.assertRaises(ValueError):
+                gtAirToApi(pdu)
+        # the longest blob that fits
+        self.assertEqual(
+            gtApiToAir(gtAirToApi(_encode(bytes(237), MSG_CLASS_P2P,
+                                          air=True))),
+            _encode(bytes(237), MSG_CLASS_P2P, air=True))
+
+        api = _encode(b'x', MSG_CLASS_SHOUT)
+        for pdu in (api[:-1], api[:2] + api[2 + DEST_LEN_SHORT:],
+                    api[:2 + DEST_LEN_SHORT]):
+            with self.assertRaises(ValueError):
+                gtApiToAir(pdu)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+
+""" Tests for blob compression and binary PLIs (gtcompress) """
+
+import os
+import unittest
+
+from gtcompress import (gtCompressBlob, gtExpandBlob, gtIsCompressed,
+                        gtPackPLI, gtUnpackPLI, PLI_BIN_MARK)
+from compatGTA import gtMakeGTABlobMsg, gtReadGTABlob
+from compatTAK import gtMakeTAKBlobPLI, gtReadTAKBlob
+
+PLI = (b'ANDROID-358240051111110', b'a-f-G-U-C', b'SYBIP', b'm-g',
+       51.948912, -4.053521, 12.5, b'Cyan', 60)
+
+
+class blobTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for blob in (gtMakeGTABlobMsg('On my way, ETA 10 min', 'SYBIP'),
+                     b'please copy, moving to the contact point ' * 20):
+            packed = gtCompressBlob(blob)
+            self.assertTrue(gtIsCompressed(packed))
+            self.assertLess(len(packed), len(blob))
+            self.assertEqual(gtExpandBlob(packed), blob)
+
+    def test_passthrough(self):
+        # incompressible and unmarked blobs are left as they are
+        blob = os.urandom(100)
+        self.assertEqual(gtCompressBlob(blob), blob)
+        self.assertEqual(gtExpandBlob(blob), blob)
+        self.assertEqual(gtExpandBlob(b''), b'')
+
+    def test_readers(self):
+        msg = gtReadGTABlob(gtMakeGTABlobMsg('hello', 'NICK', compress=True))
+        self.assertEqual(msg, gtReadGTABlob(gtMakeGTABlobMsg('hello',
+                                                             'NICK')))
+        pli = gtReadTAKBlob(gtMakeTAKBlobPLI(*PLI, compact=True,
+                                             compress=True))
+        self.assertEqual((pli['callsign'], pli['lat']), ('SYBIP',
+                                                         '51.948912'))
+
+    def test_limit(self):
+        blob = bytes(5000)
+        packed = gtCompressBlob(blob)
+        self.assertEqual(gtExpandBlob(packed, limit=5000), blob)
+        with self.assertRaises(ValueError):
+            gtExpandBlob(packed)        # default limit: 4KB
+        with self.assertRaises(ValueError):
+            gtExpandBlob(packed, limit=4999)
+
+    def test_corrupt(self):
+        packed = gtCompressBlob(b'please copy ' * 10)
+        for bad in (packed[:-2], packed[:3] + b'\xff' * 8):
+            with self.assertRaises(ValueError):
+                gtExpandBlob(bad)
+        # and the readers drop them
+        self.assertIs(gtReadTAKBlob(packed[:-2]), False)
+
+
+class pliTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        data = gtPackPLI(*PLI)
+        self.assertEqual(data[:2], PLI_BIN_MARK)
+        self.assertEqual(gtUnpackPLI(data),
+                         b'ANDROID-358240051111110;a-f-G-U-C;SYBIP;m-g;'
+                         b'51.948912;-4.053521;12.500;Cyan;60')
+        self.assertLess(len(data), len(gtUnpackPLI(data)))
+
+    def test_invalid(self):
+        data = gtPackPLI(*PLI)
+        for bad in (b'', data[:17], b'\x00\x02' + data[2:], data[:-3],
+                    data[:18] + gtCompressBlob(b'a;b')[3:]):
+            with self.assertRaises(ValueError):
+                gtUnpackPLI(bad)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+
+""" Tests for the mesh duplicate suppression cache (gtdedup) """
+
+import json
+import random
+import unittest
+
+from gtdedup import gtDedupCache
+
+
+def _msg(hashID, fromGID=0x111, tstamp=1000, seqNo0=0, seqNo1=0):
+    return dict(hashID=hashID, fromGID=fromGID, tstamp=tstamp,
+                seqNo0=seqNo0, seqNo1=seqNo1)
+
+
+class dedupTest(unittest.TestCase):
+
+    def assertConsistent(self, cache):
+        """ front counters account for exactly the live entries """
+        counts = {}
+        for (hashID, when) in cache.entries.values():
+            counts[hashID] = counts.get(hashID, 0) + 1
+        self.assertEqual(sum(cache.front), len(cache.entries))
+        for (hashID, count) in counts.items():
+            self.assertEqual(cache.front[hashID], count)
+
+    def test_duplicates(self):
+        cache = gtDedupCache()
+        self.assertFalse(cache.seen(_msg(0x1234), now=0))
+        self.assertTrue(cache.seen(_msg(0x1234), now=1))
+        self.assertTrue(cache.seen(_msg(0x1234), now=2))
+        # hashID collision with another message: checked, and new
+        self.assertFalse(cache.seen(_msg(0x1234, seqNo0=1), now=3))
+        self.assertEqual(len(cache), 2)
+        stats = cache.stats()
+        self.assertEqual((stats['lookups'], stats['dups'],
+                          stats['frontHits'], stats['falsePos']),
+                         (4, 2, 3, 1))
+        self.assertConsistent(cache)
+
+    def test_key_under_other_hash(self):
+        cache = gtDedupCache(capacity=2)
+        cache.seen(_msg(0x0001), now=0)
+        cache.seen(_msg(0x0002, seqNo0=1), now=1)
+        # same exact key, different hashID: new, and the entry replaced
+        self.assertFalse(cache.seen(_msg(0x0003), now=2))
+        self.assertEqual(cache.front[0x0001], 0)
+        self.assertEqual(len(cache), 2)
+        self.assertConsistent(cache)
+        # ... as the newest entry, so the other one is evicted first
+        cache.seen(_msg(0x0004, seqNo0=2), now=3)
+        self.assertEqual(cache.front[0x0002], 0)
+        self.assertTrue(cache.seen(_msg(0x0003), now=4))
+        self.assertFalse(cache.seen(_msg(0x0001), now=5))
+        self.assertConsistent(cache)
+
+    def test_capacity(self):
+        cache = gtDedupCache(capacity=10)
+        for i in range(25):
+            cache.seen(_msg(i, seqNo0=i), now=i)
+        self.assertEqual(len(cache), 10)
+        self.assertEqual(cache.evictedFull, 15)
+        # the oldest were forgotten, the newest are still known
+        self.assertTrue(cache.seen(_msg(24, seqNo0=24), now=30))
+        self.assertFalse(cache.seen(_msg(0, seqNo0=0), now=31))
+        self.assertConsistent(cache)
+
+    def test_window(self):
+        cache = gtDedupCache(window=10)
+        cache.seen(_msg(1), now=0)
+        cache.seen(_msg(2, seqNo0=1), now=5)
+        self.assertTrue(cache.seen(_msg(1), now=10))
+        cache.expire(now=12)
+        self.assertEqual((len(cache), cache.evictedAged), (1, 1))
+        self.assertFalse(cache.seen(_msg(1), now=13))
+        self.assertConsistent(cache)
+
+    def test_random(self):
+        rnd = random.Random(0x6474)
+        cache = gtDedupCache(capacity=50, window=20)
+        for i in range(5000):
+            # few hashIDs and keys, so that every path is taken
+            cache.seen(_msg(rnd.randrange(40), seqNo0=rnd.randrange(80)),
+                       now=i * 0.1)
+            self.assertLessEqual(len(cache), 50)
+        self.assertConsistent(cache)
+        self.assertGreater(cache.falsePos, 0)
+
+    def test_state(self):
+        cache = gtDedupCache()
+        for i in range(5):
+            cache.seen(_msg(i % 3, seqNo0=i), now=i)
+        cache.seen(_msg(0, seqNo0=0), now=6)
+        state = json.loads(json.dumps(cache.saveState()))
+
+        resumed = gtDedupCache()
+        resumed.loadState(state)
+        self.assertEqual(resumed.stats(), cache.stats())
+        self.assertEqual(list(resumed.entries), list(cache.entries))
+        self.assertConsistent(resumed)
+        self.assertTrue(resumed.seen(_msg(1, seqNo0=4), now=7))
+
+
+if __name__ == '__main__':
+    unittest.main()
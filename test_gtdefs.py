@@ -0,0 +1,48 @@
+#!/usr/bin/python
+
+""" Tests for the gtdefs lookup tables and IntEnum types """
+
+import unittest
+
+import gtdefs
+
+# table -> (name dict, default)
+TABLES = {
+    'GT_OP_NAMES': ('GT_OP_NAME', "OP_UNKNOWN"),
+    'GT_OP_FORMATS': ('GT_OP_FORMAT', gtdefs.PDU_FMT_TLV),
+    'GT_REGION_NAMES': ('GT_REGION_NAME', "Unknown"),
+    'MSG_CLASS_NAMES': ('MSG_CLASS_NAME', "UNKNOWN"),
+    'MSG_TLV_NAMES': ('MSG_TLV_NAME', None),
+    'MSGB_TLV_NAMES': ('MSGB_TLV_NAME', None),
+}
+
+
+class defsTest(unittest.TestCase):
+
+    def test_tables(self):
+        for (table, (names, default)) in TABLES.items():
+            (table, names) = (getattr(gtdefs, table), getattr(gtdefs, names))
+            self.assertEqual(len(table), 256)
+            for i in range(256):
+                self.assertEqual(table[i], names.get(i, default))
+
+    def test_enums(self):
+        self.assertEqual(gtdefs.gtOpcode.OP_SYSINFO, gtdefs.OP_SYSINFO)
+        self.assertEqual(gtdefs.gtRegion.GT_REGION_JP, gtdefs.GT_REGION_JP)
+        self.assertEqual(gtdefs.gtMsgClass.MSG_CLASS_SHOUT,
+                         gtdefs.MSG_CLASS_SHOUT)
+        self.assertEqual(gtdefs.gtMesgTLV.MESG_TLV_DLR, gtdefs.MESG_TLV_DLR)
+        self.assertEqual(gtdefs.gtMsgbTLV(gtdefs.MSGB_TLV_NICK).name,
+                         "MSGB_TLV_NICK")
+        for (enum, names) in ((gtdefs.gtOpcode, gtdefs.GT_OP_NAME),
+                              (gtdefs.gtMsgClass, gtdefs.MSG_CLASS_NAME),
+                              (gtdefs.gtMesgTLV, gtdefs.MSG_TLV_NAME)):
+            self.assertEqual(sorted(int(v) for v in enum), sorted(names))
+        # created once, then a plain module attribute
+        self.assertIs(gtdefs.gtOpcode, gtdefs.gtOpcode)
+        with self.assertRaises(AttributeError):
+            gtdefs.gtNoSuchEnum
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+
+""" Tests for goTennaDev on a simulated device (needs bluepy): the GATT
+    handle cache and the I/O thread
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from struct import pack
+
+from gtdefs import (GT_OP_SUCCESS, OP_SYSINFO, OP_GET_GEO, API_TLV_REGION,
+                    GT_REGION_US)
+from gtsim import (gtSimDev, gtSimRadio, SIM_HND_ST, SIM_HND_TX, SIM_HND_RX,
+                   SIM_SYSINFO)
+
+try:
+    import gtdevice
+except ImportError:
+    gtdevice = None
+
+SIM_MAC = 'AA:BB:CC:DD:EE:FF'
+SIM_HANDLES = [SIM_HND_ST, SIM_HND_TX, SIM_HND_RX]
+
+
+@unittest.skipIf(gtdevice is None, "bluepy not installed")
+class handleCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cacheFile = gtdevice.handleCacheFile
+        gtdevice.handleCacheFile = os.path.join(self.dir, 'handles.json')
+
+    def tearDown(self):
+        gtdevice.handleCacheFile = self.cacheFile
+        shutil.rmtree(self.dir)
+
+    def connect(self, cached=None):
+        if cached is not None:
+            gtdevice.gtHandleCache(gtdevice.handleCacheFile).put(SIM_MAC,
+                                                                 cached)
+        dev = gtSimDev(gtSimRadio())
+        dev.mac = SIM_MAC
+        ranges = []
+        getCharacteristics = dev.getCharacteristics
+
+        def traced(startHnd=1, endHnd=0xffff, uuid=None):
+            ranges.append((startHnd, endHnd))
+            return getCharacteristics(startHnd, endHnd, uuid)
+
+        dev.getCharacteristics = traced
+        self.assertTrue(dev.initialize())
+        self.addCleanup(dev.disconnect)
+        self.assertEqual([dev.hndSt, dev.hndTx, dev.hndRx], SIM_HANDLES)
+        self.assertEqual(dev.execute(OP_SYSINFO),
+                         (GT_OP_SUCCESS, SIM_SYSINFO))
+        return dev, ranges
+
+    def cached(self):
+        return gtdevice.gtHandleCache(gtdevice.handleCacheFile).get(SIM_MAC)
+
+    def test_discover_then_cache(self):
+        (dev, ranges) = self.connect()
+        self.assertFalse(dev.startup['cached'])
+        self.assertEqual(ranges, [(1, 0xffff)])
+        self.assertEqual(self.cached(), SIM_HANDLES)
+
+        # next connection: only the cached range is listed
+        (dev, ranges) = self.connect()
+        self.assertTrue(dev.startup['cached'])
+        self.assertEqual(ranges, [(SIM_HND_ST - 1, SIM_HND_RX)])
+
+    def test_stale_cache(self):
+        # handles moved around (e.g. by a firmware update)
+        for stale in ([SIM_HND_ST, SIM_HND_RX, SIM_HND_TX],
+                      [SIM_HND_ST + 3, SIM_HND_TX + 3, SIM_HND_RX + 3],
+                      [0x0100, 0x0103, 0x0106]):
+            (dev, ranges) = self.connect(stale)
+            self.assertFalse(dev.startup['cached'])
+            self.assertEqual(ranges[-1], (1, 0xffff))
+            self.assertEqual(self.cached(), SIM_HANDLES)
+
+    def test_lookup_failure(self):
+        gtdevice.gtHandleCache(gtdevice.handleCacheFile).put(
+            SIM_MAC, SIM_HANDLES)
+        dev = gtSimDev(gtSimRadio())
+        dev.mac = SIM_MAC
+        getCharacteristics = dev.getCharacteristics
+
+        def failing(startHnd=1, endHnd=0xffff, uuid=None):
+            if (startHnd, endHnd) != (1, 0xffff):
+                raise gtdevice.BTLEException("no attributes in range")
+            return getCharacteristics(startHnd, endHnd, uuid)
+
+        dev.getCharacteristics = failing
+        self.assertTrue(dev.initialize())
+        self.assertFalse(dev.startup['cached'])
+        dev.disconnect()
+
+
+@unittest.skipIf(gtdevice is None, "bluepy not installed")
+class ioThreadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.radio = gtSimRadio()
+        self.dev = gtSimDev(self.radio)
+        self.assertTrue(self.dev.initialize())
+        self.addCleanup(self.dev.disconnect)
+        self.dev.startIO(poll=0.01)
+
+    def test_threads(self):
+        geo = (GT_OP_SUCCESS, pack('BBB', API_TLV_REGION, 1, GT_REGION_US))
+        (nThreads, n) = (8, 50)
+        errors = []
+
+        def worker(i):
+            for j in range(n):
+                (opcode, want) = ((OP_SYSINFO, (GT_OP_SUCCESS, SIM_SYSINFO))
+                                  if (i + j) % 2 else (OP_GET_GEO, geo))
+                res = self.dev.execute(opcode)
+                if res != want:
+                    errors.append((i, j, res))
+
+        threads = [threading.Thread(target=worker, args=(i, ))
+                   for i in range(nThreads)]
+        commands = self.radio.commands
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.radio.commands - commands, nThreads * n)
+
+    def test_submit(self):
+        cmds = [self.dev.submit(OP_SYSINFO) for i in range(20)]
+        for cmd in cmds:
+            self.assertEqual(cmd.wait(5), (GT_OP_SUCCESS, SIM_SYSINFO))
+            self.assertTrue(cmd.done())
+
+    def test_stop(self):
+        self.dev.stopIO()
+        self.assertIsNone(self.dev.ioThread)
+        # nothing to queue to: fails at once
+        cmd = self.dev.submit(OP_SYSINFO)
+        self.assertTrue(cmd.done())
+        self.assertIs(cmd.wait(), False)
+        # execute() goes back to running commands itself
+        self.assertEqual(self.dev.execute(OP_SYSINFO),
+                         (GT_OP_SUCCESS, SIM_SYSINFO))
+        # stopped twice, then restarted: the new thread keeps running
+        self.dev.stopIO()
+        self.assertTrue(self.dev.ioQueue.empty())
+        self.dev.startIO(poll=0.01)
+        for i in range(3):
+            self.assertEqual(self.dev.execute(OP_SYSINFO),
+                             (GT_OP_SUCCESS, SIM_SYSINFO))
+        self.assertIsNotNone(self.dev.ioThread)
+
+    def test_timeout(self):
+        timeout = gtdevice.commandTimeout
+        self.addCleanup(setattr, gtdevice, 'commandTimeout', timeout)
+        gtdevice.commandTimeout = 0.1
+        send = self.radio.send
+        self.radio.send = lambda frame: None    # responses lost
+        self.assertIs(self.dev.execute(OP_SYSINFO), False)
+        # the sequence number was released, the next command goes through
+        self.radio.send = send
+        self.assertEqual(self.dev.execute(OP_SYSINFO),
+                         (GT_OP_SUCCESS, SIM_SYSINFO))
+
+    def test_error(self):
+        waitForNotifications = self.dev.waitForNotifications
+        (failing, release) = (threading.Event(), threading.Event())
+
+        def failed(timeout):
+            failing.set()
+            release.wait(5)
+            raise gtdevice.BTLEException("link lost")
+
+        self.dev.waitForNotifications = failed
+        self.assertTrue(failing.wait(5))
+        # queued behind the failure: all failed when the thread exits
+        cmds = [self.dev.submit(OP_SYSINFO) for i in range(3)]
+        release.set()
+        for cmd in cmds:
+            self.assertIs(cmd.wait(5), False)
+        self.assertIsInstance(self.dev.ioError, gtdevice.BTLEException)
+        self.assertIs(self.dev.execute(OP_SYSINFO), False)
+
+        # stopping the failed thread leaves nothing behind for the next
+        self.dev.stopIO()
+        self.assertTrue(self.dev.ioQueue.empty())
+
+        # until restarted
+        self.dev.waitForNotifications = waitForNotifications
+        self.dev.startIO(poll=0.01)
+        self.assertIsNone(self.dev.ioError)
+        self.assertEqual(self.dev.execute(OP_SYSINFO),
+                         (GT_OP_SUCCESS, SIM_SYSINFO))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+""" Tests for the BLE framing (gtframe), and the zero-copy receive path:
+    frame decoder views, buffer reuse, and message parsing in place
+"""
+
+import random
+import unittest
+
+from gtframe import (gtFrameDecoder, gtBtReAsm, gtEncodeFrame, gtFragments,
+                     GT_BLE_FRAGMENT, GT_MAX_PDU)
+from gtapiobj import gtMakeAPIMsg, gtReadAPIMsg
+from pyTLV import tlvOffsets, tlvPack
+from gtdefs import MSG_CLASS_P2P, MSG_CLASS_SHOUT
+
+
+def _chunks(rnd, data):
+    """ data, cut at random boundaries """
+    pos = 0
+    while pos < len(data):
+        step = rnd.randint(1, 25)
+        yield data[pos:pos+step]
+        pos += step
+
+
+class frameTest(unittest.TestCase):
+
+    def test_encode(self):
+        frame = gtEncodeFrame(0x10, 0x10, b'\x10\x02')
+        self.assertEqual(frame[:9], b'\x10\x02\x10\x10\x10\x10\x10\x10\x02')
+        self.assertEqual(frame[-2:], b'\x10\x03')
+        # no DLE left in the body once the doubled ones are removed
+        self.assertNotIn(b'\x10', frame[2:-2].replace(b'\x10\x10', b''))
+        self.assertEqual(gtEncodeFrame(0x104, 0x101), gtEncodeFrame(4, 1))
+
+        dec = gtFrameDecoder()
+        self.assertEqual([bytes(pdu) for pdu in dec.feed(frame)],
+                         [b'\x10\x10\x10\x02'])
+
+    def test_fragments(self):
+        frame = gtEncodeFrame(0x03, 1, bytes(range(50)))
+        frags = gtFragments(frame)
+        self.assertEqual([len(f) for f in frags[:-1]],
+                         [GT_BLE_FRAGMENT] * (len(frags) - 1))
+        self.assertEqual(b''.join(frags), frame)
+        self.assertEqual(gtFragments(b''), [])
+
+    def test_errors(self):
+        good = gtEncodeFrame(0x03, 1, b'payload')
+        bad = good[:5] + b'X' + good[6:]
+        crcErrors = []
+        dec = gtFrameDecoder()
+        dec.trace.subscribe('on_crc_error', lambda want, have, buf:
+                            crcErrors.append(bytes(buf)))
+        stream = (bad + b'\x10\x02\x01\x10\x03' +       # CRC error, runt
+                  good[:8] + good +                     # lost sync
+                  b'\x10\x02' + b'a' * (GT_MAX_PDU + 1) + good)  # overrun
+        pdus = [bytes(pdu) for pdu in dec.feed(stream)]
+        self.assertEqual(pdus, [b'\x03\x01payload'] * 2)
+        self.assertEqual(crcErrors, [b'\x03\x01pXyload'])
+        self.assertEqual((dec.pdus, dec.crcErrors, dec.runts, dec.lostSync,
+                          dec.overruns), (2, 1, 1, 1, 1))
+
+    def test_reassembler(self):
+        got = []
+        frag = gtBtReAsm()
+        frag.packetHandler = lambda pdu: got.append(bytes(pdu))
+        frame = gtEncodeFrame(0x03, 1, b'\x10' * 30)
+        for f in gtFragments(frame):
+            self.assertIsNot(frag.receiveFrame(f), False)
+        self.assertIs(frag.receiveFrame(frame[:-3] + b'\x00\x10\x03'), False)
+        self.assertEqual(got, [b'\x03\x01' + b'\x10' * 30])
+
+
+class decoderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rnd = random.Random(0x6774)
+        # payloads full of DLE, STX and ETX bytes, to exercise escaping
+        self.pdus = [bytes([op, seq]) +
+                     bytes(self.rnd.choice((0x10, 0x02, 0x03, 0x55))
+                           for i in range(self.rnd.randint(0, 120)))
+                     for (op, seq) in zip(range(40), range(100, 140))]
+        self.stream = b''.join(gtEncodeFrame(p[0], p[1], p[2:])
+                               for p in self.pdus)
+
+    def test_chunking(self):
+        dec = gtFrameDecoder()
+        got = []
+        for chunk in _chunks(self.rnd, self.stream):
+            for pdu in dec.feed(chunk):
+                self.assertIsInstance(pdu, memoryview)
+                got.append(bytes(pdu))
+        self.assertEqual(got, self.pdus)
+        self.assertEqual(dec.pdus, len(self.pdus))
+
+    def test_reuse(self):
+        dec = gtFrameDecoder()
+        bufs = set()
+        for chunk in _chunks(self.rnd, self.stream):
+            for pdu in dec.feed(chunk):
+                bufs.add(id(dec.buf))
+                del pdu
+        self.assertEqual(len(bufs), 1)
+
+    def test_held(self):
+        dec = gtFrameDecoder()
+        held = []
+        for chunk in _chunks(self.rnd, self.stream):
+            held.extend(dec.feed(chunk))
+        self.assertEqual([bytes(pdu) for pdu in held], self.pdus)
+
+
+class readMsgTest(unittest.TestCase):
+
+    def test_view(self):
+        for (msgClass, dest) in ((MSG_CLASS_SHOUT, 0),
+                                 (MSG_CLASS_P2P, 0x123456789a)):
+            msgPDU = gtMakeAPIMsg(b'hello world', msgClass, 0x3fff,
+                                  0x1122334455, dest)
+            msg = gtReadAPIMsg(memoryview(bytearray(msgPDU)))
+            self.assertEqual(msg, gtReadAPIMsg(msgPDU))
+            self.assertIs(type(msg['msgBlob']), bytes)
+        self.assertIs(gtReadAPIMsg(memoryview(msgPDU)[:-5]), False)
+
+    def test_offsets(self):
+        data = tlvPack(1, b'abc') + tlvPack(2, b'') + tlvPack(3, b'x' * 200)
+        self.assertEqual(list(tlvOffsets(data)),
+                         [(1, 2, 3), (2, 7, 0), (3, 9, 200)])
+        with self.assertRaises(ValueError):
+            list(tlvOffsets(data[:-1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/python
+
+""" Short fuzzing runs over every parser target (see gtfuzz.py for
+    longer ones), and the per-byte time budget
+"""
+
+import unittest
+
+import gtfuzz
+
+ITERATIONS = 500
+
+
+class fuzzTest(unittest.TestCase):
+
+    def test_targets(self):
+        for target in sorted(gtfuzz.FUZZ_TARGETS):
+            res = gtfuzz.gtFuzz(target, ITERATIONS, seed=0x6007)
+            self.assertEqual(res['failures'][:1], [], target)
+            self.assertGreater(res['lines'], 0, target)
+
+    def test_violations_detected(self):
+        gtfuzz.FUZZ_TARGETS['broken'] = (lambda data: data[3], ())
+        try:
+            res = gtfuzz.gtFuzz('broken', 50, seeds=[b'abcd'])
+        finally:
+            del gtfuzz.FUZZ_TARGETS['broken']
+        self.assertTrue(res['failures'])
+        self.assertIn('IndexError', res['failures'][0][1])
+
+    def test_linear_time(self):
+        for name, (small, large, growth) in gtfuzz.gtScaling(4096).items():
+            self.assertLess(growth, gtfuzz.FUZZ_SCALING_BUDGET, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
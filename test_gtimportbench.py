@@ -0,0 +1,33 @@
+#!/usr/bin/python
+
+""" Tests for deferred loading of the heavy backends, via gtimportbench:
+    modules which don't need bluepy or cryptography must not import them
+"""
+
+import unittest
+
+from gtimportbench import importTime, ENTRY_POINTS
+
+# Entry points which need a backend at import time
+NEEDS_BACKEND = {'gtdevice': {'bluepy'}}
+
+
+class importTest(unittest.TestCase):
+
+    def test_no_heavy_backends(self):
+        for module in ENTRY_POINTS:
+            (total, heavy) = importTime(module)
+            if total is None and module in NEEDS_BACKEND:
+                continue    # backend not installed
+            self.assertIsNotNone(total, "%s: %s" % (module, heavy))
+            self.assertEqual(heavy, NEEDS_BACKEND.get(module, set()),
+                             module)
+
+    def test_failure(self):
+        (total, error) = importTime('gt_no_such_module')
+        self.assertIsNone(total)
+        self.assertIn('gt_no_such_module', error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+
+""" Tests for the TAK archive key search (needs cryptography) """
+
+import os
+import random
+import unittest
+
+try:
+    from compatTAK import _aes
+    _aes()
+except ImportError:
+    _aes = None
+
+from compatTAK import gtMakeTAKBlobMsg, gtMakeTAKBlobPLI
+
+
+def corpus(keys, n, seed=1):
+    rnd = random.Random(seed)
+    names = sorted(keys)
+    (blobs, want) = ([], {})
+    for i in range(n):
+        name = rnd.choice(names)
+        key = keys[name]
+        if i % 3 == 0:
+            blob = gtMakeTAKBlobMsg(b'CS%d' % i, u'caf\xe9 at %d'.encode(
+                'utf8') % i, key)
+        elif i % 3 == 1:
+            blob = gtMakeTAKBlobPLI(b'ANDROID-%d' % i, b'a-f-G-U-C', b'CS',
+                                    b'm-g', 51.9, 4.0, 1.0, b'Cyan', 60,
+                                    aesKey=key)
+        else:
+            blob = gtMakeTAKBlobPLI(b'ANDROID-%d' % i, b'a-f-G-U-C', b'CS',
+                                    b'm-g', 51.9, 4.0, 1.0, b'Cyan', 60,
+                                    aesKey=key, compact=True, compress=True)
+        blobs.append(blob)
+        want[i] = name
+    return (blobs, want)
+
+
+@unittest.skipIf(_aes is None, "cryptography not installed")
+class keySearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.keys = dict(('key%d' % i, os.urandom(16)) for i in range(40))
+
+    def test_mapping(self):
+        from gtkeysearch import gtKeySearch
+        (blobs, want) = corpus(self.keys, 300)
+        # not encrypted, unknown key, garbage
+        blobs.append(gtMakeTAKBlobMsg(b'CS', b'in the clear'))
+        blobs.append(gtMakeTAKBlobMsg(b'CS', b'lost', os.urandom(16)))
+        blobs.append(os.urandom(64))
+        (mapping, stats) = gtKeySearch(blobs, self.keys)
+        self.assertEqual(mapping, want)
+        self.assertEqual((stats['blobs'], stats['encrypted'],
+                          stats['matched']), (303, 301, 300))
+        self.assertLess(stats['candidates'], 2 * 300)
+
+    def test_pool_and_keyring(self):
+        from compatGTA import gtKeyring
+        from gtkeysearch import gtKeySearch
+        ring = gtKeyring()
+        for (name, key) in self.keys.items():
+            ring.add(name, key)
+        (blobs, want) = corpus(self.keys, 60, seed=2)
+        (mapping, stats) = gtKeySearch(blobs, ring, processes=2, chunk=8)
+        self.assertEqual(mapping, want)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+
+""" Tests for the btsnoop session recorder (gtrecord), read back with
+    gtsnoop; recording a simulated device needs bluepy
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gtrecord import (gtRecorder, BTSNOOP_FLAG_SENT, BTSNOOP_FLAG_RCVD,
+                      ATT_OP_WRITE_CMD, ATT_OP_NOTIFY, ATT_OP_INDICATE)
+from gtsnoop import btSnoopFrames
+from gtdefs import GT_OP_SUCCESS, OP_SYSINFO
+from gtframe import gtFrameDecoder
+
+try:
+    import gtdevice  # noqa: F401
+    from gtsim import gtSimDev, gtSimRadio, SIM_SYSINFO
+except ImportError:
+    gtSimDev = None
+
+ATT_OPS = (ATT_OP_WRITE_CMD, ATT_OP_NOTIFY, ATT_OP_INDICATE)
+
+
+class recorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log = os.path.join(self.dir, 'session.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def readBack(self, filename=None):
+        with open(filename or self.log, 'rb') as f:
+            return list(btSnoopFrames(f, ATT_OPS))
+
+    def test_roundtrip(self):
+        rec = gtRecorder(self.log, flushEvery=60).start()
+        rec.record(BTSNOOP_FLAG_SENT, ATT_OP_WRITE_CMD, 0x25, b'\x10\x02ab')
+        rec.record(BTSNOOP_FLAG_RCVD, ATT_OP_INDICATE, 0x28,
+                   bytearray(b'cd'))
+        rec.record(BTSNOOP_FLAG_RCVD, ATT_OP_NOTIFY, 0x22, b'\x01')
+        rec.stop()
+        frames = self.readBack()
+        self.assertEqual([f[:1] + f[2:] for f in frames], [
+            (BTSNOOP_FLAG_SENT, ATT_OP_WRITE_CMD, 0x25, b'\x10\x02ab'),
+            (BTSNOOP_FLAG_RCVD, ATT_OP_INDICATE, 0x28, b'cd'),
+            (BTSNOOP_FLAG_RCVD, ATT_OP_NOTIFY, 0x22, b'\x01')])
+        times = [f[1] for f in frames]
+        self.assertEqual(times, sorted(times))
+        self.assertEqual((rec.written, rec.dropped), (3, 0))
+
+    def test_ring_overflow(self):
+        # not started: nothing is flushed, the ring keeps the newest
+        rec = gtRecorder(self.log, maxRecords=4)
+        for i in range(10):
+            rec.record(BTSNOOP_FLAG_SENT, ATT_OP_WRITE_CMD, 0x25, bytes([i]))
+        self.assertEqual(rec.dropped, 6)
+        rec.start()
+        rec.stop()
+        self.assertEqual([f[4] for f in self.readBack()],
+                         [bytes([i]) for i in range(6, 10)])
+
+    def test_rotation(self):
+        rec = gtRecorder(self.log, flushEvery=60, maxBytes=200,
+                         backupCount=2).start()
+        for i in range(20):
+            rec.record(BTSNOOP_FLAG_SENT, ATT_OP_WRITE_CMD, 0x25,
+                       bytes([i]) * 20)
+        rec.stop()
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['session.log', 'session.log.1', 'session.log.2'])
+        for name in os.listdir(self.dir):
+            self.assertLessEqual(
+                os.path.getsize(os.path.join(self.dir, name)), 200)
+        # newest records in the current file, older ones in .1 then .2
+        values = [f[4][0] for name in ('session.log.2', 'session.log.1',
+                                       'session.log')
+                  for f in self.readBack(os.path.join(self.dir, name))]
+        self.assertEqual(values, list(range(20 - len(values), 20)))
+
+    def test_stop_flush_failure(self):
+        # opened without the flusher thread, so stop() does the flush
+        rec = gtRecorder(self.log, maxBytes=100)
+        rec._open()
+        f = rec.f
+
+        def diskFull(recLen):
+            raise OSError(28, "No space left on device")
+
+        rec._dueRollover = diskFull
+        rec.record(BTSNOOP_FLAG_SENT, ATT_OP_WRITE_CMD, 0x25, b'x')
+        with self.assertRaises(OSError):
+            rec.stop()
+        # closed all the same
+        self.assertTrue(f.closed)
+        self.assertIsNone(rec.f)
+
+    @unittest.skipIf(gtSimDev is None, "bluepy not installed")
+    def test_device_session(self):
+        dev = gtSimDev(gtSimRadio())
+        dev.initialize()
+        rec = gtRecorder(self.log).start()
+        rec.attach(dev)
+        self.assertEqual(dev.execute(OP_SYSINFO),
+                         (GT_OP_SUCCESS, SIM_SYSINFO))
+        rec.detach(dev)
+        dev.execute(OP_SYSINFO)     # not recorded
+        dev.disconnect()
+        rec.stop()
+
+        # the capture holds the command and its response, decodable
+        pdus = {}
+        decoders = {BTSNOOP_FLAG_SENT: gtFrameDecoder(),
+                    BTSNOOP_FLAG_RCVD: gtFrameDecoder()}
+        for (flags, time64, attOp, hnd, value) in self.readBack():
+            for pdu in decoders[flags].feed(value):
+                pdus.setdefault(flags, []).append(bytes(pdu))
+        self.assertEqual(len(pdus[BTSNOOP_FLAG_SENT]), 1)
+        self.assertEqual(pdus[BTSNOOP_FLAG_SENT][0][0], OP_SYSINFO)
+        self.assertEqual(len(pdus[BTSNOOP_FLAG_RCVD]), 1)
+        self.assertEqual(pdus[BTSNOOP_FLAG_RCVD][0][2:], SIM_SYSINFO)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+""" Tests for the capture replay driver (gtreplay, needs bluepy) """
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from gtapiobj import gtMakeAPIMsg
+from gtdefs import GT_OP_SUCCESS, OP_READMSG, OP_SYSINFO, MSG_CLASS_SHOUT
+from gtframe import gtEncodeFrame, gtFragments
+from gtrecord import btSnoopHeader, btSnoopRecord
+
+try:
+    import gtdevice
+    import gtreplay
+except ImportError:
+    gtdevice = None
+
+ATT_OP_WRITE_CMD = 0x52
+ATT_OP_INDICATE = 0x1d
+HND_RX = 0x28
+
+
+def _responses(count):
+    """ Device to host fragments of count responses, half of them
+        OP_READMSG results carrying a message """
+    msgPDU = gtMakeAPIMsg(b'replayed', MSG_CLASS_SHOUT, 0x3fff, 0x1234)
+    frames = []
+    t = 1000000
+    for i in range(count):
+        if i % 2:
+            frame = gtEncodeFrame(GT_OP_SUCCESS | OP_SYSINFO, i + 1, bytes(32))
+        else:
+            frame = gtEncodeFrame(GT_OP_SUCCESS | OP_READMSG, i + 1, msgPDU)
+        for frag in gtFragments(frame):
+            t += 1000
+            frames.append((t, ATT_OP_INDICATE, HND_RX, bytes(frag)))
+    return frames
+
+
+class fakeClock():
+    """ process_time() stand-in, one tick per call """
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        self.now += 1.
+        return self.now
+
+
+@unittest.skipIf(gtdevice is None, "bluepy not installed")
+class replayTest(unittest.TestCase):
+
+    def test_counts(self):
+        frames = _responses(20)
+        rep = gtreplay.gtReplay(gtdevice.goTennaDev(None), frames).run()
+        self.assertEqual((rep['fragments'], rep['pdus'], rep['msgs']),
+                         (len(frames), 20, 10))
+        for stage in gtreplay.REPLAY_STAGES:
+            self.assertGreaterEqual(rep['cpu_' + stage], 0)
+
+    def test_repeated_runs(self):
+        with mock.patch('gtreplay.time.process_time', fakeClock()):
+            replay = gtreplay.gtReplay(gtdevice.goTennaDev(None),
+                                       _responses(10))
+            first = replay.run()
+            # report() doesn't change the totals
+            self.assertEqual(replay.report(), first)
+            second = replay.run(loops=2)
+            third = replay.run()
+        for key in ('fragments', 'pdus', 'msgs', 'cpu_reasm', 'cpu_packet',
+                    'cpu_decode'):
+            self.assertEqual(second[key], 3 * first[key])
+            self.assertEqual(third[key], 4 * first[key])
+        self.assertGreater(first['cpu_reasm'], 0)
+
+    def test_load_capture(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp, 'capture.log')
+            frames = _responses(4)
+            with open(filename, 'wb') as f:
+                f.write(btSnoopHeader())
+                # host to device writes are left out
+                f.write(btSnoopRecord(0, 999, ATT_OP_WRITE_CMD, 0x25,
+                                      gtEncodeFrame(OP_SYSINFO, 1)))
+                for (t, attOp, hnd, value) in frames:
+                    f.write(btSnoopRecord(1, t, attOp, hnd, value))
+            self.assertEqual(gtreplay.loadCapture(filename), frames)
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    unittest.main()
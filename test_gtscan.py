@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+""" Tests for gtscan, with a fake scanner and fake devices """
+
+import threading
+import time
+import unittest
+
+from gtdefs import GT_UUID_ST, GT_UUID_RX
+from gtscan import gtAdvert, gtRankAdverts, gtScanManager, scanBackend
+
+OTHER_UUID = "0000180f-0000-1000-8000-00805f9b34fb"
+
+
+class fakeScanner(scanBackend):
+    def __init__(self, adverts):
+        self.adverts = adverts
+
+    def scan(self, timeout):
+        return list(self.adverts)
+
+
+class fakeDev():
+    """ Connects after delay seconds; initialize() returns ok """
+    behaviour = {}
+    disconnected = []
+
+    def __init__(self, addr):
+        (delay, ok) = self.behaviour.get(addr, (0, True))
+        if ok is None:
+            raise IOError("connect failed")
+        time.sleep(delay)
+        self.mac = addr
+        self.ok = ok
+
+    def initialize(self):
+        return self.ok
+
+    def disconnect(self):
+        fakeDev.disconnected.append(self.mac)
+
+
+ADVERTS = [
+    gtAdvert('aa:00:00:00:00:01', -80, (GT_UUID_ST, ), 'far'),
+    gtAdvert('aa:00:00:00:00:02', -40, (GT_UUID_RX, ), 'near'),
+    gtAdvert('aa:00:00:00:00:03', -60, (OTHER_UUID, ), 'not a goTenna'),
+    gtAdvert('AA:00:00:00:00:01', -50, (GT_UUID_ST, ), 'far, closer'),
+    gtAdvert('aa:00:00:00:00:04', -95, (GT_UUID_ST, ), 'weak'),
+]
+
+
+class scanTest(unittest.TestCase):
+
+    def setUp(self):
+        fakeDev.behaviour = {}
+        fakeDev.disconnected = []
+        self.mgr = gtScanManager(fakeScanner(ADVERTS), fakeDev)
+
+    def test_rank(self):
+        ranked = gtRankAdverts(ADVERTS)
+        self.assertEqual([a.rssi for a in ranked], [-40, -50, -95])
+        self.assertEqual(len(gtRankAdverts(ADVERTS, minRSSI=-90)), 2)
+
+    def test_backend(self):
+        # backends must implement scan()
+        class noScan(scanBackend):
+            pass
+        with self.assertRaises(TypeError):
+            noScan()
+
+    def test_connect_parallel(self):
+        for adv in ADVERTS:
+            fakeDev.behaviour[adv.addr] = (0.2, True)
+        t0 = time.monotonic()
+        devices = self.mgr.scanAndConnect(maxParallel=4)
+        self.assertLess(time.monotonic() - t0, 0.4)
+        self.assertEqual([d.mac for d in devices],
+                         ['aa:00:00:00:00:02', 'AA:00:00:00:00:01',
+                          'aa:00:00:00:00:04'])
+
+    def test_failures_and_timeouts(self):
+        fakeDev.behaviour = {
+            'aa:00:00:00:00:02': (0, None),     # connect raises
+            'AA:00:00:00:00:01': (0.5, True),   # too slow
+            'aa:00:00:00:00:04': (0, False),    # initialize fails
+        }
+        adverts = self.mgr.discover()
+        (devices, failures) = self.mgr.connect(adverts, timeout=0.2)
+        self.assertEqual(devices, [])
+        self.assertIsInstance(failures['aa:00:00:00:00:02'], IOError)
+        self.assertEqual(failures['AA:00:00:00:00:01'], 'timeout')
+        self.assertEqual(failures['aa:00:00:00:00:04'], 'initialize failed')
+        # the abandoned connection is cleaned up once it completes
+        time.sleep(0.5)
+        self.assertIn('AA:00:00:00:00:01', fakeDev.disconnected)
+
+    def test_max_parallel(self):
+        active = [0, 0]
+        lock = threading.Lock()
+
+        class countingDev(fakeDev):
+            def __init__(self, addr):
+                with lock:
+                    active[0] += 1
+                    active[1] = max(active[1], active[0])
+                time.sleep(0.05)
+                fakeDev.__init__(self, addr)
+                with lock:
+                    active[0] -= 1
+
+        adverts = [gtAdvert('aa:00:00:00:01:%02x' % i, -50, (GT_UUID_ST, ),
+                            None) for i in range(10)]
+        mgr = gtScanManager(fakeScanner(adverts), countingDev)
+        self.assertEqual(len(mgr.scanAndConnect(maxParallel=3)), 10)
+        self.assertEqual(active[1], 3)
+
+        # connections which time out still hold their slot until they end
+        (active[0], active[1]) = (0, 0)
+        for adv in adverts[:6]:
+            fakeDev.behaviour[adv.addr] = (0.2, True)
+        (devices, failures) = mgr.connect(adverts[:6], timeout=0.05,
+                                          maxParallel=2)
+        self.assertEqual(len(failures), 6)
+        self.assertEqual(active[1], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+""" Tests for segmentation and reassembly (gtsegment) """
+
+import os
+import random
+import unittest
+
+from gtsegment import (gtSegment, gtReadSegment, gtReassembler, segCodecs,
+                       segCompress, segDecompress, SEG_MAX_BLOB,
+                       SEG_CODEC_NONE, SEG_CODEC_ZLIB, SEG_CODEC_LZ4)
+
+
+class segmentTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        payload = b'<event uid="x"/>' * 200
+        for codec in segCodecs() + [None]:
+            (xferID, blobs) = gtSegment(payload, codec=codec)
+            for blob in blobs:
+                self.assertLessEqual(len(blob), SEG_MAX_BLOB)
+                self.assertEqual(gtReadSegment(blob)[0], xferID)
+            reasm = gtReassembler()
+            got = [reasm.feed(blob, 0x99, now=0) for blob in blobs]
+            self.assertEqual(got[-1], payload)
+            self.assertEqual(got[:-1], [None] * (len(blobs) - 1))
+
+    def test_out_of_order(self):
+        payload = os.urandom(2000)
+        (xferID, blobs) = gtSegment(payload, codec=SEG_CODEC_NONE)
+        blobs = blobs + blobs[:3]
+        random.Random(1).shuffle(blobs)
+        while gtReadSegment(blobs[-1])[1] in range(3):
+            blobs.append(blobs.pop(0))
+        reasm = gtReassembler()
+        got = [p for p in (reasm.feed(b, 1, now=0) for b in blobs) if p]
+        self.assertEqual(got, [payload])
+        self.assertEqual(reasm.stats()['duplicates'], 3)
+        self.assertEqual(reasm.stats()['buffered'], 0)
+        # late duplicates of a completed transfer
+        self.assertIsNone(reasm.feed(blobs[0], 1, now=1))
+        self.assertEqual(reasm.stats()['duplicates'], 4)
+
+    def test_senders(self):
+        # same xferID from two senders: separate transfers
+        (a, b) = (os.urandom(500), os.urandom(500))
+        blobsA = gtSegment(a, codec=SEG_CODEC_NONE, xferID=7)[1]
+        blobsB = gtSegment(b, codec=SEG_CODEC_NONE, xferID=7)[1]
+        reasm = gtReassembler()
+        got = {}
+        for (blobA, blobB) in zip(blobsA, blobsB):
+            got[1] = reasm.feed(blobA, 1, now=0) or got.get(1)
+            got[2] = reasm.feed(blobB, 2, now=0) or got.get(2)
+        self.assertEqual(got, {1: a, 2: b})
+
+    def test_eviction(self):
+        reasm = gtReassembler(maxBytes=1000)
+        old = gtSegment(os.urandom(900), codec=SEG_CODEC_NONE)[1]
+        new = gtSegment(os.urandom(900), codec=SEG_CODEC_NONE)[1]
+        for blob in old[:-1]:
+            reasm.feed(blob, 1, now=0)
+        # room is made by dropping the oldest transfer
+        got = None
+        for blob in new:
+            got = reasm.feed(blob, 2, now=1) or got
+            self.assertLessEqual(reasm.buffered, 1000)
+        self.assertEqual(len(got), 900)
+        self.assertEqual(reasm.stats()['evicted'], 1)
+        self.assertIsNone(reasm.feed(old[-1], 1, now=2))
+        self.assertEqual(list(reasm.pending().values()), [(1, len(old))])
+
+    def test_timeout(self):
+        reasm = gtReassembler(timeout=10)
+        blobs = gtSegment(os.urandom(500), codec=SEG_CODEC_NONE)[1]
+        reasm.feed(blobs[0], 1, now=0)
+        reasm.feed(blobs[1], 1, now=5)
+        reasm.expire(now=14)
+        self.assertEqual(len(reasm.pending()), 1)
+        reasm.expire(now=15)
+        self.assertEqual(reasm.stats()['pending'], 0)
+        self.assertEqual(reasm.stats()['expired'], 1)
+        self.assertEqual(reasm.buffered, 0)
+        # the rest arrives too late to complete the transfer
+        for blob in blobs[2:]:
+            self.assertIsNone(reasm.feed(blob, 1, now=16))
+
+    def test_invalid(self):
+        reasm = gtReassembler()
+        blob = gtSegment(b'abc', codec=SEG_CODEC_NONE)[1][0]
+        for bad in (b'', b'\xe0\x07', blob[:-1] + b'\x00', blob[1:]):
+            self.assertIsNone(gtReadSegment(bad))
+            self.assertIsNone(reasm.feed(bad))
+        self.assertEqual(reasm.stats()['invalid'], 4)
+
+
+class limitTest(unittest.TestCase):
+
+    def check(self, codec):
+        payload = bytes(100000)
+        data = segCompress(payload, codec)
+        self.assertEqual(segDecompress(data, codec, len(payload)), payload)
+        self.assertEqual(segDecompress(data, codec), payload)
+        with self.assertRaises(ValueError):
+            segDecompress(data, codec, len(payload) - 1)
+        with self.assertRaises(ValueError):
+            segDecompress(data[:len(data) // 2], codec)
+
+        # a compression bomb is dropped by the reassembler
+        reasm = gtReassembler(maxPayload=1000)
+        for blob in gtSegment(payload, codec=codec)[1]:
+            self.assertIsNone(reasm.feed(blob, now=0))
+        self.assertEqual(reasm.stats()['invalid'], 1)
+
+    def test_zlib(self):
+        self.check(SEG_CODEC_ZLIB)
+
+    @unittest.skipIf(SEG_CODEC_LZ4 not in segCodecs(), "lz4 not installed")
+    def test_lz4(self):
+        self.check(SEG_CODEC_LZ4)
+
+    def test_codec(self):
+        with self.assertRaises(ValueError):
+            segDecompress(b'x', 9)
+        self.assertEqual(segDecompress(b'x', SEG_CODEC_NONE, 1), b'x')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+""" Tests for the sequence number allocator (gtseq), standalone and
+    under stress on a simulated device (the latter needs bluepy)
+"""
+
+import random
+import threading
+import unittest
+from collections import OrderedDict
+from struct import pack
+
+from gtseq import gtSeqAllocator
+from gtdefs import GT_OP_SUCCESS
+
+try:
+    import gtdevice
+    from gtsim import gtSimDev, gtSimRadio, SIM_OP_FAILED
+except ImportError:
+    gtdevice = None
+
+OP_ECHO = 0x29          # handled by echoRadio below
+
+
+def response(opcode, seq, data=b''):
+    return pack('BB', GT_OP_SUCCESS | opcode, seq) + data
+
+
+class allocatorTest(unittest.TestCase):
+
+    def test_skips_reserved_and_wraps(self):
+        seqs = gtSeqAllocator()
+        got = []
+        for i in range(600):
+            seq = seqs.allocate(0x04, now=0)
+            got.append(seq)
+            seqs.post(seq, response(0x04, seq))
+            seqs.take(seq)
+        self.assertNotIn(0x10, got)
+        self.assertEqual(got[:3], [1, 2, 3])
+        self.assertEqual(len(set(got[:255])), 255)
+
+    def test_exhaustion(self):
+        seqs = gtSeqAllocator()
+        for i in range(255):
+            self.assertIsNotNone(seqs.allocate(0x04, now=0))
+        self.assertIsNone(seqs.allocate(0x04, now=0))
+        # all in flight expire after the timeout, into quarantine
+        self.assertIsNone(seqs.allocate(0x04, now=100))
+        self.assertIsNotNone(seqs.allocate(0x04, now=105))
+
+    def test_orphans_and_mismatches(self):
+        seqs = gtSeqAllocator()
+        seq = seqs.allocate(0x04, now=0)
+        self.assertFalse(seqs.post(seq + 1, response(0x04, seq + 1)))
+        self.assertFalse(seqs.post(seq, response(0x06, seq)))
+        self.assertFalse(seqs.ready(seq))
+        self.assertTrue(seqs.post(seq, response(0x04, seq, b'1')))
+        self.assertFalse(seqs.post(seq, response(0x04, seq, b'2')))
+        self.assertEqual(seqs.take(seq), response(0x04, seq, b'1'))
+        self.assertEqual((seqs.orphans, seqs.mismatched, seqs.duplicates),
+                         (1, 1, 1))
+
+    def test_late_response_after_wrap(self):
+        seqs = gtSeqAllocator(timeout=5, quarantine=60)
+        old = seqs.allocate(0x04, now=0)
+        seqs.release(old, now=5)
+        # a full wrap later, the abandoned number is still quarantined
+        for i in range(300):
+            seq = seqs.allocate(0x04, now=10)
+            self.assertNotEqual(seq, old)
+            seqs.post(seq, response(0x04, seq))
+            seqs.take(seq)
+        self.assertFalse(seqs.post(old, response(0x04, old)))
+        self.assertEqual(seqs.late, 1)
+        # and reused once the quarantine is over
+        self.assertIn(old, [seqs.allocate(0x04, now=70) for i in range(255)])
+
+    def test_bounded(self):
+        seqs = gtSeqAllocator(timeout=1, quarantine=1)
+        rnd = random.Random(1)
+        now = 0
+        for i in range(20000):
+            now += rnd.random() * 0.01
+            seq = seqs.allocate(0x04, now)
+            if seq is not None and rnd.random() < 0.5:
+                seqs.post(seq, response(0x04, seq))
+                seqs.take(seq)
+            seqs.post(rnd.randrange(256), response(0x04, 0))
+        self.assertLessEqual(len(seqs.inflight) + len(seqs.stale), 256)
+
+
+if gtdevice is not None:
+    class echoRadio(gtSimRadio):
+        """
+        Echoes OP_ECHO data back, holding back every holdEvery-th
+          response until its sequence number comes round again (the
+          worst case after a wrap), or at most lateAfter commands
+        """
+        def __init__(self, holdEvery=7, lateAfter=300):
+            gtSimRadio.__init__(self)
+            self.holdEvery = holdEvery
+            self.lateAfter = lateAfter
+            self.held = OrderedDict()   # seq -> (commands, frame)
+
+        def execute(self, opcode, data):
+            if opcode == OP_ECHO:
+                return GT_OP_SUCCESS, data
+            return SIM_OP_FAILED, b''
+
+        def send(self, frame):
+            # DLE STX opcode seq ... (neither is ever an escaped DLE)
+            seq = frame[3]
+            if seq in self.held:
+                gtSimRadio.send(self, self.held.pop(seq)[1])
+            while self.held:
+                (seqHeld, (since, late)) = next(iter(self.held.items()))
+                if self.commands - since < self.lateAfter:
+                    break
+                gtSimRadio.send(self, self.held.pop(seqHeld)[1])
+            if self.commands % self.holdEvery == 0:
+                self.held[seq] = (self.commands, frame)
+                return
+            gtSimRadio.send(self, frame)
+
+
+@unittest.skipIf(gtdevice is None, "bluepy not installed")
+class simulatedStressTest(unittest.TestCase):
+
+    def setUp(self):
+        self.timeout = gtdevice.commandTimeout
+        gtdevice.commandTimeout = 0.05
+
+    def tearDown(self):
+        gtdevice.commandTimeout = self.timeout
+
+    def stress(self, dev, n, threads=1):
+        wrong = []
+
+        def worker(t):
+            for i in range(n):
+                data = pack('!HH', t, i)
+                res = dev.execute(OP_ECHO, data)
+                if res and res != (GT_OP_SUCCESS, data):
+                    wrong.append(res)
+
+        workers = [threading.Thread(target=worker, args=(t, ))
+                   for t in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        return wrong
+
+    def test_late_responses_direct(self):
+        radio = echoRadio()
+        dev = gtSimDev(radio)
+        dev.initialize()
+        dev.seqs.quarantine = 60
+        self.assertEqual(self.stress(dev, 700), [])
+        self.assertGreater(dev.seqs.late, 40)
+        self.assertLessEqual(len(dev.seqs.inflight), 1)
+
+    def test_late_responses_threaded(self):
+        radio = echoRadio()
+        dev = gtSimDev(radio)
+        dev.initialize()
+        dev.seqs.quarantine = 60
+        dev.startIO()
+        try:
+            self.assertEqual(self.stress(dev, 100, threads=8), [])
+        finally:
+            dev.disconnect()
+        self.assertGreater(dev.seqs.late, 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
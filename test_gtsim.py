@@ -0,0 +1,101 @@
+#!/usr/bin/python
+
+""" Tests for the simulated device (gtsim): the radio model on its own,
+    and a goTennaDev driving it (the latter needs bluepy)
+"""
+
+import unittest
+from struct import pack
+
+from gtsim import (gtSimRadio, SIM_HND_ST, SIM_HND_TX, SIM_HND_RX,
+                   SIM_OP_FAILED, SIM_SYSINFO)
+from gtframe import gtEncodeFrame, gtFrameDecoder, gtFragments
+from gtapiobj import gtMakeAPIMsg, gtReadAPIMsg
+from gtdefs import (GT_OP_SUCCESS, OP_SYSINFO, OP_SET_GEO, OP_GET_GEO,
+                    OP_SENDMSG, OP_READMSG, OP_NEXTMSG, API_TLV_REGION,
+                    MSG_CLASS_SHOUT)
+
+try:
+    import gtdevice  # noqa: F401
+    from gtsim import gtSimDev
+except ImportError:
+    gtSimDev = None
+
+
+class radioTest(unittest.TestCase):
+
+    def setUp(self):
+        self.radio = gtSimRadio(loopback=True)
+        self.radio.notify = self.notify
+        self.decoder = gtFrameDecoder()
+        self.results = []
+        self.mwi = []
+
+    def notify(self, hnd, data):
+        if hnd == SIM_HND_ST:
+            self.mwi.append(data)
+        else:
+            self.assertEqual(hnd, SIM_HND_RX)
+            self.assertLessEqual(len(data), 20)
+            self.results.extend(bytes(pdu) for pdu in self.decoder.feed(data))
+
+    def command(self, opcode, data=b'', seq=1):
+        for frag in gtFragments(gtEncodeFrame(opcode, seq, data)):
+            self.radio.write(SIM_HND_TX, bytes(frag))
+        pdu = self.results.pop(0)
+        self.assertEqual(pdu[1], seq)
+        return pdu[0] ^ opcode, pdu[2:]
+
+    def test_commands(self):
+        self.assertEqual(self.command(OP_SYSINFO, seq=0x10),
+                         (GT_OP_SUCCESS, SIM_SYSINFO))
+        self.assertEqual(self.command(OP_SET_GEO, b'\x00'),
+                         (SIM_OP_FAILED, b''))
+        self.assertEqual(self.command(OP_SET_GEO,
+                                      pack('BBB', API_TLV_REGION, 1, 2)),
+                         (GT_OP_SUCCESS, b''))
+        self.assertEqual(self.command(OP_GET_GEO),
+                         (GT_OP_SUCCESS, pack('BBB', API_TLV_REGION, 1, 2)))
+        self.assertEqual(self.command(0x3e), (SIM_OP_FAILED, b''))
+        self.assertEqual(self.radio.commands, 5)
+
+    def test_loopback(self):
+        msgPDU = gtMakeAPIMsg(b'echo', MSG_CLASS_SHOUT, 0x3fff, 0x1234)
+        self.assertEqual(self.command(OP_SENDMSG, msgPDU),
+                         (GT_OP_SUCCESS, b''))
+        self.assertEqual(self.radio.sent, [msgPDU])
+        self.assertGreater(self.radio.airtime(), 0)
+        self.assertEqual(self.mwi, [b'\x01'])
+
+        (code, data) = self.command(OP_READMSG)
+        self.assertEqual(code, GT_OP_SUCCESS)
+        msg = gtReadAPIMsg(data)
+        self.assertEqual((msg['msgBlob'], msg['meshHops']), (b'echo', 1))
+        self.assertEqual(self.command(OP_NEXTMSG), (GT_OP_SUCCESS, b''))
+        self.assertEqual(self.mwi, [b'\x01', b'\x00'])
+        self.assertEqual(self.command(OP_READMSG), (SIM_OP_FAILED, b''))
+        # not a valid message
+        self.assertEqual(self.command(OP_SENDMSG, b'\x00\x01'),
+                         (SIM_OP_FAILED, b''))
+
+
+@unittest.skipIf(gtSimDev is None, "bluepy not installed")
+class simDevTest(unittest.TestCase):
+
+    def test_execute(self):
+        radio = gtSimRadio()
+        dev = gtSimDev(radio)
+        self.assertTrue(dev.initialize())
+        self.assertEqual((dev.hndSt, dev.hndTx, dev.hndRx),
+                         (SIM_HND_ST, SIM_HND_TX, SIM_HND_RX))
+        for i in range(300):
+            self.assertEqual(dev.execute(OP_SYSINFO),
+                             (GT_OP_SUCCESS, SIM_SYSINFO))
+        radio.receive(gtMakeAPIMsg(b'in', MSG_CLASS_SHOUT, 0x3fff, 0x99))
+        dev.execute(OP_SYSINFO)     # pumps the MWI notification
+        self.assertEqual(dev.mwi, 1)
+        dev.disconnect()
+
+
+if __name__ == '__main__':
+    unittest.main()
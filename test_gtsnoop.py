@@ -0,0 +1,113 @@
+#!/usr/bin/python
+
+""" Tests for resuming gtsnoop from a checkpoint on a growing log """
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+import gtsnoop
+from gtdefs import (OP_SYSINFO, OP_SET_GEO, OP_READMSG, GT_OP_SUCCESS,
+                    MSG_CLASS_SHOUT)
+from gtapiobj import gtMakeAPIMsg
+from gtframe import gtEncodeFrame, gtFragments
+from gtdedup import gtDedupCache
+from gtrecord import btSnoopHeader, btSnoopRecord
+from gtstats import gtSnoopStats
+
+
+def _capture(count, start=1000000):
+    """ btsnoop records of count command/response exchanges """
+    records = []
+    for i in range(count):
+        (op, seq) = ((OP_SYSINFO, OP_SET_GEO)[i % 2], i % 250 + 1)
+        t = start + i * 20000
+        for (flags, attOp, frame) in (
+                (0, 0x52, gtEncodeFrame(op, seq, b'\x10' * (i % 30))),
+                (1, 0x1d, gtEncodeFrame(GT_OP_SUCCESS | op, seq,
+                                        bytes(i % 40)))):
+            for frag in gtFragments(frame):
+                t += 1000
+                records.append(btSnoopRecord(flags, t, attOp, 0x25,
+                                             bytes(frag)))
+    return btSnoopHeader() + b''.join(records)
+
+
+class checkpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log = os.path.join(self.dir, 'btsnoop_hci.log')
+        self.cp = os.path.join(self.dir, 'checkpoint')
+
+    def tearDown(self):
+        gtsnoop.snoopStats = None
+        shutil.rmtree(self.dir)
+
+    def run_snoop(self, data, checkpoint=None):
+        with open(self.log, 'wb') as f:
+            f.write(data)
+        gtsnoop.snoopStats = gtSnoopStats(window=0.5)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            packets = gtsnoop.parseBTSnoop(self.log, checkpoint)
+        return (packets, out.getvalue())
+
+    def test_resume(self):
+        data = _capture(200)
+        (packets, full) = self.run_snoop(data)
+        # cuts inside frames and inside records
+        for cut in (len(data) // 3, len(data) // 2 + 7, len(data) * 4 // 5,
+                    len(data)):
+            (resumed, out) = self.run_snoop(data[:cut], self.cp)
+        self.assertIn("Resuming", out)
+        self.assertEqual(resumed, packets)
+        self.assertEqual(out.split("\n", 1)[1], full)
+
+    def test_rotated(self):
+        data = _capture(100)
+        self.run_snoop(data, self.cp)
+        # replaced by a newer log, longer than the checkpoint offset
+        (packets, out) = self.run_snoop(_capture(110, 5000000), self.cp)
+        self.assertIn("Log changed", out)
+        self.assertNotIn("Resuming", out)
+        self.assertEqual(gtsnoop.snoopStats.pdus, 220)
+        # different options
+        gtsnoop.dedupCache = gtDedupCache()
+        try:
+            (packets, out) = self.run_snoop(_capture(120, 5000000), self.cp)
+        finally:
+            gtsnoop.dedupCache = None
+        self.assertNotIn("Resuming", out)
+        self.assertEqual(gtsnoop.snoopStats.pdus, 240)
+
+
+class dissectTest(unittest.TestCase):
+
+    def tearDown(self):
+        gtsnoop.dedupCache = None
+
+    def dissect(self, pdu):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            gtsnoop.pduDissect(pdu)
+        return out.getvalue()
+
+    def test_malformed_readmsg(self):
+        # a READMSG result which doesn't parse as a message
+        pdu = bytes([GT_OP_SUCCESS | OP_READMSG, 1, 0x05, 0x09, 1, 2, 3])
+        gtsnoop.dedupCache = gtDedupCache()
+        self.assertIn("OP_READMSG OK", self.dissect(pdu))
+        self.assertEqual(gtsnoop.dedupCache.stats()['dups'], 0)
+
+    def test_duplicate_readmsg(self):
+        pdu = (bytes([GT_OP_SUCCESS | OP_READMSG, 1]) +
+               gtMakeAPIMsg(b'hi', MSG_CLASS_SHOUT, 0x3fff, 0x1234))
+        gtsnoop.dedupCache = gtDedupCache()
+        self.assertNotIn("DUPLICATE", self.dissect(pdu))
+        self.assertIn("DUPLICATE", self.dissect(pdu))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+
+""" Tests for the SYSINFO/GEO decoders and the device state cache
+    (the latter on a simulated device, which needs bluepy)
+"""
+
+import time
+import unittest
+from struct import pack, calcsize
+
+from gtdefs import (API_TLV_REGION, GT_REGION_EU, GT_REGION_US, OP_SET_GEO,
+                    OP_SET_GID, OP_RST_GID, SYSINFO_LEN, SYSINFO_FIELDS)
+from gtstate import (gtReadSysInfo, gtGuessSysInfo, gtReadRegion,
+                     gtDeviceState)
+
+try:
+    import gtdevice  # noqa: F401
+    from gtsim import gtSimDev, gtSimRadio, SIM_SYSINFO
+except ImportError:
+    gtSimDev = None
+
+
+class decoderTest(unittest.TestCase):
+
+    def test_sysinfo(self):
+        # kept as is, whatever the length
+        data = bytearray(range(SYSINFO_LEN))
+        self.assertEqual(gtReadSysInfo(data), bytes(data))
+        self.assertEqual(gtReadSysInfo(b'\x01\x02'), b'\x01\x02')
+
+    def test_sysinfo_guess(self):
+        # the tentative layout only: each field from its own offset
+        data = bytes(SYSINFO_LEN)
+        for (name, offset, fmt) in SYSINFO_FIELDS:
+            self.assertLessEqual(offset + calcsize(fmt), SYSINFO_LEN, name)
+        info = gtGuessSysInfo(data)
+        self.assertEqual(set(info), set(f[0] for f in SYSINFO_FIELDS) |
+                         {'raw'})
+        self.assertEqual(info['raw'], data)
+        self.assertEqual(info['serial'], '')
+        short = gtGuessSysInfo(data[:4])
+        self.assertIsNone(short['charging'])
+        self.assertIsNone(short['serial'])
+
+    def test_region(self):
+        self.assertEqual(gtReadRegion(pack('BBB', API_TLV_REGION, 1, 2)),
+                         (GT_REGION_EU, "European Union"))
+        self.assertEqual(gtReadRegion(pack('BBB', API_TLV_REGION, 1, 3)),
+                         (3, "Unknown"))
+        self.assertIsNone(gtReadRegion(b''))
+        self.assertIsNone(gtReadRegion(pack('BB', API_TLV_REGION, 5)))
+
+
+@unittest.skipIf(gtSimDev is None, "bluepy not installed")
+class deviceStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.radio = gtSimRadio()
+        self.dev = gtSimDev(self.radio)
+        self.dev.initialize()
+
+    def tearDown(self):
+        self.dev.disconnect()
+
+    def test_ttl(self):
+        state = gtDeviceState(self.dev, ttl=0.2)
+        self.assertEqual(state.sysinfo(), SIM_SYSINFO)
+        self.assertEqual(state.region(), (GT_REGION_US, "North America"))
+        self.assertEqual(state.sysinfo(), SIM_SYSINFO)
+        self.assertEqual(state.stats()['queries'], 2)
+        time.sleep(0.25)
+        state.sysinfo()
+        self.assertEqual(state.stats()['queries'], 3)
+
+    def test_tracked_commands(self):
+        state = gtDeviceState(self.dev)
+        gid = pack('!Q', 0x123456789a)
+        self.dev.execute(OP_SET_GID, gid)
+        self.assertEqual(state.gid, gid)
+        self.dev.execute(OP_SET_GEO, pack('BBB', API_TLV_REGION, 1,
+                                          GT_REGION_EU))
+        self.assertEqual(state.region(wait=False)[0], GT_REGION_EU)
+        self.assertEqual(state.stats()['queries'], 0)
+        self.dev.execute(OP_RST_GID)
+        self.assertIsNone(state.gid)
+        state.close()
+
+    def test_background(self):
+        state = gtDeviceState(self.dev, ttl=60)
+        self.assertIsNone(state.sysinfo(wait=False))
+        state.startRefresh()
+        try:
+            deadline = time.monotonic() + 2
+            while state.sysinfo(wait=False) is None:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+            # commands from other threads share the I/O thread meanwhile
+            self.dev.execute(OP_SET_GID, b'\x01')
+            self.assertEqual(state.gid, b'\x01')
+        finally:
+            state.close()
+        self.assertEqual(state.region(wait=False)[0], GT_REGION_US)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+
+""" Tests for the incremental protocol statistics (gtstats) """
+
+import unittest
+from struct import pack
+
+from gtdefs import GT_OP_SUCCESS, OP_SYSINFO, OP_SET_GEO
+from gtstats import gtSnoopStats
+
+
+def cmd(opcode, seq, data=b''):
+    return pack('BB', opcode, seq) + data
+
+
+def res(opcode, seq, code=GT_OP_SUCCESS, data=b''):
+    return pack('BB', code | opcode, seq) + data
+
+
+class statsTest(unittest.TestCase):
+
+    def test_latency_pairing(self):
+        stats = gtSnoopStats()
+        stats.feed(cmd(OP_SYSINFO, 1), 10.0)
+        stats.feed(cmd(OP_SYSINFO, 2), 10.1)
+        stats.feed(res(OP_SYSINFO, 2), 10.104)
+        stats.feed(res(OP_SYSINFO, 1), 10.3)
+        s = stats.ops[OP_SYSINFO]
+        self.assertEqual((s.commands, s.ok, s.latN), (2, 2, 2))
+        self.assertAlmostEqual(s.latMin, 0.004)
+        self.assertAlmostEqual(s.latMax, 0.3)
+        self.assertEqual(s.percentile(50), 0.005)
+        self.assertAlmostEqual(s.percentile(99), 0.3)
+
+    def test_errors_and_retries(self):
+        stats = gtSnoopStats()
+        stats.feed(cmd(OP_SET_GEO, 1, b'\x1f\x01\x09'), 0)
+        stats.feed(res(OP_SET_GEO, 1, 0x80), 0.01)
+        stats.feed(cmd(OP_SET_GEO, 2, b'\x1f\x01\x09'), 0.02)
+        # no response to seq 2 before it is reused
+        stats.feed(cmd(OP_SYSINFO, 2), 0.03)
+        stats.feed(res(OP_SYSINFO, 3), 0.04)
+        stats.feed(res(OP_SET_GEO, 2), 0.05)
+        s = stats.ops[OP_SET_GEO]
+        self.assertEqual((s.failed, s.codes, s.retries, s.unanswered),
+                         (1, {0x80: 1}, 1, 1))
+        self.assertEqual((stats.orphans, stats.mismatched), (1, 1))
+
+    def test_windows_bounded(self):
+        stats = gtSnoopStats(window=1.0, maxWindows=5)
+        closed = []
+        stats.onWindow = lambda start, counters: closed.append(counters)
+        for i in range(1000):
+            stats.feed(cmd(OP_SYSINFO, i % 255 + 1), i * 0.1)
+            stats.feed(res(OP_SYSINFO, i % 255 + 1), i * 0.1 + 0.01)
+            stats.mwiUpdate(i % 20 < 10, i * 0.1)
+        stats.finish()
+        self.assertEqual(len(stats.windows), 5)
+        self.assertEqual(len(closed), 100)
+        self.assertEqual(sum(c['commands'] for c in closed), 1000)
+        self.assertEqual(stats.mwi, 50)
+        self.assertLessEqual(len(stats.pending), 256)
+        self.assertTrue(stats.report())
+
+
+if __name__ == '__main__':
+    unittest.main()
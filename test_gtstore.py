@@ -0,0 +1,184 @@
+#!/usr/bin/python
+
+""" Tests for the received message store (gtstore) """
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gtstore import gtMsgStore
+from gtapiobj import gtReadAPIMsg
+from gtcodec import gtEncodeMsg
+from gtdefs import (GT_OP_SUCCESS, OP_READMSG, OP_SYSINFO, MSG_CLASS_SHOUT,
+                    MSG_CLASS_P2P)
+from gtframe import gtEncodeFrame, gtFragments
+from gtrecord import btSnoopHeader, btSnoopRecord, BTSNOOP_EPOCH_DELTA
+
+try:
+    import gtdevice  # noqa: F401
+    from gtsim import gtSimDev, gtSimRadio
+except ImportError:
+    gtSimDev = None
+
+
+def _msgPDU(blob, fromGID, tstamp, msgClass=MSG_CLASS_SHOUT, destGID=0):
+    return gtEncodeMsg(blob, msgClass, 0x3fff, fromGID, destGID,
+                       tstamp=tstamp)
+
+
+def _msg(blob, fromGID, tstamp, **kwargs):
+    return gtReadAPIMsg(_msgPDU(blob, fromGID, tstamp, **kwargs))
+
+
+class storeTest(unittest.TestCase):
+
+    def test_query(self):
+        store = gtMsgStore(batchSize=1000)
+        store.add(_msg(b'one', 0x111, 1000))
+        store.add(_msg(b'two', 0x222, 1010, msgClass=MSG_CLASS_P2P,
+                       destGID=0x999))
+        store.add(_msg(b'three', 0x111, 1005), rxtime=5.)
+        # still batched, but queries see everything
+        self.assertEqual(len(store.pending), 3)
+        self.assertEqual(store.count(), 3)
+
+        msgs = store.query()
+        self.assertEqual([m['msgBlob'] for m in msgs],
+                         [b'one', b'three', b'two'])
+        self.assertEqual(msgs[1]['rxtime'], 5.)
+        self.assertNotIn('destGID', msgs[0])
+        self.assertEqual(msgs[2]['destGID'], 0x999)
+        self.assertEqual(msgs[0]['hashID'], _msg(b'one', 0x111,
+                                                 1000)['hashID'])
+
+        self.assertEqual([m['msgBlob'] for m in store.query(fromGID=0x111)],
+                         [b'one', b'three'])
+        self.assertEqual([m['msgBlob'] for m in
+                          store.query(since=1001, until=1010)],
+                         [b'three', b'two'])
+        self.assertEqual(len(store.query(limit=1, fromGID=0x111)), 1)
+        self.assertEqual(store.query(classID=MSG_CLASS_P2P,
+                                     destGID=0x111), [])
+        with self.assertRaises(ValueError):
+            store.query(msgBlob=b'one')
+
+    def test_u64_gids(self):
+        store = gtMsgStore()
+        for gid in (1 << 63, (1 << 64) - 1, 0x111):
+            store.add(_msg(b'%x' % gid, gid, 1000))
+        self.assertEqual([m['fromGID'] for m in store.query()],
+                         [1 << 63, (1 << 64) - 1, 0x111])
+        self.assertEqual([m['msgBlob'] for m in
+                          store.query(fromGID=1 << 63)], [b'8000000000000000'])
+
+    def test_failed_batch(self):
+        store = gtMsgStore(batchSize=2)
+        store.add(_msg(b'before', 0x111, 1000))
+        bad = dict(_msg(b'bad', 0x111, 1000), tstamp=1 << 70)
+        with self.assertRaises(OverflowError):
+            store.add(bad)
+        # that batch is gone, the store still works
+        store.add(_msg(b'after', 0x111, 1000))
+        self.assertEqual([m['msgBlob'] for m in store.query()], [b'after'])
+
+    def test_zero_times(self):
+        store = gtMsgStore()
+        store.add(_msg(b'zero', 0x111, 1000), rxtime=0)
+        self.assertEqual(store.query()[0]['rxtime'], 0)
+        self.assertEqual(store.compact(10, now=0), 0)
+
+    def test_batches_and_compact(self):
+        store = gtMsgStore(batchSize=10)
+        store.addMany(_msg(b'%d' % i, 0x111, 1000 + i) for i in range(25))
+        self.assertEqual(store.pending, [])
+        self.assertEqual(store.count(), 25)
+        self.assertEqual(store.compact(10, now=1020), 10)
+        self.assertEqual(store.query(limit=1)[0]['tstamp'], 1010)
+        self.assertEqual(store.compact(10, now=1020, vacuum=True), 0)
+
+    def test_persistent(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'msgs.db')
+            store = gtMsgStore(path)
+            store.add(_msg(b'kept', 0x111, 1000))
+            store.close()
+            self.assertEqual(gtMsgStore(path).query()[0]['msgBlob'],
+                             b'kept')
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_feed(self):
+        store = gtMsgStore()
+        msgPDU = _msgPDU(b'fed', 0x333, 1000)
+        store.feedPDU(bytes([GT_OP_SUCCESS | OP_READMSG, 1]) + msgPDU)
+        # not a message, a failed read, a malformed message
+        store.feedPDU(bytes([GT_OP_SUCCESS | OP_SYSINFO, 2]) + msgPDU)
+        store.feedPDU(bytes([0x80 | OP_READMSG, 3]) + msgPDU)
+        store.feedPDU(bytes([GT_OP_SUCCESS | OP_READMSG, 4]) + msgPDU[:-6])
+        self.assertEqual([m['msgBlob'] for m in store.query()], [b'fed'])
+
+    def test_load_snoop(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp, 'capture.log')
+            with open(filename, 'wb') as f:
+                f.write(btSnoopHeader())
+                t = BTSNOOP_EPOCH_DELTA + 1500000000 * 1000000
+                for i in range(3):
+                    frame = gtEncodeFrame(GT_OP_SUCCESS | OP_READMSG, i + 1,
+                                          _msgPDU(b'%d' % i, 0x444, 1000 + i))
+                    for frag in gtFragments(frame):
+                        t += 1000
+                        f.write(btSnoopRecord(1, t, 0x1d, 0x28, bytes(frag)))
+            store = gtMsgStore()
+            store.loadSnoop(filename)
+            msgs = store.query()
+            self.assertEqual([m['msgBlob'] for m in msgs],
+                             [b'0', b'1', b'2'])
+            # stamped with the capture time of the last fragment
+            self.assertEqual(msgs[-1]['rxtime'],
+                             (t - BTSNOOP_EPOCH_DELTA) / 1000000.)
+            self.assertGreater(msgs[-1]['rxtime'], msgs[0]['rxtime'])
+        finally:
+            shutil.rmtree(tmp)
+
+    @unittest.skipIf(gtSimDev is None, "bluepy not installed")
+    def test_attach(self):
+        radio = gtSimRadio()
+        dev = gtSimDev(radio)
+        dev.initialize()
+        store = gtMsgStore()
+        store.attach(dev)
+        radio.receive(_msgPDU(b'live', 0x555, 1000))
+        dev.execute(OP_READMSG)
+        dev.execute(OP_READMSG)     # same message, read again
+        dev.disconnect()
+        msgs = store.query()
+        self.assertEqual([m['msgBlob'] for m in msgs], [b'live', b'live'])
+        self.assertEqual(msgs[0]['meshHops'], 1)
+
+    @unittest.skipIf(gtSimDev is None, "bluepy not installed")
+    def test_attach_failure(self):
+        radio = gtSimRadio()
+        dev = gtSimDev(radio)
+        dev.initialize()
+        dev.startIO()
+        store = gtMsgStore()
+        store.attach(dev)
+
+        def failing(msg, rxtime=None):
+            raise OverflowError("store failed")
+
+        store.add = failing
+        radio.receive(_msgPDU(b'live', 0x555, 1000))
+        # the command still succeeds, and the I/O thread carries on
+        self.assertEqual(dev.execute(OP_READMSG)[0], GT_OP_SUCCESS)
+        self.assertIsNone(dev.ioError)
+        self.assertEqual(dev.execute(OP_READMSG)[0], GT_OP_SUCCESS)
+        dev.disconnect()
+
+
+if __name__ == '__main__':
+    unittest.main()
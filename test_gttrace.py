@@ -0,0 +1,113 @@
+#!/usr/bin/python
+
+""" Tests for the tracing hooks (gttrace), standalone and on a simulated
+    device (the latter needs bluepy)
+"""
+
+import logging
+import unittest
+
+from gttrace import gtTrace, gtTraceLogger, hexDump, GT_TRACE_HOOKS
+from gtdefs import GT_OP_SUCCESS, OP_SYSINFO
+
+try:
+    import gtdevice  # noqa: F401
+    from gtsim import gtSimDev, gtSimRadio, SIM_SYSINFO
+except ImportError:
+    gtSimDev = None
+
+
+class listHandler(logging.Handler):
+    """ Keeps the formatted records """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append((record.levelno, record.getMessage()))
+
+
+class traceTest(unittest.TestCase):
+
+    def test_subscribe(self):
+        trace = gtTrace()
+        for hook in GT_TRACE_HOOKS:
+            self.assertEqual(getattr(trace, hook), [])
+        with self.assertRaises(ValueError):
+            trace.subscribe('on_nothing', print)
+
+        calls = []
+        func = lambda *args: calls.append(args)   # noqa: E731
+        trace.subscribe('on_pdu', func)
+        for hook in trace.on_pdu:
+            hook('rx', b'\x01')
+        trace.unsubscribe('on_pdu', func)
+        trace.unsubscribe('on_pdu', func)       # not subscribed: ignored
+        trace.unsubscribe('on_nothing', func)
+        self.assertEqual(trace.on_pdu, [])
+        self.assertEqual(calls, [('rx', b'\x01')])
+
+    def test_hexdump(self):
+        self.assertEqual(str(hexDump(b'\x00\x10\xff')), '0010ff')
+        self.assertEqual(str(hexDump(memoryview(bytearray(b'\xab')))), 'ab')
+
+    def test_logger(self):
+        trace = gtTrace()
+        logger = logging.getLogger('pyGT.test.trace')
+        logger.propagate = False
+        handler = listHandler()
+        logger.addHandler(handler)
+        try:
+            # level above DEBUG: only the CRC warning gets through
+            logger.setLevel(logging.INFO)
+            self.assertIs(gtTraceLogger(trace, logger), logger)
+            for hook in trace.on_command:
+                hook(0x04, 0x21, b'\x10\x02')
+            for hook in trace.on_crc_error:
+                hook(0x1234, 0x4321, b'\x03')
+            logger.setLevel(logging.DEBUG)
+            for hook in trace.on_result:
+                hook(0x04, GT_OP_SUCCESS, 0x21, b'\xaa')
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(handler.lines, [
+            (logging.WARNING, "CRC failed, want=1234, have=4321 for 03"),
+            (logging.DEBUG, "RES(21): %02x aa" % GT_OP_SUCCESS)])
+
+    def test_logger_hooks(self):
+        trace = gtTrace()
+        gtTraceLogger(trace, logging.getLogger('pyGT.test.trace'),
+                      ('on_pdu', ))
+        self.assertEqual(len(trace.on_pdu), 1)
+        self.assertEqual(trace.on_command, [])
+
+
+@unittest.skipIf(gtSimDev is None, "bluepy not installed")
+class deviceTraceTest(unittest.TestCase):
+
+    def test_command_path(self):
+        dev = gtSimDev(gtSimRadio())
+        dev.initialize()
+        events = []
+        for hook in GT_TRACE_HOOKS:
+            dev.trace.subscribe(hook, lambda *args, hook=hook:
+                                events.append((hook, ) + args))
+        (code, data) = dev.execute(OP_SYSINFO)
+        dev.disconnect()
+        self.assertEqual((code, data), (GT_OP_SUCCESS, SIM_SYSINFO))
+
+        hooks = [e[0] for e in events]
+        # command, its PDU and fragments out; fragments, PDU and result in
+        self.assertEqual(hooks[:2], ['on_command', 'on_pdu'])
+        self.assertEqual(events[1][1], 'tx')
+        self.assertEqual(hooks[-2:], ['on_pdu', 'on_result'])
+        self.assertEqual(events[-2][1], 'rx')
+        self.assertEqual(events[-1], ('on_result', OP_SYSINFO, GT_OP_SUCCESS,
+                                      events[0][2], SIM_SYSINFO))
+        self.assertIn('on_tx_fragment', hooks)
+        self.assertGreater(hooks.count('on_rx_fragment'), 1)
+        self.assertNotIn('on_crc_error', hooks)
+
+
+if __name__ == '__main__':
+    unittest.main()